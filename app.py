@@ -1,21 +1,42 @@
-from flask import Flask, render_template, request, make_response, redirect, url_for, session, jsonify
-from pipeline import run_pipeline
+from flask import (
+    Flask, render_template, request, make_response, redirect, url_for, session, jsonify, abort,
+    get_template_attribute,
+)
+from pipeline import run_pipeline, classify_error, configure_genai, request_options, MAX_IMAGE_SIDE
+from ratelimit import admit, report_quota_error, RateLimited, CHAT
+from config import get_secret_key, TTS_RESERVE_SECONDS, RESULT_PAGE_TTL, AUDIO_CACHE_MAX_AGE
+from shared_cache import cache_key, file_digest
+import shared_cache
+import telemetry
+import deadline
+import singleflight
+import usage
+import tts
+import capture
 import time
-# from gtts import gTTS # Lazy load this!
-import json, os, uuid
+# gTTS is imported lazily by tts.py
+import gzip, json, os, secrets, uuid
 
 app = Flask(__name__)
 
 # --- DIAGNOSTIC: Moved to route ---
 # Keeping startup fast and non-blocking.
 # --- DIAGNOSTIC END ---
-app.secret_key = os.urandom(24) # Generates new key on every restart -> Invalidates all old sessions
+app.secret_key = get_secret_key() # Same key in every worker and across restarts
+capture.install() # Record Gemini/gTTS calls when CAPTURE_ENABLED is set
 
 UPLOAD_FOLDER = "uploads"
 AUDIO_FOLDER = "static/audio"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(AUDIO_FOLDER, exist_ok=True)
 
+# Upload formats saved with their own extension (browser sends WebP/JPEG after downscaling)
+UPLOAD_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/png": ".png",
+}
+
 # UI Translations
 TRANSLATIONS = {
     "English": {
@@ -66,6 +87,12 @@ TRANSLATIONS = {
         "error_blurry": "📸 Photo is blurry. Please hold steady and try again.",
         "error_dark": "📸 Photo is too dark. Try in better light.",
         "error_read_fail": "🔄 Could not read the prescription. Please try again.",
+        "error_timeout": "⏱️ This is taking too long. Please try again in a minute.",
+        "retake_too_dark": "📷 The photo is too dark. Please retake it in good light.",
+        "retake_too_bright": "📷 The photo is too bright. Please retake it away from direct light or glare.",
+        "retake_blurry": "📷 The photo is blurry. Hold the phone steady and retake it.",
+        "retake_no_text": "📷 We couldn't find any writing in this photo. Please photograph the prescription.",
+        "error_busy": "⏳ Our AI is busy right now. Please try again in {seconds} seconds.",
         "error_retry": "Try Again",
         "error_manual_fallback": "Can't scan? Type medicine name and ask AI",
         "role_myself": "Myself",
@@ -75,6 +102,7 @@ TRANSLATIONS = {
         "role_new_placeholder": "Name (or say it)",
         "role_save": "Save",
         "filter_all": "All",
+        "history_search": "Search medicine",
         "tts_morning": "in the morning",
         "tts_afternoon": "in the afternoon",
         "tts_night": "at night",
@@ -162,6 +190,12 @@ TRANSLATIONS = {
         "error_blurry": "📸 फोटो धुंधली है। कृपया स्थिर रखें और फिर से कोशिश करें।",
         "error_dark": "📸 फोटो बहुत अंधेरी है। बेहतर रोशनी में कोशिश करें।",
         "error_read_fail": "🔄 दवाई पढ़ नहीं पाई। कृपया फिर से कोशिश करें।",
+        "error_timeout": "⏱️ इसमें बहुत समय लग रहा है। कृपया एक मिनट बाद फिर से कोशिश करें।",
+        "retake_too_dark": "📷 फोटो बहुत अंधेरी है। कृपया अच्छी रोशनी में फिर से फोटो लें।",
+        "retake_too_bright": "📷 फोटो में बहुत ज़्यादा चमक है। कृपया सीधी रोशनी से हटकर फिर से फोटो लें।",
+        "retake_blurry": "📷 फोटो धुंधली है। फोन को स्थिर पकड़कर फिर से फोटो लें।",
+        "retake_no_text": "📷 इस फोटो में कोई लिखावट नहीं मिली। कृपया पर्चे की फोटो लें।",
+        "error_busy": "⏳ अभी हमारी AI व्यस्त है। कृपया {seconds} सेकंड बाद फिर से कोशिश करें।",
         "error_retry": "फिर से कोशिश करें",
         "error_manual_fallback": "स्कैन नहीं हो रहा? दवाई का नाम लिखें और AI से पूछें",
         "role_myself": "मैं",
@@ -171,6 +205,7 @@ TRANSLATIONS = {
         "role_new_placeholder": "नाम लिखें (या बोलें)",
         "role_save": "सहेजें",
         "filter_all": "सब",
+        "history_search": "दवा खोजें",
         "tts_morning": "सुबह",
         "tts_afternoon": "दोपहर को",
         "tts_night": "रात को",
@@ -258,6 +293,12 @@ TRANSLATIONS = {
         "error_blurry": "📸 ಫೋಟೋ ಮಸುಕಾಗಿದೆ. ಸ್ಥಿರವಾಗಿ ಹಿಡಿದು ಮತ್ತೊಮ್ಮೆ ಪ್ರಯತ್ನಿಸಿ.",
         "error_dark": "📸 ಫೋಟೋ ತುಂಬಾ ಕತ್ತಲೆಯಾಗಿದೆ. ಉತ್ತಮ ಬೆಳಕಿನಲ್ಲಿ ಪ್ರಯತ್ನಿಸಿ.",
         "error_read_fail": "🔄 ಪ್ರಿಸ್ಕ್ರಿಪ್ಷನ್ ಓದಲಾಗಲಿಲ್ಲ. ದಯವಿಟ್ಟು ಮತ್ತೊಮ್ಮೆ ಪ್ರಯತ್ನಿಸಿ.",
+        "error_timeout": "⏱️ ಇದಕ್ಕೆ ತುಂಬಾ ಸಮಯ ಹಿಡಿಯುತ್ತಿದೆ. ದಯವಿಟ್ಟು ಒಂದು ನಿಮಿಷದ ನಂತರ ಮತ್ತೆ ಪ್ರಯತ್ನಿಸಿ.",
+        "retake_too_dark": "📷 ಫೋಟೋ ತುಂಬಾ ಕತ್ತಲಾಗಿದೆ. ದಯವಿಟ್ಟು ಉತ್ತಮ ಬೆಳಕಿನಲ್ಲಿ ಮತ್ತೆ ತೆಗೆಯಿರಿ.",
+        "retake_too_bright": "📷 ಫೋಟೋ ತುಂಬಾ ಪ್ರಕಾಶಮಾನವಾಗಿದೆ. ದಯವಿಟ್ಟು ನೇರ ಬೆಳಕಿನಿಂದ ದೂರ ಮತ್ತೆ ತೆಗೆಯಿರಿ.",
+        "retake_blurry": "📷 ಫೋಟೋ ಮಸುಕಾಗಿದೆ. ಫೋನ್ ಅನ್ನು ಸ್ಥಿರವಾಗಿ ಹಿಡಿದು ಮತ್ತೆ ತೆಗೆಯಿರಿ.",
+        "retake_no_text": "📷 ಈ ಫೋಟೋದಲ್ಲಿ ಯಾವುದೇ ಬರಹ ಕಾಣಲಿಲ್ಲ. ದಯವಿಟ್ಟು ಪ್ರಿಸ್ಕ್ರಿಪ್ಷನ್‌ನ ಫೋಟೋ ತೆಗೆಯಿರಿ.",
+        "error_busy": "⏳ ನಮ್ಮ AI ಈಗ ಕಾರ್ಯನಿರತವಾಗಿದೆ. ದಯವಿಟ್ಟು {seconds} ಸೆಕೆಂಡುಗಳ ನಂತರ ಮತ್ತೆ ಪ್ರಯತ್ನಿಸಿ.",
         "error_retry": "ಮತ್ತೊಮ್ಮೆ ಪ್ರಯತ್ನಿಸಿ",
         "error_manual_fallback": "ಸ್ಕ್ಯಾನ್ ಆಗುತ್ತಿಲ್ಲ? ಔಷಧಿ ಹೆಸರು ಟೈಪ್ ಮಾಡಿ AI ಗೆ ಕೇಳಿ",
         "role_myself": "ನಾನು",
@@ -267,6 +308,7 @@ TRANSLATIONS = {
         "role_new_placeholder": "ಹೆಸರು (ಅಥವಾ ಹೇಳಿ)",
         "role_save": "ಉಳಿಸಿ",
         "filter_all": "ಎಲ್ಲಾ",
+        "history_search": "ಔಷಧಿ ಹುಡುಕಿ",
         "tts_morning": "ಬೆಳಿಗ್ಗೆ",
         "tts_afternoon": "ಮಧ್ಯಾಹ್ನ",
         "tts_night": "ರಾತ್ರಿ",
@@ -354,6 +396,12 @@ TRANSLATIONS = {
         "error_blurry": "📸 புகைப்படம் மங்கலாக உள்ளது. நிலையாக பிடித்து மீண்டும் முயற்சிக்கவும்.",
         "error_dark": "📸 புகைப்படம் மிகவும் இருட்டாக உள்ளது. நல்ல வெளிச்சத்தில் முயற்சிக்கவும்.",
         "error_read_fail": "🔄 மருந்து சீட்டை படிக்க முடியவில்லை. மீண்டும் முயற்சிக்கவும்.",
+        "error_timeout": "⏱️ இது அதிக நேரம் எடுக்கிறது. ஒரு நிமிடம் கழித்து மீண்டும் முயற்சிக்கவும்.",
+        "retake_too_dark": "📷 புகைப்படம் மிகவும் இருட்டாக உள்ளது. நல்ல வெளிச்சத்தில் மீண்டும் எடுக்கவும்.",
+        "retake_too_bright": "📷 புகைப்படம் மிகவும் பிரகாசமாக உள்ளது. நேரடி வெளிச்சத்திலிருந்து விலகி மீண்டும் எடுக்கவும்.",
+        "retake_blurry": "📷 புகைப்படம் மங்கலாக உள்ளது. போனை அசையாமல் பிடித்து மீண்டும் எடுக்கவும்.",
+        "retake_no_text": "📷 இந்த புகைப்படத்தில் எழுத்து எதுவும் இல்லை. மருந்து சீட்டை புகைப்படம் எடுக்கவும்.",
+        "error_busy": "⏳ எங்கள் AI இப்போது பிஸியாக உள்ளது. {seconds} விநாடிகளில் மீண்டும் முயற்சிக்கவும்.",
         "error_retry": "மீண்டும் முயற்சிக்கவும்",
         "error_manual_fallback": "ஸ்கேன் ஆகவில்லையா? மருந்து பெயரை டைப் செய்து AI யிடம் கேளுங்கள்",
         "role_myself": "நான்",
@@ -363,6 +411,7 @@ TRANSLATIONS = {
         "role_new_placeholder": "பெயர் (அல்லது சொல்லுங்கள்)",
         "role_save": "சேமி",
         "filter_all": "அனைத்தும்",
+        "history_search": "மருந்தைத் தேடுங்கள்",
         "tts_morning": "காலை",
         "tts_afternoon": "மதியம்",
         "tts_night": "இரவு",
@@ -450,6 +499,12 @@ TRANSLATIONS = {
         "error_blurry": "📸 ఫోటో అస్పష్టంగా ఉంది. స్థిరంగా పట్టుకుని మళ్లీ ప్రయత్నించండి.",
         "error_dark": "📸 ఫోటో చాలా చీకటిగా ఉంది. మంచి వెలుతురులో ప్రయత్నించండి.",
         "error_read_fail": "🔄 ప్రిస్క్రిప్షన్ చదవలేకపోయాము. దయచేసి మళ్లీ ప్రయత్నించండి.",
+        "error_timeout": "⏱️ దీనికి చాలా సమయం పడుతోంది. దయచేసి ఒక నిమిషం తర్వాత మళ్ళీ ప్రయత్నించండి.",
+        "retake_too_dark": "📷 ఫోటో చాలా చీకటిగా ఉంది. దయచేసి మంచి వెలుతురులో మళ్ళీ తీయండి.",
+        "retake_too_bright": "📷 ఫోటో చాలా ప్రకాశవంతంగా ఉంది. దయచేసి నేరుగా పడే వెలుతురు నుండి దూరంగా మళ్ళీ తీయండి.",
+        "retake_blurry": "📷 ఫోటో మసకగా ఉంది. ఫోన్‌ను కదలకుండా పట్టుకుని మళ్ళీ తీయండి.",
+        "retake_no_text": "📷 ఈ ఫోటోలో ఎలాంటి రాత కనిపించలేదు. దయచేసి ప్రిస్క్రిప్షన్ ఫోటో తీయండి.",
+        "error_busy": "⏳ మా AI ప్రస్తుతం బిజీగా ఉంది. {seconds} సెకన్ల తర్వాత మళ్ళీ ప్రయత్నించండి.",
         "error_retry": "మళ్లీ ప్రయత్నించండి",
         "error_manual_fallback": "స్కాన్ కావడం లేదా? మందు పేరు టైప్ చేసి AI ని అడగండి",
         "role_myself": "నేను",
@@ -459,6 +514,7 @@ TRANSLATIONS = {
         "role_new_placeholder": "పేరు (లేదా చెప్పండి)",
         "role_save": "సేవ్",
         "filter_all": "అన్ని",
+        "history_search": "మందును వెతకండి",
         "tts_morning": "ఉదయం",
         "tts_afternoon": "మధ్యాహ్నం",
         "tts_night": "రాత్రి",
@@ -546,6 +602,12 @@ TRANSLATIONS = {
         "error_blurry": "📸 ഫോട്ടോ മങ്ങിയതാണ്. സ്ഥിരമായി പിടിച്ച് വീണ്ടും ശ്രമിക്കുക.",
         "error_dark": "📸 ഫോട്ടോ വളരെ ഇരുട്ടാണ്. നല്ല വെളിച്ചത്തിൽ ശ്രമിക്കുക.",
         "error_read_fail": "🔄 പ്രിസ്ക്രിപ്ഷൻ വായിക്കാൻ കഴിഞ്ഞില്ല. ദയവായി വീണ്ടും ശ്രമിക്കുക.",
+        "error_timeout": "⏱️ ഇതിന് വളരെ സമയമെടുക്കുന്നു. ദയവായി ഒരു മിനിറ്റിന് ശേഷം വീണ്ടും ശ്രമിക്കുക.",
+        "retake_too_dark": "📷 ഫോട്ടോ വളരെ ഇരുണ്ടതാണ്. നല്ല വെളിച്ചത്തിൽ വീണ്ടും എടുക്കുക.",
+        "retake_too_bright": "📷 ഫോട്ടോയിൽ വളരെയധികം തിളക്കമുണ്ട്. നേരിട്ടുള്ള വെളിച്ചത്തിൽ നിന്ന് മാറി വീണ്ടും എടുക്കുക.",
+        "retake_blurry": "📷 ഫോട്ടോ മങ്ങിയതാണ്. ഫോൺ അനക്കാതെ പിടിച്ച് വീണ്ടും എടുക്കുക.",
+        "retake_no_text": "📷 ഈ ഫോട്ടോയിൽ എഴുത്തൊന്നും കണ്ടില്ല. ദയവായി പ്രിസ്ക്രിപ്ഷന്റെ ഫോട്ടോ എടുക്കുക.",
+        "error_busy": "⏳ ഞങ്ങളുടെ AI ഇപ്പോൾ തിരക്കിലാണ്. {seconds} സെക്കൻഡിന് ശേഷം വീണ്ടും ശ്രമിക്കുക.",
         "error_retry": "വീണ്ടും ശ്രമിക്കുക",
         "error_manual_fallback": "സ്കാന്‍ ആവുന്നില്ലേ? മരുന്നിന്റെ പേര് ടൈപ്പ് ചെയ്ത് AI യോട് ചോദിക്കൂ",
         "role_myself": "ഞാൻ",
@@ -555,6 +617,7 @@ TRANSLATIONS = {
         "role_new_placeholder": "പേര് (അല്ലെങ്കിൽ പറയൂ)",
         "role_save": "സേവ്",
         "filter_all": "എല്ലാം",
+        "history_search": "മരുന്ന് തിരയുക",
         "tts_morning": "രാവിലെ",
         "tts_afternoon": "ഉച്ചയ്ക്ക്",
         "tts_night": "രാത്രി",
@@ -596,110 +659,387 @@ TRANSLATIONS = {
     },
 }
 
-@app.route("/", methods=["GET", "POST"])
-def index():
+# Map Language to TTS language code (gTTS and espeak-ng)
+LANG_CODE_MAP = {
+    "Hindi": "hi",
+    "Tamil": "ta",
+    "Telugu": "te",
+    "Kannada": "kn",
+    "Malayalam": "ml",
+    "English": "en"
+}
+
+def build_audio_text(language, med_list, dangerous_combinations):
+    """Spoken summary of the prescription: one sentence group per medicine, then warnings"""
+    audio_text = f"Prescription Guide in {language}. "
+    
+    for med in med_list:
+        # Robust extraction with defaults
+        name = med.get('medicine_name') or med.get('name') or "Medicine"
+        purpose = med.get('purpose') or "As prescribed"
+        dosage = med.get('dosage') or "As directed"
+        timing = med.get('frequency') or med.get('timing') or ""
+        
+        audio_text += f"{name}. {purpose}. Dosage: {dosage}. {timing}. "
+
+    # Add interaction warnings to audio
+    if dangerous_combinations:
+        audio_text += "Warning! "
+        for combo in dangerous_combinations:
+            risk_text = combo.get('risk_translated') or combo.get('risk', '')
+            meds = combo.get('medicines', '')
+            audio_text += f"{meds}: {risk_text}. "
+    return audio_text
+
+def synthesize_speech(text, language, prefix=""):
+    """Write text as speech under static/audio and return the file name.
+    The same text + language reuses the file from any worker.
+    Returns None when the request has no time left for it."""
+    lang_code = LANG_CODE_MAP.get(language, "en")
+    key = cache_key(lang_code, text)
+    cached = shared_cache.audio.get(key)
+    if cached and os.path.exists(os.path.join(AUDIO_FOLDER, cached)):
+        observe_time_to_audio("cached")
+        return cached
+
+    if not deadline.allows(deadline.MIN_TTS_SECONDS):
+        print(f"⏱️ Deadline: {deadline.remaining():.1f}s left, skipping audio")
+        return None
+
+    audio_filename = singleflight.speech.do(key, render_speech, text, lang_code, prefix, key)
+    observe_time_to_audio("synthesized")
+    return audio_filename
+
+def observe_time_to_audio(source):
+    """Time to first audio: from the request's start (upload, scan, translation
+    included) until the file behind its audio URL exists"""
+    elapsed = telemetry.request_seconds()
+    if elapsed is not None:
+        tts.TTFA_SECONDS.observe(elapsed, request.endpoint or "unknown", source)
+
+def render_speech(text, lang_code, prefix, key):
+    with telemetry.span("tts"):
+        audio_filename = tts.synthesize(text, lang_code, AUDIO_FOLDER, prefix)
+        audio_filename = tts.transcode(AUDIO_FOLDER, audio_filename)
+    shared_cache.audio.set(key, audio_filename)
+    return audio_filename
+
+@app.before_request
+def start_trace():
+    telemetry.begin_request(request.headers.get("X-Request-ID"))
+    deadline.start()
+    capture.begin(request)
+
+@app.after_request
+def finish_trace(response):
+    response.headers["X-Request-ID"] = telemetry.request_id()
+    telemetry.end_request(request.endpoint, response.status_code)
+    capture.end(request, response, session.get("user_lang"))
+    return response
+
+@app.after_request
+def cache_audio(response):
+    """Generated audio never changes (every synthesis gets a new name): let the browser keep it.
+    Range requests (206) and ETag revalidation come from the static route itself."""
+    if request.endpoint == "static" and request.view_args.get("filename", "").startswith("audio/") \
+            and response.status_code in (200, 206, 304):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = AUDIO_CACHE_MAX_AGE
+    return response
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint (only when METRICS_ENABLED is set)"""
+    if not telemetry.ENABLED:
+        abort(404)
+    return telemetry.render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/usage")
+def usage_summary():
+    """Token use and estimated cost per day, endpoint, model and language (?days=7)"""
+    if not usage.ENABLED:
+        abort(404)
+    days = min(max(request.args.get("days", 1, type=int), 1), 90)
+    return jsonify(usage.summary(days))
+
+def session_language():
+    """UI language from the session, or None to show the Language Wall"""
     # Use session instead of cookies for stricter lifecycle
     user_lang = session.get("user_lang")
-    
-    # If no language is set, render the Language Wall
     if not user_lang:
-        return render_template("language.html")
+        return None
     
     # Default to English if session data is invalid
     if user_lang not in TRANSLATIONS and user_lang not in ["Hindi", "Kannada", "Tamil", "Telugu", "Malayalam"]:
         user_lang = "English"
+    return user_lang
+
+def empty_scan_result():
+    return {
+        "english": None,
+        "translated": None,
+        "dangerous_combinations": [],
+        "audio_path": None,
+        "error_type": None,
+        "retry_after": None,
+        "quality_issue": None,
+    }
+
+def save_upload():
+    """Save the posted photo under uploads/; returns its path, or None if nothing was sent"""
+    image = request.files.get("image") or request.files.get("image_camera")
+    if not image:
+        return None
+    ext = UPLOAD_EXTENSIONS.get(image.mimetype, ".jpg")
+    filename = f"{uuid.uuid4()}{ext}"
+    save_path = os.path.join(UPLOAD_FOLDER, filename)
+    image.save(save_path)
+    return save_path
+
+def cached_scan(save_path, language):
+    """Earlier pipeline result for this exact photo + language: (cache key, JSON or None)"""
+    image_key = cache_key(file_digest(save_path), language)
+    return image_key, shared_cache.results.get(image_key)
+
+def read_scan_result(result, raw_response, language, image_key, from_cache):
+    """Fill `result` from the pipeline JSON; returns the text to speak, or None"""
+    try:
+        data = json.loads(raw_response)
+        english = result["english"] = data.get("english", [])
+        translated = result["translated"] = data.get("translated", [])
+        dangerous_combinations = result["dangerous_combinations"] = data.get("dangerous_combinations", [])
+
+        if data.get("retry_after"):
+            result["error_type"] = "busy"
+            result["retry_after"] = data["retry_after"]
+        elif data.get("timed_out"):
+            result["error_type"] = "timeout"
+        elif data.get("quality"):
+            # Rejected by the quality gate before any model call
+            result["error_type"] = "quality"
+            result["quality_issue"] = data["quality"]
+        elif not english and not translated:
+            result["error_type"] = "no_medicines"
+        else:
+            if not from_cache and not data.get("error"):
+                shared_cache.results.set(image_key, raw_response)
+
+            # Determine which list to read (translated if available, else english)
+            med_list = translated if translated else english
+            return build_audio_text(language, med_list, dangerous_combinations)
+    
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Error parsing AI response: {e}")
+        result["error_type"] = "parse_error"
+    return None
+
+def render_index(user_lang, result, result_id=None):
+    with telemetry.span("render"):
+        return render_template(
+            "index.html",
+            english=result["english"],
+            translated=result["translated"],
+            dangerous_combinations=result["dangerous_combinations"],
+            language=user_lang,
+            audio_path=result["audio_path"],
+            texts=TRANSLATIONS.get(user_lang, TRANSLATIONS["English"]),
+            all_translations=TRANSLATIONS,
+            error_type=result["error_type"],
+            retry_after=result["retry_after"],
+            quality_issue=result.get("quality_issue"),
+            max_image_side=MAX_IMAGE_SIDE,
+            result_id=result_id
+        )
+
+def store_result(result, language):
+    """Keep a scan result for /r/<id>; returns the id, or None if the store is off or unavailable"""
+    result_id = secrets.token_urlsafe(8)
+    if shared_cache.pages.set(result_id, json.dumps({**result, "language": language})):
+        return result_id
+    return None
+
+def finish_scan(user_lang, result, language):
+    """POST-redirect-GET: store the result and send the browser to its permalink,
+    so reloads and shared links never re-run the pipeline.
+    Errors (busy, timeout, unreadable photo...) render in place: a reload should
+    retry them, not replay the error for RESULT_PAGE_TTL. So does a result the
+    store is off or unavailable for."""
+    result_id = None if result["error_type"] else store_result(result, language)
+    return scan_page(user_lang, result, result_id)
+
+def scan_page(user_lang, result, result_id):
+    """finish_scan()'s response once the result is stored (result_id) or not (None)"""
+    if result_id:
+        return redirect(url_for("show_result", result_id=result_id), code=303)
+    return render_index(user_lang, result)
+
+def scan_upload(result, save_path, language, speak=True):
+    """Read the saved photo into `result` (pipeline or cache), plus the audio guide if `speak`"""
+    try:
+        # 1. Run Pipeline (Returns JSON String) - unless this exact photo was already read
+        image_key, raw_response = cached_scan(save_path, language)
+        from_cache = raw_response is not None
+        if not from_cache:
+            # Leave time for the audio: without it the result still shows.
+            # The same photo submitted twice at once runs the pipeline once.
+            with telemetry.span("pipeline"), deadline.reserve(TTS_RESERVE_SECONDS), usage.attribute(language):
+                raw_response = singleflight.scans.do(image_key, run_pipeline, save_path, language)
         
-    texts = TRANSLATIONS.get(user_lang, TRANSLATIONS["English"])
-    english = None
-    translated = None
-    dangerous_combinations = []
-    audio_path = None
-    error_type = None
+        # 2. Parse, then 3. Generate Audio
+        audio_text = read_scan_result(result, raw_response, language, image_key, from_cache)
+        if audio_text and speak:
+            audio_filename = synthesize_speech(audio_text, language)
+            if audio_filename:
+                result["audio_path"] = f"audio/{audio_filename}"
+
+    except Exception as e:
+        print(f"Pipeline/API error: {e}")
+        result["error_type"] = "api_error"
+
+@app.route("/", methods=["GET", "POST"])
+def index():
+    user_lang = session_language()
+    
+    # If no language is set, render the Language Wall
+    if not user_lang:
+        return render_template("language.html")
+    
+    result = empty_scan_result()
 
     if request.method == "POST":
-        language = request.form.get("language")
         # Fallback if language not in form, use user_lang or default
-        if not language:
-            language = user_lang
-
-        image = request.files.get("image") or request.files.get("image_camera")
-        if image:
-            filename = f"{uuid.uuid4()}.jpg"
-            save_path = os.path.join(UPLOAD_FOLDER, filename)
-            image.save(save_path)
-            
-            try:
-                # 1. Run Pipeline (Returns JSON String)
-                raw_response = run_pipeline(save_path, language)
-                
-                try:
-                    data = json.loads(raw_response)
-                    english = data.get("english", [])
-                    translated = data.get("translated", [])
-                    dangerous_combinations = data.get("dangerous_combinations", [])
-
-                    if not english and not translated:
-                        error_type = "no_medicines"
-                    else:
-                        # 3. Generate Audio
-                        audio_text = f"Prescription Guide in {language}. "
-                        
-                        # Determine which list to read (translated if available, else english)
-                        med_list = translated if translated else english
-                        
-                        for med in med_list:
-                            # Robust extraction with defaults
-                            name = med.get('medicine_name') or med.get('name') or "Medicine"
-                            purpose = med.get('purpose') or "As prescribed"
-                            dosage = med.get('dosage') or "As directed"
-                            timing = med.get('frequency') or med.get('timing') or ""
-                            
-                            audio_text += f"{name}. {purpose}. Dosage: {dosage}. {timing}. "
-
-                        # Add interaction warnings to audio
-                        if dangerous_combinations:
-                            audio_text += "Warning! "
-                            for combo in dangerous_combinations:
-                                risk_text = combo.get('risk_translated') or combo.get('risk', '')
-                                meds = combo.get('medicines', '')
-                                audio_text += f"{meds}: {risk_text}. "
-
-                        # Map Language to GTTS Code
-                        lang_code_map = {
-                            "Hindi": "hi",
-                            "Tamil": "ta",
-                            "Telugu": "te",
-                            "Kannada": "kn",
-                            "Malayalam": "ml",
-                            "English": "en"
-                        }
-
-                        # Lazy load gTTS
-                        from gtts import gTTS
-                        tts = gTTS(text=audio_text, lang=lang_code_map.get(language, "en"))
-                        audio_filename = f"{uuid.uuid4()}.mp3"
-                        tts.save(os.path.join(AUDIO_FOLDER, audio_filename))
-                        audio_path = f"audio/{audio_filename}"
-                
-                except (json.JSONDecodeError, ValueError) as e:
-                    print(f"Error parsing AI response: {e}")
-                    error_type = "parse_error"
+        language = request.form.get("language") or user_lang
 
-            except Exception as e:
-                print(f"Pipeline/API error: {e}")
-                error_type = "api_error"
-
-    return render_template(
-        "index.html",
-        english=english,
-        translated=translated,
-        dangerous_combinations=dangerous_combinations,
-        language=user_lang,
-        audio_path=audio_path,
-        texts=texts,
-        all_translations=TRANSLATIONS,
-        error_type=error_type
-    )
+        save_path = save_upload()
+        if save_path:
+            scan_upload(result, save_path, language)
+            return finish_scan(user_lang, result, language)
+
+    return render_index(user_lang, result)
+
+# ===== JSON API =====
+# Same scan as the form, without the page: just the medicine lists
+
+API_FIELDS = ("english", "translated", "dangerous_combinations", "audio_url", "result_url", "html")
+API_DEFAULT_FIELDS = ("english", "translated", "dangerous_combinations")
+# Dropped from every medicine with warnings=0
+WARNING_FIELDS = ("warnings", "precautions")
+API_ERROR_STATUS = {"busy": 503, "timeout": 504, "quality": 422, "no_medicines": 422}
+# Smaller bodies aren't worth compressing
+GZIP_MIN_BYTES = 1024
+
+def compact_json(payload, status=200, headers=None):
+    """Minified UTF-8 JSON (Indic text as-is, not \\u escapes), gzipped if the client accepts it"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    response = make_response(body, status, headers or {})
+    response.mimetype = "application/json"
+    response.vary.add("Accept-Encoding")
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+def api_options():
+    """(language, fields, include_warnings) from the request, or (None, error response)"""
+    language = request.values.get("language") or session_language() or "English"
+    if language not in TRANSLATIONS:
+        return None, compact_json({"error": "unsupported_language"}, 400)
+    fields = request.values.get("fields")
+    fields = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(API_DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in API_FIELDS]
+    if unknown:
+        return None, compact_json({"error": "unknown_fields", "fields": unknown}, 400)
+    include_warnings = request.values.get("warnings", "1") not in ("0", "false", "no")
+    return (language, fields, include_warnings), None
+
+def api_result(result, language, fields, include_warnings):
+    """The scan result as a compact JSON response"""
+    error_type = result["error_type"]
+    if error_type:
+        payload = {"error": error_type}
+        headers = {}
+        if result["retry_after"]:
+            payload["retry_after"] = result["retry_after"]
+            headers["Retry-After"] = str(result["retry_after"])
+        if result.get("quality_issue"):
+            payload["quality_issue"] = result["quality_issue"]
+        return compact_json(payload, API_ERROR_STATUS.get(error_type, 502), headers)
+
+    payload = {"language": language}
+    for field in fields:
+        if field == "audio_url":
+            audio_path = result["audio_path"]
+            payload[field] = url_for("static", filename=audio_path) if audio_path else None
+        elif field == "result_url":
+            result_id = store_result(result, language)
+            payload[field] = url_for("show_result", result_id=result_id) if result_id else None
+        elif field == "dangerous_combinations":
+            payload[field] = result[field] or []
+        elif field == "html":
+            payload[field] = result_fragments(result)
+        else:
+            medicines = result[field] or []
+            if not include_warnings:
+                medicines = [{k: v for k, v in med.items() if k not in WARNING_FIELDS} for med in medicines]
+            payload[field] = medicines
+    return compact_json(payload)
+
+def result_fragments(result):
+    """The page's audio button, interaction warnings and medicine cards, rendered
+    with the same macros as index.html (labels in the session's language)"""
+    texts = TRANSLATIONS.get(session_language(), TRANSLATIONS["English"])
+    audio_url = url_for("static", filename=result["audio_path"]) if result["audio_path"] else None
+    with telemetry.span("render"):
+        return {
+            "audio": str(get_template_attribute("_results.html", "audio_control")(audio_url, texts)),
+            "interactions": str(get_template_attribute("_results.html", "interaction_warnings")(
+                result["dangerous_combinations"], texts)),
+            "cards": str(get_template_attribute("_results.html", "medicine_cards")(
+                result["translated"] or result["english"] or [], texts)),
+        }
+
+@app.route("/api/v1/analyze", methods=["POST"])
+def api_analyze():
+    """
+    Scan a photo and return only the medicines, as JSON.
+    Form fields: image, language (default: session language or English),
+    fields (comma list of API_FIELDS; audio_url also generates the audio guide,
+    html returns the page's rendered result parts),
+    warnings=0 to leave out each medicine's warnings/precautions.
+    """
+    options, error = api_options()
+    if error:
+        return error
+    language, fields, include_warnings = options
+
+    save_path = save_upload()
+    if not save_path:
+        return compact_json({"error": "no_image"}, 400)
+
+    result = empty_scan_result()
+    scan_upload(result, save_path, language, speak="audio_url" in fields)
+    return api_result(result, language, fields, include_warnings)
+
+@app.route("/r/<result_id>")
+def show_result(result_id):
+    """A stored scan result: served from the result store, never re-processed"""
+    stored = shared_cache.pages.get(result_id)
+    if stored is None:
+        return redirect(url_for("index"))  # expired or unknown
+    result = json.loads(stored)
+    
+    # Someone opening a shared link may not have picked a language yet
+    user_lang = session_language() or result.get("language")
+    if user_lang not in TRANSLATIONS:
+        user_lang = "English"
+    
+    response = make_response(render_index(user_lang, result, result_id))
+    # The result never changes; the page only varies with the session's language
+    response.headers["Cache-Control"] = f"private, max-age={min(RESULT_PAGE_TTL, 3600)}"
+    response.headers["Vary"] = "Cookie"
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route("/set_language/<lang>")
 def set_language(lang):
@@ -725,25 +1065,7 @@ CHAT_MODELS = [
     "gemini-flash-latest"
 ]
 
-@app.route("/ask", methods=["POST"])
-def ask_question():
-    # Lazy load genai
-    import google.generativeai as genai
-    import os
-    
-     # Configure API Key (Lazy)
-    api_key = os.environ.get("GOOGLE_API_KEY")
-    if api_key:
-        genai.configure(api_key=api_key)
-        
-    data = request.get_json()
-    question = data.get("question", "")
-    medicines = data.get("medicines", [])
-    language = data.get("language", "English")
-
-    if not question:
-        return jsonify({"answer": "Please ask a question."})
-
+def build_chat_prompt(question, medicines, language):
     # Build medicine context
     med_context = ""
     for med in medicines:
@@ -755,7 +1077,7 @@ def ask_question():
         generic = med.get("generic_alternative", "")
         med_context += f"- {name}: Dosage={dosage}, Purpose={purpose}, Timing={timing}, Precautions={precautions}, Generic={generic}\n"
 
-    prompt = f"""You are a friendly, helpful medical assistant for rural villagers.
+    return f"""You are a friendly, helpful medical assistant for rural villagers.
 The patient has these medicines prescribed:
 {med_context}
 
@@ -770,22 +1092,84 @@ Rules:
 
 Answer:"""
 
-    answer = "Sorry, all models are busy. Please try again in a minute."
+CHAT_BUSY_ANSWER = "Sorry, all models are busy. Please try again in a minute."
+CHAT_TIMEOUT_ANSWER = "Sorry, this is taking too long. Please try again in a minute."
+
+def chat_model_failed(model_name, e, started):
+    """Record a failed chat call; returns its kind (429/404/error)"""
+    error_kind = classify_error(str(e))
+    telemetry.observe_model_call("chat", model_name, error_kind, time.perf_counter() - started)
+    print(f"⚠️ Chat model {model_name} error: {e}")
+    if error_kind == "429":
+        report_quota_error(model_name)
+    return error_kind
+
+def chat_response(answer, retry_after=None, timed_out=False):
+    if answer is None and timed_out:
+        return jsonify({"answer": CHAT_TIMEOUT_ANSWER, "timed_out": True}), 504
+    if answer is None and retry_after is not None:
+        # Shed by the rate limiter: tell the client when to come back
+        seconds = int(retry_after + 0.999)
+        return jsonify({"answer": CHAT_BUSY_ANSWER, "retry_after": seconds}), 503, {"Retry-After": str(seconds)}
+    return jsonify({"answer": answer or CHAT_BUSY_ANSWER})
+
+@app.route("/ask", methods=["POST"])
+def ask_question():
+    # Lazy load genai
+    import google.generativeai as genai
+    
+     # Configure API Key (Lazy)
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if api_key:
+        configure_genai(genai, api_key)
+        
+    data = request.get_json()
+    question = data.get("question", "")
+    medicines = data.get("medicines", [])
+    language = data.get("language", "English")
+
+    if not question:
+        return jsonify({"answer": "Please ask a question."})
+
+    # Identical questions about the same medicines share one model call
+    prompt = build_chat_prompt(question, medicines, language)
+    answer, retry_after, timed_out = singleflight.questions.do(
+        cache_key(prompt), answer_question, genai, prompt, language)
+    return chat_response(answer, retry_after, timed_out)
+
+def answer_question(genai, prompt, language):
+    """Try the chat models in turn. Returns (answer or None, retry_after, timed_out)"""
+    retry_after = None
     
-    for model_name in CHAT_MODELS:
+    for model_name in usage.route(CHAT_MODELS):
+        if not deadline.allows(deadline.MIN_MODEL_CALL_SECONDS):
+            return None, retry_after, retry_after is None
+        
+        # Chat queues briefly at most and never eats the quota reserved for scans
+        try:
+            admit(model_name, CHAT)
+        except RateLimited as busy:
+            telemetry.observe_model_call("chat", model_name, "shed", 0.0)
+            retry_after = min(retry_after or busy.retry_after, busy.retry_after)
+            continue
+        
+        started = time.perf_counter()
         try:
             model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt) # Default config is fine for text
+            response = model.generate_content(prompt, request_options=request_options()) # Default config is fine for text
+            usage.record("chat", model_name, response, language)
             if response.text:
-                answer = response.text.strip()
-                break
+                telemetry.observe_model_call("chat", model_name, "success", time.perf_counter() - started)
+                return response.text.strip(), None, False
+            telemetry.observe_model_call("chat", model_name, "empty", time.perf_counter() - started)
         except Exception as e:
-            print(f"⚠️ Chat model {model_name} error: {e}")
-            if "429" in str(e) or "quota" in str(e).lower():
+            if chat_model_failed(model_name, e, started) == "429":
                 continue # Try next model
-            time.sleep(1) 
+            if deadline.allows(1 + deadline.MIN_MODEL_CALL_SECONDS):
+                with telemetry.span("backoff"):
+                    time.sleep(1) 
 
-    return jsonify({"answer": answer})
+    return None, retry_after, False
 
 def translate_text(text, target_language):
     try:
@@ -796,18 +1180,39 @@ def translate_text(text, target_language):
         import os
         api_key = os.environ.get("GOOGLE_API_KEY")
         if api_key:
-            genai.configure(api_key=api_key)
+            configure_genai(genai, api_key)
+
+        key = cache_key(target_language, text)
+        cached = shared_cache.translations.get(key)
+        if cached is not None:
+            return cached
 
         prompt = f"Translate the following medical text to {target_language}. Keep it simple and accurate for a patient. If it's a medicine name, keep it in English but transliterated if needed. Text: '{text}'"
         
-        for model_name in CHAT_MODELS:
+        for model_name in usage.route(CHAT_MODELS):
+            if not deadline.allows(deadline.MIN_MODEL_CALL_SECONDS):
+                break # Out of time: keep the original text
+            try:
+                admit(model_name, CHAT)
+            except RateLimited:
+                continue
+            started = time.perf_counter()
             try:
                 model = genai.GenerativeModel(model_name)
-                response = model.generate_content(prompt)
+                response = model.generate_content(prompt, request_options=request_options())
+                usage.record("translate", model_name, response, target_language)
                 if response.text:
-                    return response.text.strip()
+                    telemetry.observe_model_call("translate", model_name, "success", time.perf_counter() - started)
+                    translation = response.text.strip()
+                    shared_cache.translations.set(key, translation)
+                    return translation
+                telemetry.observe_model_call("translate", model_name, "empty", time.perf_counter() - started)
             except Exception as e:
+                error_kind = classify_error(str(e))
+                telemetry.observe_model_call("translate", model_name, error_kind, time.perf_counter() - started)
                 print(f"⚠️ Translation error with {model_name}: {e}")
+                if error_kind == "429":
+                    report_quota_error(model_name)
                 continue
                 
         return text # Fallback to original
@@ -827,21 +1232,10 @@ def speak():
     if not text:
         return jsonify({"error": "No text provided"}), 400
 
-    lang_code_map = {
-        "Hindi": "hi",
-        "Tamil": "ta",
-        "Telugu": "te",
-        "Kannada": "kn",
-        "Malayalam": "ml",
-        "English": "en"
-    }
-
     try:
-        from gtts import gTTS # Lazy Load
-        tts = gTTS(text=text, lang=lang_code_map.get(language, "en"))
-        audio_filename = f"chat_{uuid.uuid4()}.mp3"
-        audio_path = os.path.join(AUDIO_FOLDER, audio_filename)
-        tts.save(audio_path)
+        audio_filename = synthesize_speech(text, language, prefix="chat_")
+        if not audio_filename:
+            return jsonify({"error": "timeout"}), 504
         return jsonify({"audio_url": url_for('static', filename=f"audio/{audio_filename}")})
     except Exception as e:
         print(f"TTS error: {e}")
@@ -0,0 +1,337 @@
+"""
+asyncio serving mode
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT
+
+The scan form (POST /), /api/v1/analyze, /ask and /speak run as coroutines:
+Gemini calls, quota waits and retry backoff are awaited, so a request that is
+waiting on Google holds no thread. Image decoding, text-to-speech (gTTS
+has no async API, espeak-ng is a subprocess), saving uploads and the SQLite
+writes (quota bookings, 429 back-offs, result cache, page store) run in a
+bounded thread pool, so a busy database never stalls the event loop.
+Every other route is the normal Flask app behind asgiref's WSGI adapter, so
+templates, sessions and hooks behave the same as under gunicorn.
+"""
+
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import request, jsonify, render_template, url_for
+
+from app import (
+    app as flask_app, session_language, empty_scan_result, save_upload, cached_scan,
+    read_scan_result, render_index, store_result, scan_page, synthesize_speech, build_chat_prompt, chat_model_failed,
+    chat_response, api_options, api_result, compact_json, CHAT_MODELS,
+)
+from config import (
+    ASYNC_MAX_SCANS, ASYNC_BLOCKING_THREADS, ASYNC_MAX_BUFFERED_BYTES, MAX_UPLOAD_BYTES, TTS_RESERVE_SECONDS,
+    WARMUP_ENABLED,
+)
+from pipeline import run_pipeline_async, configure_genai, request_options
+from ratelimit import admit_async, RateLimited, CHAT
+from shared_cache import cache_key
+import telemetry
+import deadline
+import singleflight
+import usage
+import warmup
+
+
+# Created on the server's event loop at startup
+_scan_slots = None
+_body_bytes = None
+
+
+class ByteBudget:
+    """Semaphore counted in bytes: bounds the request bodies held in memory at once"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.free = capacity
+        self.changed = asyncio.Condition()
+
+    async def acquire(self, size):
+        size = min(size, self.capacity)  # one oversized body may still go alone
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.free >= size)
+            self.free -= size
+        return size
+
+    async def release(self, size):
+        async with self.changed:
+            self.free += size
+            self.changed.notify_all()
+
+
+async def index_async():
+    """index() with the pipeline and TTS awaited"""
+    user_lang = session_language()
+
+    # If no language is set, render the Language Wall
+    if not user_lang:
+        return render_template("language.html")
+
+    result = empty_scan_result()
+    language = request.form.get("language") or user_lang
+
+    save_path = await asyncio.to_thread(save_upload)
+    if save_path:
+        await scan_upload_async(result, save_path, language)
+        # finish_scan() with the page-store write off the event loop
+        result_id = None
+        if not result["error_type"]:
+            result_id = await asyncio.to_thread(store_result, result, language)
+        return scan_page(user_lang, result, result_id)
+
+    return render_index(user_lang, result)
+
+
+async def scan_upload_async(result, save_path, language, speak=True):
+    """scan_upload() with the pipeline and TTS awaited"""
+    try:
+        # Bounded: decoded images are the big per-scan allocation
+        async with _scan_slots:
+            image_key, raw_response = await asyncio.to_thread(cached_scan, save_path, language)
+            from_cache = raw_response is not None
+            if not from_cache:
+                with telemetry.span("pipeline"), deadline.reserve(TTS_RESERVE_SECONDS), usage.attribute(language):
+                    raw_response = await singleflight.scans.do_async(
+                        image_key, run_pipeline_async, save_path, language)
+
+        # Writes the result cache
+        audio_text = await asyncio.to_thread(
+            read_scan_result, result, raw_response, language, image_key, from_cache)
+        if audio_text and speak:
+            audio_filename = await asyncio.to_thread(synthesize_speech, audio_text, language)
+            if audio_filename:
+                result["audio_path"] = f"audio/{audio_filename}"
+
+    except Exception as e:
+        print(f"Pipeline/API error: {e}")
+        result["error_type"] = "api_error"
+
+
+async def api_analyze_async():
+    """api_analyze() with the pipeline awaited"""
+    options, error = api_options()
+    if error:
+        return error
+    language, fields, include_warnings = options
+
+    save_path = await asyncio.to_thread(save_upload)
+    if not save_path:
+        return compact_json({"error": "no_image"}, 400)
+
+    result = empty_scan_result()
+    await scan_upload_async(result, save_path, language, speak="audio_url" in fields)
+    # result_url stores the page; html renders templates
+    return await asyncio.to_thread(api_result, result, language, fields, include_warnings)
+
+
+async def ask_async():
+    """ask_question() with model calls and quota waits awaited"""
+    import google.generativeai as genai
+
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if api_key:
+        configure_genai(genai, api_key)
+
+    data = request.get_json()
+    question = data.get("question", "")
+    medicines = data.get("medicines", [])
+    language = data.get("language", "English")
+
+    if not question:
+        return jsonify({"answer": "Please ask a question."})
+
+    # Identical questions about the same medicines share one model call
+    prompt = build_chat_prompt(question, medicines, language)
+    answer, retry_after, timed_out = await singleflight.questions.do_async(
+        cache_key(prompt), answer_question_async, genai, prompt, language)
+    return chat_response(answer, retry_after, timed_out)
+
+
+async def answer_question_async(genai, prompt, language):
+    """answer_question() with model calls and quota waits awaited"""
+    retry_after = None
+
+    for model_name in usage.route(CHAT_MODELS):
+        if not deadline.allows(deadline.MIN_MODEL_CALL_SECONDS):
+            return None, retry_after, retry_after is None
+
+        try:
+            await admit_async(model_name, CHAT)
+        except RateLimited as busy:
+            telemetry.observe_model_call("chat", model_name, "shed", 0.0)
+            retry_after = min(retry_after or busy.retry_after, busy.retry_after)
+            continue
+
+        started = time.perf_counter()
+        try:
+            model = genai.GenerativeModel(model_name)
+            response = await model.generate_content_async(prompt, request_options=request_options())
+            usage.record("chat", model_name, response, language)
+            if response.text:
+                telemetry.observe_model_call("chat", model_name, "success", time.perf_counter() - started)
+                return response.text.strip(), None, False
+            telemetry.observe_model_call("chat", model_name, "empty", time.perf_counter() - started)
+        except Exception as e:
+            # A 429 writes the shared back-off to SQLite
+            if await asyncio.to_thread(chat_model_failed, model_name, e, started) == "429":
+                continue
+            if deadline.allows(1 + deadline.MIN_MODEL_CALL_SECONDS):
+                with telemetry.span("backoff"):
+                    await asyncio.sleep(1)
+
+    return None, retry_after, False
+
+
+async def speak_async():
+    data = request.get_json()
+    text = data.get("text", "")
+    language = data.get("language", "English")
+
+    if not text:
+        return jsonify({"error": "No text provided"}), 400
+
+    try:
+        audio_filename = await asyncio.to_thread(synthesize_speech, text, language, "chat_")
+        if not audio_filename:
+            return jsonify({"error": "timeout"}), 504
+        return jsonify({"audio_url": url_for('static', filename=f"audio/{audio_filename}")})
+    except Exception as e:
+        print(f"TTS error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+ASYNC_ROUTES = {
+    ("POST", "/"): index_async,
+    ("POST", "/ask"): ask_async,
+    ("POST", "/speak"): speak_async,
+    ("POST", "/api/v1/analyze"): api_analyze_async,
+}
+
+
+class AsyncFlask:
+    """ASGI app: coroutine views for ASYNC_ROUTES, the WSGI Flask app for the rest"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.started = False
+
+    def startup(self):
+        global _scan_slots, _body_bytes
+        if self.started:
+            return
+        loop = asyncio.get_running_loop()
+        # Shared by to_thread() calls and the WSGI adapter
+        loop.set_default_executor(ThreadPoolExecutor(ASYNC_BLOCKING_THREADS, thread_name_prefix="blocking"))
+        _scan_slots = asyncio.Semaphore(ASYNC_MAX_SCANS)
+        _body_bytes = ByteBudget(ASYNC_MAX_BUFFERED_BYTES)
+        self.started = True
+        print(f"⚡ Async mode: {ASYNC_MAX_SCANS} concurrent scans, {ASYNC_BLOCKING_THREADS} blocking threads")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        self.startup()  # servers without lifespan support
+        if scope["type"] == "http":
+            view = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+            if view:
+                return await self.dispatch(view, scope, receive, send)
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.startup()
+                if WARMUP_ENABLED:
+                    await asyncio.to_thread(warmup.warm_up, True)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_body(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    async def dispatch(self, view, scope, receive, send):
+        """Run the view with its request body's size reserved in _body_bytes, from
+        before the body is read until the response is sent (_scan_slots only
+        bounds decoded images; this bounds the raw uploads waiting for them)"""
+        length = content_length(scope)
+        if length is not None and length > MAX_UPLOAD_BYTES:
+            return await self.send_plain(send, 413, b"Request body too large")
+        reserved = await _body_bytes.acquire(MAX_UPLOAD_BYTES if length is None else length)
+        try:
+            await self.respond(view, scope, receive, send)
+        finally:
+            await _body_bytes.release(reserved)
+
+    async def respond(self, view, scope, receive, send):
+        """Flask's full_dispatch_request, with the view awaited"""
+        body = await self.read_body(receive)
+        if body is None:
+            return await self.send_plain(send, 413, b"Request body too large")
+
+        adapter = WsgiToAsgiInstance(self.flask_app)
+        adapter.scope = scope  # build_environ reads headers from it
+        environ = adapter.build_environ(scope, io.BytesIO(body))
+        app = self.flask_app
+        with app.request_context(environ):
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await view()
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                response = app.handle_exception(e)
+            payload = response.get_data()
+            headers = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in response.headers.items()
+            ]
+
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": payload})
+
+    async def send_plain(self, send, status, text):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        })
+        await send({"type": "http.response.body", "body": text})
+
+
+def content_length(scope):
+    """The Content-Length header as an int, or None (chunked or malformed)"""
+    for name, value in scope.get("headers", ()):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+application = AsyncFlask(flask_app)
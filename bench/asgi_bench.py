@@ -0,0 +1,11 @@
+"""
+asyncio serving mode with the fake Gemini/gTTS backends
+
+    uvicorn bench.asgi_bench:application
+"""
+
+from bench.fakes import install
+
+install()
+
+from asgi import application  # noqa: E402,F401
@@ -0,0 +1,38 @@
+"""
+Local stand-ins for google.generativeai and gTTS
+
+install() registers the fakes in sys.modules, so the app's lazy
+`import google.generativeai as genai` and `from gtts import gTTS` pick them
+up without touching app code. Call it before the app handles requests
+(bench/gunicorn_bench.conf.py does this in the gunicorn master).
+
+With REPLAY_FILE set (bench/replay.py), the modules that play back captured
+answers are installed instead.
+"""
+
+import os
+import sys
+import types
+
+
+def install():
+    if os.environ.get("REPLAY_FILE"):
+        from . import replay_genai as fake_genai, replay_gtts as fake_gtts
+    else:
+        from . import fake_genai, fake_gtts
+
+    google = sys.modules.get("google")
+    if google is None:
+        try:
+            import google
+        except ImportError:
+            google = types.ModuleType("google")
+            google.__path__ = []
+            sys.modules["google"] = google
+    google.generativeai = fake_genai
+    sys.modules["google.generativeai"] = fake_genai
+    sys.modules["gtts"] = fake_gtts
+    if os.environ.get("REPLAY_FILE"):
+        print(f"🧪 Replaying recorded google.generativeai and gTTS answers from {os.environ['REPLAY_FILE']}")
+    else:
+        print("🧪 Using fake google.generativeai and gTTS backends")
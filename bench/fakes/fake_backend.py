@@ -0,0 +1,91 @@
+"""
+Shared knobs for the fake Gemini/gTTS modules used by the benchmarks
+Everything is read from FAKE_* environment variables so it survives the
+jump into gunicorn workers:
+
+    FAKE_GEMINI_LATENCY_MS    median call latency (default 1500)
+    FAKE_GEMINI_SIGMA         log-normal spread, higher = fatter tail (default 0.5)
+    FAKE_GEMINI_ERROR_RATE    fraction of calls raising a generic 500 (default 0)
+    FAKE_GEMINI_429_RATE      fraction of calls raising 429 quota errors (default 0)
+    FAKE_GEMINI_MISSING       comma-separated model names that answer 404
+    FAKE_TTS_LATENCY_MS       median gTTS latency (default 600)
+    FAKE_TTS_SIGMA            (default 0.4)
+    FAKE_TTS_ERROR_RATE       (default 0)
+    FAKE_SEED                 seed for reproducible runs
+
+Replaying captured traffic (bench/replay.py) instead:
+
+    REPLAY_FILE               capture.jsonl whose recorded answers are played back
+    REPLAY_SPEED              recorded latencies are divided by this (default 1)
+"""
+
+import collections
+import json
+import os
+import random
+import threading
+
+_rng = random.Random(os.environ.get("FAKE_SEED"))
+
+
+def knob(name, default):
+    """Environment value converted to the type of the default"""
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    if isinstance(default, (int, float)):
+        return float(value)
+    return value
+
+
+def sample_latency(prefix, default_ms, default_sigma):
+    """Seconds, drawn from a log-normal around the configured median"""
+    median = knob(f"{prefix}_LATENCY_MS", default_ms) / 1000.0
+    sigma = knob(f"{prefix}_SIGMA", default_sigma)
+    if median <= 0:
+        return 0.0
+    return median * _rng.lognormvariate(0.0, sigma)
+
+
+def roll(rate):
+    return rate > 0 and _rng.random() < rate
+
+
+# --- Playback of captured calls ---
+
+_recorded = None
+_recorded_lock = threading.Lock()
+
+
+def _load_recorded():
+    calls = collections.defaultdict(collections.deque)
+    with open(os.environ["REPLAY_FILE"], encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for call in record.get("upstream", ()):
+                key = call.get("model") if call["kind"] == "gemini" else call.get("lang")
+                calls[(record["request_id"], call["kind"], key)].append(call)
+    return calls
+
+
+def recorded_call(kind, key):
+    """
+    The next recorded `kind` call ("gemini" by model, "gtts" by language) of the
+    request being replayed (matched by its X-Request-ID), or None when the
+    original request made no such call
+    """
+    global _recorded
+    import telemetry  # the app's; replay sends the captured request id
+
+    with _recorded_lock:
+        if _recorded is None:
+            _recorded = _load_recorded()
+        calls = _recorded.get((telemetry.request_id(), kind, key))
+        return calls.popleft() if calls else None
+
+
+def replay_latency(call):
+    speed = knob("REPLAY_SPEED", 1.0)
+    return call["seconds"] / speed if speed > 0 else 0.0
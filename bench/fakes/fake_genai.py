@@ -0,0 +1,134 @@
+"""
+Stand-in for google.generativeai with configurable latency and failures
+Only the surface used by app.py/pipeline.py is implemented. See
+fake_backend.py for the FAKE_GEMINI_* knobs.
+"""
+
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from .fake_backend import knob, roll, sample_latency
+
+
+class GenerationConfig:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+types = SimpleNamespace(GenerationConfig=GenerationConfig)
+
+_SCAN_RESULT = {
+    "english": [
+        {
+            "name": "Paracetamol 500mg",
+            "medicine_type": "tablet",
+            "purpose": "for fever and pain",
+            "dosage": "1-0-1",
+            "visual_timing": "☀️ -- 🌙",
+            "timing": "After food",
+            "frequency": "After food",
+            "duration": "5 days",
+            "warnings": "Avoid alcohol",
+            "precautions": "Avoid alcohol",
+            "generic_alternative": "Paracetamol (generic)",
+            "application_instructions": ""
+        },
+        {
+            "name": "Amoxicillin 250mg",
+            "medicine_type": "capsule",
+            "purpose": "for infection",
+            "dosage": "1-1-1",
+            "visual_timing": "☀️ 🌤️ 🌙",
+            "timing": "After food",
+            "frequency": "After food",
+            "duration": "7 days",
+            "warnings": "Complete the full course",
+            "precautions": "Complete the full course",
+            "generic_alternative": "Amoxicillin (generic)",
+            "application_instructions": ""
+        }
+    ],
+    "dangerous_combinations": []
+}
+_SCAN_RESULT["translated"] = _SCAN_RESULT["english"]
+
+_CHAT_ANSWER = "Take this medicine after food with a glass of water. Do not skip doses."
+
+_AVAILABLE_MODELS = [
+    "gemini-2.5-flash", "gemini-2.0-flash", "gemini-2.5-pro",
+    "gemini-flash-latest", "gemini-2.0-flash-lite",
+]
+
+_configured_key = None
+
+
+def configure(api_key=None, **kwargs):
+    global _configured_key
+    _configured_key = api_key
+
+
+def list_models(**kwargs):
+    return [
+        SimpleNamespace(name=f"models/{name}", supported_generation_methods=["generateContent"])
+        for name in _AVAILABLE_MODELS
+    ]
+
+
+class GenerativeModel:
+    def __init__(self, model_name, **kwargs):
+        self.model_name = model_name
+
+    def _outcome(self, contents):
+        """Decide latency and result for one call"""
+        missing = [m.strip() for m in knob("FAKE_GEMINI_MISSING", "").split(",") if m.strip()]
+        if self.model_name in missing:
+            return 0.05, Exception(f"404 models/{self.model_name} is not found for API version v1beta")
+        latency = sample_latency("FAKE_GEMINI", 1500, 0.5)
+        if roll(knob("FAKE_GEMINI_429_RATE", 0.0)):
+            return latency * 0.1, Exception("429 Resource has been exhausted (e.g. check quota).")
+        if roll(knob("FAKE_GEMINI_ERROR_RATE", 0.0)):
+            return latency, Exception("500 An internal error has occurred.")
+
+        # Vision calls pass [prompt, image]; chat/translation pass a plain prompt
+        is_scan = isinstance(contents, (list, tuple)) and len(contents) > 1
+        prompt = contents[0] if isinstance(contents, (list, tuple)) else contents
+        text = json.dumps(_SCAN_RESULT, ensure_ascii=False) if is_scan else _CHAT_ANSWER
+        return latency, _response(text, prompt, is_scan)
+
+    def generate_content(self, contents, generation_config=None, request_options=None, **kwargs):
+        latency, result = _with_timeout(self._outcome(contents), request_options)
+        time.sleep(latency)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def generate_content_async(self, contents, generation_config=None, request_options=None, **kwargs):
+        latency, result = _with_timeout(self._outcome(contents), request_options)
+        await asyncio.sleep(latency)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _with_timeout(outcome, request_options):
+    """Cut a call short at request_options["timeout"], like the real client"""
+    latency, result = outcome
+    timeout = (request_options or {}).get("timeout")
+    if timeout is not None and latency > timeout:
+        return timeout, Exception("504 Deadline Exceeded")
+    return latency, result
+
+
+def _response(text, prompt, is_scan):
+    prompt_tokens = len(str(prompt)) // 4 + (258 if is_scan else 0)
+    output_tokens = len(text) // 4
+    return SimpleNamespace(
+        text=text,
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        ),
+    )
@@ -0,0 +1,37 @@
+"""
+Stand-in for gTTS: sleeps for a sampled latency and writes a tiny MP3 frame
+See fake_backend.py for the FAKE_TTS_* knobs.
+"""
+
+import time
+
+from .fake_backend import knob, roll, sample_latency
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz)
+_SILENT_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+class gTTSError(Exception):
+    pass
+
+
+class gTTS:
+    def __init__(self, text, lang="en", timeout=None, **kwargs):
+        self.text = text
+        self.lang = lang
+        self.timeout = timeout
+
+    def write_to_fp(self, fp):
+        latency = sample_latency("FAKE_TTS", 600, 0.4)
+        if self.timeout is not None and latency > self.timeout:
+            time.sleep(self.timeout)
+            raise gTTSError("Failed to connect. Probable cause: timeout")
+        time.sleep(latency)
+        if roll(knob("FAKE_TTS_ERROR_RATE", 0.0)):
+            raise gTTSError("Failed to connect. Probable cause: timeout")
+        # Roughly one frame per word, like real speech length
+        fp.write(_SILENT_FRAME * max(1, len(self.text.split())))
+
+    def save(self, savefile):
+        with open(savefile, "wb") as f:
+            self.write_to_fp(f)
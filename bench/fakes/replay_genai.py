@@ -0,0 +1,24 @@
+"""
+google.generativeai that answers with the calls recorded by capture.py
+Each call gets the next recorded answer (or error) for the same request and
+model, after the recorded latency divided by REPLAY_SPEED. Calls the original
+request didn't make fall back to fake_genai's synthetic answers.
+"""
+
+from types import SimpleNamespace
+
+from .fake_backend import recorded_call, replay_latency
+from .fake_genai import GenerationConfig, configure, list_models, types  # noqa: F401
+from . import fake_genai
+
+
+class GenerativeModel(fake_genai.GenerativeModel):
+    def _outcome(self, contents):
+        call = recorded_call("gemini", self.model_name)
+        if call is None:
+            print(f"🧪 Replay: no recorded {self.model_name} call, answering synthetically")
+            return super()._outcome(contents)
+        latency = replay_latency(call)
+        if "error" in call:
+            return latency, Exception(call["error"])
+        return latency, SimpleNamespace(text=call.get("text"), usage_metadata=SimpleNamespace(**call.get("usage", {})))
@@ -0,0 +1,23 @@
+"""
+gTTS that plays back the calls recorded by capture.py: the recorded latency
+(divided by REPLAY_SPEED), error or file size, per request and language.
+Calls the original request didn't make fall back to fake_gtts.
+"""
+
+import time
+
+from .fake_backend import recorded_call, replay_latency
+from .fake_gtts import gTTSError, _SILENT_FRAME  # noqa: F401
+from . import fake_gtts
+
+
+class gTTS(fake_gtts.gTTS):
+    def write_to_fp(self, fp):
+        call = recorded_call("gtts", self.lang)
+        if call is None:
+            print(f"🧪 Replay: no recorded gTTS call for {self.lang}, answering synthetically")
+            return super().write_to_fp(fp)
+        time.sleep(replay_latency(call))
+        if "error" in call:
+            raise gTTSError(call["error"])
+        fp.write(_SILENT_FRAME * max(1, call.get("bytes", 0) // len(_SILENT_FRAME)))
@@ -0,0 +1,17 @@
+# gunicorn config for benchmarks: the normal gunicorn.conf.py plus fake
+# Gemini/gTTS backends installed in the master before workers fork.
+import os
+import runpy
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+globals().update({
+    k: v for k, v in runpy.run_path(os.path.join(ROOT, "gunicorn.conf.py")).items()
+    if not k.startswith("__")
+})
+
+from bench.fakes import install  # noqa: E402
+
+install()
@@ -0,0 +1,359 @@
+"""
+Load test for the Flask app against local stand-ins for Gemini and gTTS
+
+Starts gunicorn with bench/gunicorn_bench.conf.py (the normal gunicorn.conf.py
+plus fakes registered for `google.generativeai` and `gtts`), so no request
+leaves the machine. Latency and error/429 rates of the fakes are configurable
+(see bench/fakes/fake_backend.py).
+It then drives /, /ask and /speak at rising concurrency and reports RPS,
+p50/p95/p99 and worker saturation.
+
+    python bench/loadtest.py --levels 1,4,8,16 --duration 20
+    python bench/loadtest.py --scenario ask --gemini-latency-ms 800 --gemini-429-rate 0.1
+    python bench/loadtest.py --compare bench/results/<older run>.json
+    python bench/loadtest.py --asgi --levels 16,64,256      # asyncio mode under uvicorn
+    python bench/loadtest.py --url http://localhost:10000   # already running server
+
+Each scan posts the photo with a few unique bytes appended, so it runs the
+pipeline rather than the result cache (--same-photo measures the cache).
+Every run is written to bench/results/<commit>-<timestamp>.json. Like real
+traffic, scans leave files in uploads/ and static/audio/. Each run gets a fresh
+DATA_DIR, so caches and quota buckets start empty; other app settings
+(RESULT_CACHE_TTL=0, RATE_LIMIT_ENABLED=0, ...) are passed through from the
+environment.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_CONFIG = os.path.join(ROOT, "bench", "gunicorn_bench.conf.py")
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+SCENARIO_MIX = {"scan": 0.5, "ask": 0.3, "speak": 0.2}
+
+ASK_BODY = {
+    "question": "Can I take this after food?",
+    "medicines": [{"name": "Paracetamol 500mg", "dosage": "1-0-1", "purpose": "for fever"}],
+    "language": "English",
+}
+SPEAK_BODY = {"text": "Paracetamol 500mg. For fever and pain. Dosage: 1-0-1. After food.", "language": "English"}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content_type, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Client:
+    """One simulated user: own cookie jar (session language) and request loop"""
+
+    def __init__(self, base_url, image, timeout, same_photo=False):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.image = (os.path.basename(image), _guess_type(image), _read(image))
+        self.same_photo = same_photo
+        # Language wall: the session needs a language before / accepts uploads
+        self.opener.open(f"{base_url}/set_language/English", timeout=timeout).read()
+
+    def request(self, scenario):
+        if scenario == "scan":
+            filename, content_type, data = self.image
+            if not self.same_photo:
+                # A new photo each time (bytes after the JPEG end are ignored), so scans
+                # run the pipeline instead of hitting the result cache and single-flight
+                data += uuid.uuid4().hex.encode()
+            body, body_type = encode_multipart({"language": "English"}, {"image": (filename, content_type, data)})
+            req = urllib.request.Request(f"{self.base_url}/", data=body, headers={"Content-Type": body_type})
+        else:
+            body = ASK_BODY if scenario == "ask" else SPEAK_BODY
+            req = urllib.request.Request(
+                f"{self.base_url}/{scenario}", data=json.dumps(body).encode(),
+                headers={"Content-Type": "application/json"})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = "error"
+        return time.perf_counter() - started, status
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _guess_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    return {".webp": "image/webp", ".png": "image/png"}.get(ext, "image/jpeg")
+
+
+class SaturationSampler(threading.Thread):
+    """Scrapes clearscript_requests_in_flight from /metrics while a level runs"""
+
+    IN_FLIGHT = re.compile(r"^clearscript_requests_in_flight (\S+)$", re.M)
+
+    def __init__(self, base_url, interval=0.5):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                with urllib.request.urlopen(f"{self.base_url}/metrics", timeout=2) as resp:
+                    match = self.IN_FLIGHT.search(resp.read().decode())
+                # The scrape itself is one of the in-flight requests
+                if match:
+                    self.samples.append(max(0.0, float(match.group(1)) - 1))
+            except Exception:
+                pass
+
+
+def run_level(base_url, concurrency, duration, scenario, image, timeout, threads_per_worker, same_photo=False):
+    clients = [Client(base_url, image, timeout, same_photo) for _ in range(concurrency)]
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    rng = random.Random(concurrency)
+
+    def pick():
+        if scenario != "mix":
+            return scenario
+        return rng.choices(list(SCENARIO_MIX), weights=list(SCENARIO_MIX.values()))[0]
+
+    def loop(client):
+        while time.perf_counter() < deadline:
+            kind = pick()
+            elapsed, status = client.request(kind)
+            with lock:
+                results.append((kind, elapsed, status))
+
+    sampler = SaturationSampler(base_url)
+    sampler.start()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=loop, args=(c,)) for c in clients]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    wall = time.perf_counter() - started
+    sampler.stop_event.set()
+
+    return summarize(concurrency, results, wall, sampler.samples, threads_per_worker)
+
+
+def summarize(concurrency, results, wall, in_flight_samples, threads_per_worker):
+    latencies = sorted(elapsed for _, elapsed, _ in results)
+    status_counts = {}
+    for _, _, status in results:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    errors = sum(n for s, n in status_counts.items() if not (s.isdigit() and int(s) < 400))
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    per_scenario = {}
+    for kind in sorted({k for k, _, _ in results}):
+        values = sorted(e for k, e, _ in results if k == kind)
+        per_scenario[kind] = {
+            "requests": len(values),
+            "p50_ms": ms(percentile(values, 50)),
+            "p95_ms": ms(percentile(values, 95)),
+            "p99_ms": ms(percentile(values, 99)),
+        }
+
+    saturation = None
+    if in_flight_samples:
+        mean_in_flight = sum(in_flight_samples) / len(in_flight_samples)
+        saturation = {
+            "mean_in_flight": round(mean_in_flight, 2),
+            "max_in_flight": max(in_flight_samples),
+            # Per scraped worker; 1.0 means every gthread was busy
+            "utilization": round(mean_in_flight / threads_per_worker, 3) if threads_per_worker else None,
+        }
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": errors,
+        "rps": round(len(results) / wall, 2) if wall else 0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+        "status_counts": status_counts,
+        "scenarios": per_scenario,
+        "saturation": saturation,
+    }
+
+
+def start_server(args, port):
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "GOOGLE_API_KEY": "fake-benchmark-key",
+        "METRICS_ENABLED": "1",
+        "DATA_DIR": tempfile.mkdtemp(prefix="clearscript-bench-"),
+        "FAKE_GEMINI_LATENCY_MS": str(args.gemini_latency_ms),
+        "FAKE_GEMINI_ERROR_RATE": str(args.gemini_error_rate),
+        "FAKE_GEMINI_429_RATE": str(args.gemini_429_rate),
+        "FAKE_GEMINI_MISSING": args.gemini_missing,
+        "FAKE_TTS_LATENCY_MS": str(args.tts_latency_ms),
+        "FAKE_TTS_ERROR_RATE": str(args.tts_error_rate),
+    })
+    if args.asgi:
+        cmd = [sys.executable, "-m", "uvicorn", "bench.asgi_bench:application",
+               "--host", "127.0.0.1", "--port", str(port), "--workers", str(args.workers),
+               "--no-access-log"]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "-c", BENCH_CONFIG,
+               "--workers", str(args.workers), "--threads", str(args.threads),
+               "--access-logfile", "/dev/null", "app:app"]
+    log = open(os.path.join(RESULTS_DIR, "server.log"), "w")
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if proc.poll() is not None:
+            raise SystemExit(f"gunicorn exited early, see {log.name}")
+        try:
+            urllib.request.urlopen(f"{base_url}/metrics", timeout=1).read()
+            return proc, base_url
+        except Exception:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("gunicorn did not become ready")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old_levels = {lvl["concurrency"]: lvl for lvl in baseline["levels"]}
+    print(f"\nvs {baseline.get('commit')} ({os.path.basename(baseline_path)})")
+    print(f"{'conc':>5} {'rps':>14} {'p50':>14} {'p95':>14} {'p99':>14}")
+    for lvl in current["levels"]:
+        old = old_levels.get(lvl["concurrency"])
+        if not old:
+            continue
+        cells = [_delta(lvl[key], old[key]) for key in ("rps", "p50_ms", "p95_ms", "p99_ms")]
+        print(f"{lvl['concurrency']:>5} " + " ".join(f"{c:>14}" for c in cells))
+
+
+def _delta(new, old):
+    if new is None or not old:
+        return "-"
+    return f"{new:g} ({(new - old) / old * 100:+.0f}%)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting gunicorn")
+    parser.add_argument("--port", type=int, default=10099)
+    parser.add_argument("--asgi", action="store_true", help="Serve asgi.py with uvicorn instead of gunicorn")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--levels", default="1,2,4,8,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds per level")
+    parser.add_argument("--scenario", choices=["scan", "ask", "speak", "mix"], default="mix")
+    parser.add_argument("--image", default=os.path.join(ROOT, "uploads", "sample.jpg"))
+    parser.add_argument("--same-photo", action="store_true",
+                        help="Post the image unchanged every time (measures cache hits and coalescing)")
+    parser.add_argument("--timeout", type=float, default=130)
+    parser.add_argument("--gemini-latency-ms", type=float, default=1500)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-missing", default="", help="Models that should answer 404")
+    parser.add_argument("--tts-latency-ms", type=float, default=600)
+    parser.add_argument("--tts-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Result file (default bench/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to diff against")
+    args = parser.parse_args()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    proc = None
+    base_url = args.url
+    if not base_url:
+        proc, base_url = start_server(args, args.port)
+
+    levels = []
+    try:
+        for concurrency in [int(n) for n in args.levels.split(",")]:
+            print(f"▶ concurrency {concurrency} for {args.duration:g}s ({args.scenario})...")
+            level = run_level(base_url, concurrency, args.duration, args.scenario,
+                              args.image, args.timeout, args.threads, args.same_photo)
+            sat = level["saturation"] or {}
+            print(f"  {level['requests']} req, {level['rps']} rps, p50 {level['p50_ms']} ms, "
+                  f"p95 {level['p95_ms']} ms, p99 {level['p99_ms']} ms, errors {level['errors']}, "
+                  f"utilization {sat.get('utilization', '-')}")
+            levels.append(level)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "levels": levels,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 Saved {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
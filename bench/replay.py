@@ -0,0 +1,281 @@
+"""
+Replay captured production traffic against the app, offline
+
+Starts gunicorn (or uvicorn with --asgi) with the Gemini and gTTS answers
+recorded by capture.py played back for each request (bench/fakes/replay_*.py),
+then sends the captured requests with their original spacing and reports
+latency per endpoint next to what was recorded in production. --speed divides
+both the gaps between requests and the recorded upstream latencies. A result
+page (/r/<id>) waits for the scan that redirected to it.
+
+    python bench/replay.py instance/capture.jsonl
+    python bench/replay.py capture.jsonl --speed 10 --workers 2 --threads 8
+    python bench/replay.py capture.jsonl --asgi
+    python bench/replay.py capture.jsonl --compare bench/results/replay-<older run>.json
+
+Photos are stand-ins: uploads/sample.jpg made unique per recorded hash and
+padded to the recorded size, so repeated photos still hit the caches. Free
+text is replaced the same way. Every run is written to
+bench/results/replay-<commit>-<timestamp>.json.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import (  # noqa: E402
+    ROOT, RESULTS_DIR, encode_multipart, git_commit, percentile, start_server, _delta, _read,
+)
+
+
+def load_capture(path):
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r["t"])
+
+
+def placeholder(value):
+    """Stand-in for an anonymized value: same hash gives the same text, same length"""
+    if not isinstance(value, dict) or "sha256" not in value:
+        return value
+    if "chars" in value:
+        return (value["sha256"] * (value["chars"] // len(value["sha256"]) + 1))[:value["chars"]]
+    return [{"name": f"{value['sha256']}-{i}"} for i in range(value["items"])]
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # The redirected page is a request of its own in the capture
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Replayer:
+    def __init__(self, base_url, image, timeout):
+        self.base_url = base_url
+        self.image = _read(image)
+        self.timeout = timeout
+        self.openers = {}
+        self.images = {}
+        self.locations = {}  # recorded redirect target -> the one this run got
+        self.lock = threading.Lock()
+
+    def opener(self, language):
+        """One cookie jar per session language"""
+        with self.lock:
+            opener = self.openers.get(language)
+            if opener is None:
+                opener = urllib.request.build_opener(
+                    urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+                if language:
+                    try:
+                        opener.open(f"{self.base_url}/set_language/{language}", timeout=self.timeout).read()
+                    except urllib.error.HTTPError:
+                        pass  # the 302 back to / is expected
+                self.openers[language] = opener
+            return opener
+
+    def photo(self, shape):
+        """sample.jpg made unique per recorded hash (bytes after the JPEG end are ignored) at the recorded size"""
+        with self.lock:
+            data = self.images.get(shape["sha256"])
+            if data is None:
+                data = self.image + shape["sha256"].encode()
+                data += b"\0" * max(0, shape["bytes"] - len(data))
+                self.images[shape["sha256"]] = data
+            return data
+
+    def build(self, record):
+        path = self.locations.get(record["path"], record["path"])
+        headers = {"X-Request-ID": record["request_id"]}
+        data = None
+        if record.get("image") or record.get("form"):
+            fields = {k: placeholder(v) for k, v in (record.get("form") or {}).items()}
+            files = {}
+            if record.get("image"):
+                image = record["image"]
+                files["image"] = ("photo", image.get("type") or "image/jpeg", self.photo(image))
+            data, headers["Content-Type"] = encode_multipart(fields, files)
+        elif record.get("json") is not None:
+            data = json.dumps({k: placeholder(v) for k, v in record["json"].items()}).encode()
+            headers["Content-Type"] = "application/json"
+        return urllib.request.Request(
+            f"{self.base_url}{path}", data=data, headers=headers, method=record["method"])
+
+    def send(self, record):
+        req = self.build(record)
+        location = None
+        started = time.perf_counter()
+        try:
+            with self.opener(record.get("session_language")).open(req, timeout=self.timeout) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+            location = e.headers.get("Location")
+        except Exception:
+            status = "error"
+        elapsed = time.perf_counter() - started
+        if location and record.get("location"):
+            with self.lock:
+                self.locations[urllib.parse.urlsplit(record["location"]).path] = urllib.parse.urlsplit(location).path
+        return elapsed, status
+
+
+def replay(replayer, records, speed):
+    """Send every record at its recorded offset / speed, each on its own thread"""
+    results = []
+    lock = threading.Lock()
+    first = records[0]["t"]
+    started = time.perf_counter()
+
+    # A result page is only requested once the scan that redirected to it has
+    # finished here too (the new /r/<id> isn't known before that)
+    done = {id(r): threading.Event() for r in records}
+    redirected_by = {
+        urllib.parse.urlsplit(r["location"]).path: r for r in records if r.get("location")}
+
+    def run(record):
+        producer = redirected_by.get(record["path"])
+        if producer is not None and producer is not record:
+            done[id(producer)].wait(replayer.timeout)
+        elapsed, status = replayer.send(record)
+        done[id(record)].set()
+        with lock:
+            results.append((record, elapsed, status))
+
+    threads = []
+    for record in records:
+        if speed > 0:
+            wait = started + (record["t"] - first) / speed - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        thread = threading.Thread(target=run, args=(record,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, wall):
+    def ms(values, pct):
+        value = percentile(sorted(values), pct)
+        return None if value is None else round(value * 1000, 1)
+
+    endpoints = {}
+    for endpoint in sorted({r["endpoint"] for r, _, _ in results}):
+        rows = [(r, e, s) for r, e, s in results if r["endpoint"] == endpoint]
+        replayed = [e for _, e, _ in rows]
+        recorded = [r["seconds"] for r, _, _ in rows]
+        status_counts = {}
+        for _, _, status in rows:
+            status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "p50_ms": ms(replayed, 50),
+            "p95_ms": ms(replayed, 95),
+            "p99_ms": ms(replayed, 99),
+            "recorded_p50_ms": ms(recorded, 50),
+            "recorded_p95_ms": ms(recorded, 95),
+            "recorded_p99_ms": ms(recorded, 99),
+            "status_changed": sum(1 for r, _, s in rows if s != r["status"]),
+            "status_counts": status_counts,
+        }
+    return {"requests": len(results), "wall_seconds": round(wall, 2), "endpoints": endpoints}
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old_endpoints = baseline["summary"]["endpoints"]
+    print(f"\nvs {baseline.get('commit')} ({os.path.basename(baseline_path)})")
+    print(f"{'endpoint':>14} {'p50':>16} {'p95':>16} {'p99':>16}")
+    for endpoint, row in current["summary"]["endpoints"].items():
+        old = old_endpoints.get(endpoint)
+        if not old:
+            continue
+        cells = [_delta(row[key], old[key]) for key in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{endpoint:>14} " + " ".join(f"{c:>16}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("capture", help="JSONL written with CAPTURE_ENABLED=1")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Time compression: 10 = ten times faster, 0 = all at once")
+    parser.add_argument("--url", help="Replay against an already running server (started with REPLAY_FILE)")
+    parser.add_argument("--port", type=int, default=10098)
+    parser.add_argument("--asgi", action="store_true", help="Serve asgi.py with uvicorn instead of gunicorn")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--image", default=os.path.join(ROOT, "uploads", "sample.jpg"),
+                        help="Photo the stand-in uploads are made from")
+    parser.add_argument("--timeout", type=float, default=130)
+    parser.add_argument("--output", help="Result file (default bench/results/replay-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier replay result file to diff against")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)
+    if not records:
+        raise SystemExit(f"No requests in {args.capture}")
+    span = records[-1]["t"] - records[0]["t"]
+    print(f"▶ Replaying {len(records)} requests recorded over {span:.0f}s at {args.speed:g}x")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    proc = None
+    base_url = args.url
+    if not base_url:
+        os.environ.update({
+            "REPLAY_FILE": os.path.abspath(args.capture),
+            "REPLAY_SPEED": str(args.speed),
+            "CAPTURE_ENABLED": "0",
+        })
+        # Calls the original requests didn't make get loadtest's default fakes
+        server_args = argparse.Namespace(
+            asgi=args.asgi, workers=args.workers, threads=args.threads, gemini_latency_ms=1500,
+            gemini_error_rate=0.0, gemini_429_rate=0.0, gemini_missing="", tts_latency_ms=600,
+            tts_error_rate=0.0)
+        proc, base_url = start_server(server_args, args.port)
+
+    try:
+        results, wall = replay(Replayer(base_url, args.image, args.timeout), records, args.speed)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    summary = summarize(results, wall)
+    for endpoint, row in summary["endpoints"].items():
+        print(f"  {endpoint:<14} {row['requests']} req, p50 {row['p50_ms']} ms (recorded "
+              f"{row['recorded_p50_ms']}), p95 {row['p95_ms']} ms ({row['recorded_p95_ms']}), "
+              f"p99 {row['p99_ms']} ms ({row['recorded_p99_ms']}), status changed {row['status_changed']}")
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "summary": summary,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"replay-{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 Saved {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Speech synthesis latency per TTS backend and language
+
+Runs every backend in tts.py on a short prescription sentence in each
+language of LANG_CODE_MAP, then the transcoding stage (AUDIO_FORMAT), and
+reports p50/p95 synthesis and transcode time, failures, bytes before and after
+transcoding, plus "auto": tts.synthesize() with the configured TTS_POLICY and
+fallback.
+
+Time to first audio is estimated for a slow link (--link-kbps, default 2G/EDGE):
+synthesis + transcode + downloading the first --first-audio-kb (what a
+browser buffers before it starts playing a Range-served file). Download is the
+whole file over the same link.
+
+    python bench/tts_bench.py --repeat 5
+    python bench/tts_bench.py --backends espeak --languages Hindi,Tamil --format opus
+    python bench/tts_bench.py --fake --tts-latency-ms 800     # fake gTTS, no network
+
+Audio goes to a temporary directory. Every run is written to
+bench/results/tts-<commit>-<timestamp>.json.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadtest import RESULTS_DIR, git_commit, percentile  # noqa: E402
+
+# What the audio guide says about one medicine, in each language
+SAMPLES = {
+    "English": "Paracetamol 500mg. For fever and pain. Dosage: 1-0-1. One tablet in the morning and one at night, after food.",
+    "Hindi": "पैरासिटामोल 500 मिलीग्राम। बुखार और दर्द के लिए। सुबह एक गोली और रात को एक गोली, खाने के बाद।",
+    "Tamil": "பாராசிட்டமால் 500 மில்லிகிராம். காய்ச்சல் மற்றும் வலிக்கு. காலை ஒன்று, இரவு ஒன்று, உணவுக்குப் பிறகு.",
+    "Telugu": "పారాసిటమాల్ 500 మిల్లీగ్రాములు. జ్వరం మరియు నొప్పికి. ఉదయం ఒకటి, రాత్రి ఒకటి, భోజనం తర్వాత.",
+    "Kannada": "ಪ್ಯಾರಸಿಟಮಾಲ್ 500 ಮಿಲಿಗ್ರಾಂ. ಜ್ವರ ಮತ್ತು ನೋವಿಗೆ. ಬೆಳಿಗ್ಗೆ ಒಂದು, ರಾತ್ರಿ ಒಂದು, ಊಟದ ನಂತರ.",
+    "Malayalam": "പാരസെറ്റമോൾ 500 മില്ലിഗ്രാം. പനിക്കും വേദനയ്ക്കും. രാവിലെ ഒന്ന്, രാത്രി ഒന്ന്, ഭക്ഷണത്തിന് ശേഷം.",
+}
+
+
+def measure(run, transcode, folder, repeat, link_kbps, first_audio_kb):
+    """Call run() `repeat` times (it returns the synthesized file's name), then transcode() on each result"""
+    link_bytes_per_second = link_kbps * 1000 / 8.0
+    synth, transcoding, first_audio, download = [], [], [], []
+    raw_sizes, sizes, errors = [], [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            filename = run()
+        except Exception as e:
+            errors.append(str(e)[:200])
+            continue
+        synthesized = time.perf_counter()
+        raw_sizes.append(os.path.getsize(os.path.join(folder, filename)))
+        filename = transcode(filename)
+        finished = time.perf_counter()
+        size = os.path.getsize(os.path.join(folder, filename))
+
+        synth.append(synthesized - started)
+        transcoding.append(finished - synthesized)
+        sizes.append(size)
+        first_audio.append(finished - started + min(size, first_audio_kb * 1024) / link_bytes_per_second)
+        download.append(size / link_bytes_per_second)
+
+    def ms(values, pct):
+        value = percentile(sorted(values), pct)
+        return None if value is None else round(value * 1000, 1)
+
+    def kb(values):
+        return round(sum(values) / len(values) / 1024, 1) if values else None
+
+    return {
+        "calls": repeat,
+        "errors": len(errors),
+        "p50_ms": ms(synth, 50),
+        "p95_ms": ms(synth, 95),
+        "transcode_p50_ms": ms(transcoding, 50),
+        "raw_kb": kb(raw_sizes),
+        "audio_kb": kb(sizes),
+        "first_audio_p50_ms": ms(first_audio, 50),
+        "download_p50_ms": ms(download, 50),
+        "error_samples": errors[:3],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--backends", help="Comma-separated backends (default: TTS_BACKENDS)")
+    parser.add_argument("--languages", help="Comma-separated languages (default: all of LANG_CODE_MAP)")
+    parser.add_argument("--repeat", type=int, default=3, help="Syntheses per backend and language")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--format", help="Transcode target: mp3, opus or off (default: AUDIO_FORMAT)")
+    parser.add_argument("--link-kbps", type=float, default=50, help="Client bandwidth for time to first audio")
+    parser.add_argument("--first-audio-kb", type=float, default=8,
+                        help="Bytes buffered before playback starts")
+    parser.add_argument("--fake", action="store_true", help="Use the fake gTTS from bench/fakes")
+    parser.add_argument("--tts-latency-ms", type=float, default=600, help="Median latency of the fake gTTS")
+    parser.add_argument("--output", help="Result file (default bench/results/tts-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    # Importing the app writes its session secret; keep that out of instance/
+    os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="tts-bench-"))
+    if args.fake:
+        os.environ["FAKE_TTS_LATENCY_MS"] = str(args.tts_latency_ms)
+        from fakes import install
+        install()
+
+    import tts
+    from app import LANG_CODE_MAP
+
+    audio_format = args.format or tts.AUDIO_FORMAT
+    if audio_format in tts.AUDIO_FORMATS and tts.FFMPEG is None:
+        print("⚠️ ffmpeg not found: files are measured as synthesized")
+
+    backends = tts.load_backends(args.backends.split(",")) if args.backends else tts.BACKENDS
+    languages = args.languages.split(",") if args.languages else list(LANG_CODE_MAP)
+    folder = tempfile.mkdtemp(prefix="tts-audio-")
+
+    def direct(backend, lang_code, text):
+        def run():
+            filename = f"{backend.name}-{time.perf_counter_ns()}{backend.extension}"
+            backend.synthesize(text, lang_code, os.path.join(folder, filename), args.timeout)
+            return filename
+        return run
+
+    def auto(lang_code, text):
+        return lambda: tts.synthesize(text, lang_code, folder)
+
+    def transcode(filename):
+        return tts.transcode(folder, filename, audio_format)
+
+    rows = []
+    try:
+        for language in languages:
+            lang_code = LANG_CODE_MAP[language]
+            text = SAMPLES[language]
+            runs = [(b.name, direct(b, lang_code, text)) for b in backends if b.available(lang_code)]
+            runs.append(("auto", auto(lang_code, text)))
+            for name in (b.name for b in backends if not b.available(lang_code)):
+                print(f"  {name:<8} {language:<10} unavailable")
+                rows.append({"backend": name, "language": language, "available": False})
+            for name, run in runs:
+                row = {"backend": name, "language": language, "available": True,
+                       **measure(run, transcode, folder, args.repeat, args.link_kbps, args.first_audio_kb)}
+                print(f"  {name:<8} {language:<10} p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms, "
+                      f"transcode {row['transcode_p50_ms']} ms, {row['raw_kb']} -> {row['audio_kb']} KB, "
+                      f"first audio {row['first_audio_p50_ms']} ms, download {row['download_p50_ms']} ms, "
+                      f"errors {row['errors']}/{row['calls']}")
+                rows.append(row)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "policy": tts.TTS_POLICY,
+        "audio_format": audio_format,
+        "rows": rows,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"tts-{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"📄 Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
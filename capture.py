@@ -0,0 +1,249 @@
+"""
+Traffic capture for offline replay (CAPTURE_ENABLED)
+Writes one JSON line per scan, /ask and /speak request to CAPTURE_FILE: when
+it arrived, what it asked for and how long it took, each stage's timing, and
+every Gemini and gTTS call it made with its latency and answer (or error).
+bench/replay.py sends the same traffic to a test server and plays the
+recorded answers back, so caching, routing and concurrency changes can be
+compared on real traffic offline.
+
+Nothing that identifies the user is kept: no cookies, addresses or headers.
+Photos and free text are stored as a SHA-256 prefix plus their size, so
+repeats stay repeats in a replay. The model answers are kept as they are
+(replay needs them), which makes the file patient data.
+
+Upstream calls are recorded by wrapping google.generativeai and gtts in
+sys.modules, the same way bench/fakes swaps them, so the app code is unchanged.
+"""
+
+import atexit
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import types
+
+import telemetry
+from config import CAPTURE_ENABLED, CAPTURE_FILE
+
+ENABLED = CAPTURE_ENABLED
+
+CAPTURED_ENDPOINTS = {"index", "api_analyze", "show_result", "ask_question", "speak"}
+# Request fields kept as sent; any other text is replaced by its hash and length
+PLAIN_FIELDS = {"language", "fields", "warnings"}
+IMAGE_FIELDS = ("image", "image_camera")
+USAGE_FIELDS = ("prompt_token_count", "candidates_token_count", "thoughts_token_count", "total_token_count")
+# Hash prefix length: enough to tell inputs apart, too short to look anything up
+DIGEST_CHARS = 16
+
+_record = contextvars.ContextVar("capture_record", default=None)
+_fd = None
+# Lines wait here for the writer thread, so no response (or event loop) waits on the disk
+_lines = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def digest(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:DIGEST_CHARS]
+
+
+def anonymize(value):
+    """Shape of a request value: hash and size of text and lists, numbers and flags as they are"""
+    if isinstance(value, str):
+        return {"sha256": digest(value), "chars": len(value)}
+    if isinstance(value, (list, dict)):
+        return {"sha256": digest(json.dumps(value, sort_keys=True, ensure_ascii=False)), "items": len(value)}
+    return value
+
+
+# --- Request scope (before_request / after_request) ---
+
+def begin(request):
+    if not ENABLED or request.endpoint not in CAPTURED_ENDPOINTS:
+        return
+    _record.set({
+        "t": round(time.time(), 3),
+        "started": time.perf_counter(),
+        "request_id": telemetry.request_id(),
+        "upstream": [],
+        "stages": telemetry.collect_stages(),
+    })
+
+
+def end(request, response, session_language):
+    record = _record.get()
+    if record is None:
+        return
+    _record.set(None)
+    try:
+        # A copy: a dropped hedge call may still add itself to the original
+        record = {k: v for k, v in record.items() if k != "started"} | {
+            "seconds": round(time.perf_counter() - record["started"], 4),
+            "upstream": list(record["upstream"]),
+            "method": request.method, "path": request.path, "endpoint": request.endpoint,
+            "status": response.status_code, "session_language": session_language,
+        }
+        if response.status_code in (301, 302, 303, 307, 308):
+            record["location"] = response.headers.get("Location")
+        if request.form:
+            record["form"] = {k: v if k in PLAIN_FIELDS else anonymize(v) for k, v in request.form.items()}
+        images = [_image(request.files[field]) for field in IMAGE_FIELDS if field in request.files]
+        if images:
+            record["image"] = images[0]
+        body = request.get_json(silent=True) if request.is_json else None
+        if isinstance(body, dict):
+            record["json"] = {k: v if k in PLAIN_FIELDS else anonymize(v) for k, v in body.items()}
+        _write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+    except Exception as e:
+        print(f"⚠️ Capture failed: {e}")
+
+
+def _image(upload):
+    stream = upload.stream
+    stream.seek(0)
+    sha, size = hashlib.sha256(), 0
+    for chunk in iter(lambda: stream.read(1 << 16), b""):
+        sha.update(chunk)
+        size += len(chunk)
+    return {"sha256": sha.hexdigest()[:DIGEST_CHARS], "bytes": size, "type": upload.mimetype}
+
+
+def _write(line):
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                # Started on first use, i.e. after gunicorn has forked
+                _writer = threading.Thread(target=_drain, name="capture-writer", daemon=True)
+                _writer.start()
+                atexit.register(flush)
+    _lines.put(line)
+
+
+def _drain():
+    global _fd
+    while True:
+        line = _lines.get()
+        try:
+            if _fd is None:
+                os.makedirs(os.path.dirname(CAPTURE_FILE) or ".", exist_ok=True)
+                _fd = os.open(CAPTURE_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            # O_APPEND: each line lands whole even with several workers writing
+            os.write(_fd, line.encode("utf-8"))
+        except Exception as e:
+            print(f"⚠️ Capture failed: {e}")
+        finally:
+            _lines.task_done()
+
+
+def flush():
+    """Wait until every queued line is in CAPTURE_FILE"""
+    if _writer is not None:
+        _lines.join()
+
+
+def _upstream(entry, started):
+    record = _record.get()
+    if record is None:
+        return
+    entry["seconds"] = round(time.perf_counter() - started, 4)
+    entry["at"] = round(started - record["started"], 4)
+    record["upstream"].append(entry)
+
+
+# --- Upstream recording ---
+
+def _model_call(model, started, response=None, error=None):
+    entry = {"kind": "gemini", "model": model}
+    if error is not None:
+        entry["error"] = str(error)[:500]
+    else:
+        try:
+            entry["text"] = response.text
+        except Exception:  # blocked answers raise instead of returning text
+            entry["text"] = None
+        meta = getattr(response, "usage_metadata", None)
+        if meta is not None:
+            entry["usage"] = {field: int(getattr(meta, field, 0) or 0) for field in USAGE_FIELDS}
+    _upstream(entry, started)
+
+
+def _recording_model(base):
+    class RecordingModel(base):
+        def __init__(self, model_name, *args, **kwargs):
+            super().__init__(model_name, *args, **kwargs)
+            self._captured_name = model_name
+
+        def generate_content(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = super().generate_content(*args, **kwargs)
+            except Exception as e:
+                _model_call(self._captured_name, started, error=e)
+                raise
+            _model_call(self._captured_name, started, response=response)
+            return response
+
+        async def generate_content_async(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = await super().generate_content_async(*args, **kwargs)
+            except Exception as e:
+                _model_call(self._captured_name, started, error=e)
+                raise
+            _model_call(self._captured_name, started, response=response)
+            return response
+
+    return RecordingModel
+
+
+def _recording_gtts(base):
+    class RecordingGTTS(base):
+        def save(self, savefile):
+            started = time.perf_counter()
+            try:
+                super().save(savefile)
+            except Exception as e:
+                _upstream({"kind": "gtts", "lang": self.lang, "error": str(e)[:500]}, started)
+                raise
+            _upstream({"kind": "gtts", "lang": self.lang, "bytes": os.path.getsize(savefile)}, started)
+
+    return RecordingGTTS
+
+
+class _Wrapped(types.ModuleType):
+    """A module with some attributes replaced; everything else comes from the original"""
+
+    def __init__(self, original, **replaced):
+        super().__init__(original.__name__, original.__doc__)
+        self.__dict__.update(replaced)
+        self._original = original
+
+    def __getattr__(self, name):
+        return getattr(self._original, name)
+
+
+def install():
+    """Record Gemini and gTTS calls from here on (wraps whatever is installed, fakes included)"""
+    if not ENABLED:
+        return
+    import google
+    import google.generativeai as genai
+    if not isinstance(genai, _Wrapped):
+        wrapped = _Wrapped(genai, GenerativeModel=_recording_model(genai.GenerativeModel))
+        google.generativeai = wrapped
+        sys.modules["google.generativeai"] = wrapped
+    try:
+        import gtts
+    except ImportError:
+        gtts = None
+    if gtts is not None and not isinstance(gtts, _Wrapped):
+        sys.modules["gtts"] = _Wrapped(gtts, gTTS=_recording_gtts(gtts.gTTS))
+    print(f"🎙️ Capturing traffic to {CAPTURE_FILE}")
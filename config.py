@@ -5,6 +5,7 @@ Supports both local development (key.json) and production (environment variables
 
 import os
 import json
+import time
 
 def get_api_key():
     """
@@ -33,3 +34,162 @@ def get_api_key():
     
     print("❌ API key not found in environment or key.json")
     return None
+
+def env_flag(name, default=False):
+    """
+    Read an on/off switch from the environment
+    Accepts 1/true/yes/on (any case); anything else is off
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# Per-stage timings + /metrics endpoint (off by default, near-zero cost when off)
+METRICS_ENABLED = env_flag("METRICS_ENABLED")
+# Print one line per span (noisy, for local debugging); works with METRICS_ENABLED off too
+METRICS_LOG_SPANS = env_flag("METRICS_LOG_SPANS")
+
+# Local state shared by all workers (SQLite files etc.)
+DATA_DIR = os.environ.get("DATA_DIR", "instance")
+
+# Gemini quota admission control (see ratelimit.py)
+RATE_LIMIT_ENABLED = env_flag("RATE_LIMIT_ENABLED", default=True)
+# How long a caller may queue for quota before it is turned away with "busy, retry in N s"
+SCAN_MAX_QUEUE_SECONDS = float(os.environ.get("SCAN_MAX_QUEUE_SECONDS", "15"))
+CHAT_MAX_QUEUE_SECONDS = float(os.environ.get("CHAT_MAX_QUEUE_SECONDS", "3"))
+# Share of each model's quota that chat/translation must leave free for scans
+CHAT_QUOTA_RESERVE = float(os.environ.get("CHAT_QUOTA_RESERVE", "0.2"))
+
+def get_secret_key():
+    """
+    Flask session signing key, identical in every gunicorn worker and across restarts
+    Priority: SECRET_KEY env > key.json "secret_key" > generated once into DATA_DIR/secret_key
+    """
+    secret = os.environ.get("SECRET_KEY")
+    if secret:
+        return secret
+
+    try:
+        with open('key.json', 'r') as f:
+            secret = json.load(f).get('secret_key')
+            if secret:
+                return secret
+    except Exception:
+        pass
+
+    path = os.path.join(DATA_DIR, "secret_key")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    try:
+        # O_EXCL: if workers race on first boot, exactly one writes the key
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(os.urandom(32).hex())
+        print(f"🔑 Generated session secret in {path}")
+    except FileExistsError:
+        pass
+    for _ in range(50):
+        with open(path) as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+        time.sleep(0.01)  # another worker is still writing it
+    raise RuntimeError(f"Session secret file {path} is empty")
+
+# Cross-worker caches (see shared_cache.py); TTLs in seconds, 0 disables a cache
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", str(24 * 3600)))
+AUDIO_CACHE_TTL = int(os.environ.get("AUDIO_CACHE_TTL", str(24 * 3600)))
+TRANSLATION_CACHE_TTL = int(os.environ.get("TRANSLATION_CACHE_TTL", str(7 * 24 * 3600)))
+
+# asyncio serving mode (asgi.py)
+# Scans processed at once per process; more wait in line (bounds decoded image memory)
+ASYNC_MAX_SCANS = int(os.environ.get("ASYNC_MAX_SCANS", "200"))
+# Threads for blocking work: image decoding, text-to-speech, plain Flask routes
+ASYNC_BLOCKING_THREADS = int(os.environ.get("ASYNC_BLOCKING_THREADS", "32"))
+# Largest request body the async routes will buffer
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Request bodies buffered at once per process (bytes); more wait before being read
+ASYNC_MAX_BUFFERED_BYTES = int(os.environ.get("ASYNC_MAX_BUFFERED_BYTES", str(256 * 1024 * 1024)))
+
+# Hedged scan calls (see hedging.py): if a model hasn't answered by its usual
+# HEDGE_PERCENTILE latency, ask the next model too and keep the first answer
+HEDGE_ENABLED = env_flag("HEDGE_ENABLED")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.9"))
+# Delay used until a model has enough recorded calls to estimate the percentile
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "8"))
+# At most this many hedges per primary call (0.1 = 10% extra quota at worst)
+HEDGE_MAX_RATE = float(os.environ.get("HEDGE_MAX_RATE", "0.1"))
+# Threads for hedged calls under gunicorn: a primary and a hedge per request thread,
+# plus as many losing calls still running (they can't be stopped)
+HEDGE_POOL_THREADS = int(os.environ.get(
+    "HEDGE_POOL_THREADS", str(4 * int(os.environ.get("GUNICORN_THREADS", "4")))))
+
+# End-to-end time budget per request (see deadline.py). Keep it below the
+# gunicorn timeout (120 s) so requests answer before the worker is killed.
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "100"))
+# Part of a scan's budget kept back for text-to-speech and rendering
+TTS_RESERVE_SECONDS = float(os.environ.get("TTS_RESERVE_SECONDS", "10"))
+
+# Text-to-speech (see tts.py): backends in order of preference, and how to pick
+# between them per language: "quality" keeps the order (gTTS voices sound better),
+# "latency" tries whichever has been fastest for that language first
+TTS_BACKENDS = [b.strip() for b in os.environ.get("TTS_BACKENDS", "gtts,espeak").split(",") if b.strip()]
+TTS_POLICY = os.environ.get("TTS_POLICY", "quality")
+# espeak-ng processes run at once per worker; more wait for a free one
+TTS_LOCAL_PROCESSES = int(os.environ.get("TTS_LOCAL_PROCESSES", str(os.cpu_count() or 2)))
+# After a failure a backend is tried last for this many seconds
+TTS_FAILURE_COOLDOWN = float(os.environ.get("TTS_FAILURE_COOLDOWN", "60"))
+
+# Speech is re-encoded after synthesis for slow (2G) connections: "mp3" (plays
+# everywhere), "opus" (about half the bytes, Ogg Opus) or "off". Needs ffmpeg.
+# gTTS already sends 32 kbps MP3, so in "mp3" mode only espeak-ng output is re-encoded.
+AUDIO_FORMAT = os.environ.get("AUDIO_FORMAT", "mp3")
+# Bitrate for the re-encoded mono audio (default 32k for mp3, 16k for opus)
+AUDIO_BITRATE = os.environ.get("AUDIO_BITRATE", "")
+# Browser cache lifetime of generated audio (design.md 7.3: one hour)
+AUDIO_CACHE_MAX_AGE = int(os.environ.get("AUDIO_CACHE_MAX_AGE", "3600"))
+
+# Warm startup (see warmup.py): import the SDKs, load PIL codecs and compile
+# templates before taking traffic instead of on the first request
+WARMUP_ENABLED = env_flag("WARMUP_ENABLED", default=True)
+# Also ask Gemini which models this key can use (one list_models call per worker)
+WARMUP_CHECK_MODELS = env_flag("WARMUP_CHECK_MODELS", default=True)
+# Result pages (POST-redirect-GET permalinks, also used for shared links)
+RESULT_PAGE_TTL = int(os.environ.get("RESULT_PAGE_TTL", str(7 * 24 * 3600)))
+
+# Image quality gate (see quality.py): reject photos that can't be read
+# before spending a model call on them. Scores are measured on a 512 px copy.
+QUALITY_GATE_ENABLED = env_flag("QUALITY_GATE_ENABLED", default=True)
+# Mean brightness 0-255 outside this range: too dark / washed out
+QUALITY_MIN_BRIGHTNESS = float(os.environ.get("QUALITY_MIN_BRIGHTNESS", "40"))
+QUALITY_MAX_BRIGHTNESS = float(os.environ.get("QUALITY_MAX_BRIGHTNESS", "245"))
+# Brightness standard deviation below this: an empty, featureless frame
+QUALITY_MIN_CONTRAST = float(os.environ.get("QUALITY_MIN_CONTRAST", "8"))
+# Variance of the Laplacian; sharp phone photos of text score in the hundreds
+QUALITY_MIN_SHARPNESS = float(os.environ.get("QUALITY_MIN_SHARPNESS", "20"))
+# Share of pixels on strong edges; any page of writing is well above this
+QUALITY_MIN_TEXT_DENSITY = float(os.environ.get("QUALITY_MIN_TEXT_DENSITY", "0.005"))
+
+# Find the page in the photo, straighten it and crop the background (see document.py)
+DOCUMENT_CROP_ENABLED = env_flag("DOCUMENT_CROP_ENABLED", default=True)
+# Send a small image first and the full MAX_IMAGE_SIDE one only when the
+# answer looks incomplete (768 px fits in one Gemini image tile)
+ADAPTIVE_RESOLUTION = env_flag("ADAPTIVE_RESOLUTION", default=True)
+SCAN_START_SIDE = int(os.environ.get("SCAN_START_SIDE", "768"))
+
+# Token accounting per endpoint, model and language (see usage.py, GET /usage)
+USAGE_TRACKING_ENABLED = env_flag("USAGE_TRACKING_ENABLED", default=True)
+# Each worker adds its counts to DATA_DIR/usage.sqlite3 this often
+USAGE_FLUSH_SECONDS = float(os.environ.get("USAGE_FLUSH_SECONDS", "30"))
+# Daily token budgets, e.g. DAILY_TOKEN_BUDGETS='{"gemini-2.5-pro": 2000000}'.
+# Past BUDGET_DOWNGRADE_AT of its budget a model is only tried after the
+# others, with BUDGET_DOWNGRADE_MODEL in front of it; at 100% it is skipped.
+BUDGET_DOWNGRADE_AT = float(os.environ.get("BUDGET_DOWNGRADE_AT", "0.8"))
+BUDGET_DOWNGRADE_MODEL = os.environ.get("BUDGET_DOWNGRADE_MODEL", "gemini-2.0-flash-lite")
+
+# Traffic capture for offline replay (see capture.py, bench/replay.py): one
+# JSON line per scan/ask/speak request with hashed inputs, stage timings and
+# the Gemini/gTTS answers. Off by default; the file holds model answers
+# (medicine lists), so treat it like patient data.
+CAPTURE_ENABLED = env_flag("CAPTURE_ENABLED")
+CAPTURE_FILE = os.environ.get("CAPTURE_FILE", os.path.join(DATA_DIR, "capture.jsonl"))
@@ -0,0 +1,58 @@
+"""
+Per-request deadline
+before_request starts a budget of REQUEST_DEADLINE_SECONDS; the pipeline,
+quota queue, retries, translation and TTS check what is left and skip work
+that cannot finish in time, so the request answers (possibly with a partial
+result) instead of being killed by the gunicorn timeout.
+
+The deadline lives in a contextvar, so it follows the request into
+asyncio tasks and to_thread() calls.
+"""
+
+import contextlib
+import contextvars
+import math
+import time
+
+from config import REQUEST_DEADLINE_SECONDS
+
+# Don't start a model call with less than this left: it would only be cut off
+MIN_MODEL_CALL_SECONDS = 3.0
+MIN_TTS_SECONDS = 2.0
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+def start(seconds=REQUEST_DEADLINE_SECONDS):
+    """Begin a request's budget"""
+    _deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+
+
+def remaining():
+    """Seconds left for this request (inf outside a request or with no deadline)"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return math.inf
+    return max(0.0, deadline - time.monotonic())
+
+
+def allows(seconds):
+    """True if `seconds` of work still fits in the budget"""
+    return remaining() > seconds
+
+
+def timeout():
+    """remaining() for APIs that take a timeout: None when unbounded"""
+    left = remaining()
+    return None if left == math.inf else left
+
+
+@contextlib.contextmanager
+def reserve(seconds):
+    """Run a block with `seconds` held back for the work that follows it"""
+    deadline = _deadline.get()
+    token = _deadline.set(None if deadline is None else deadline - seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
@@ -0,0 +1,226 @@
+"""
+Find the prescription in the photo, straighten it and crop to the page
+Phone photos are often mostly table, hand and background. Working on a small
+grayscale copy, the paper (the bright region) is separated from the
+background with an Otsu threshold, its four corners are taken as the extreme
+points of that region, and the quadrilateral is mapped to an upright
+rectangle. Text skew left after that is measured with a projection profile
+and rotated out.
+
+Pure PIL, a few tens of ms at 1024 px. Whenever the page can't be found
+confidently the photo is used as it is.
+"""
+
+import math
+
+from PIL import Image, ImageFilter
+
+import telemetry
+from config import DOCUMENT_CROP_ENABLED
+
+ENABLED = DOCUMENT_CROP_ENABLED
+
+# Side of the copy used for detection
+WORK_SIDE = 256
+# The paper must cover this share of the frame (less: probably not the page;
+# more: the photo is already cropped, nothing to gain)
+MIN_PAGE_AREA = 0.2
+MAX_PAGE_AREA = 0.9
+# Share of the corner quadrilateral the bright region must fill (else it isn't one sheet)
+MIN_QUAD_FILL = 0.85
+# Corners this close to the frame edge (share of the side) mean the page runs off
+# the photo, or shading split it; with two of them the crop would cut writing off
+EDGE_MARGIN = 0.03
+
+# Skew search range and step (degrees); smaller angles are left alone
+MAX_SKEW = 10.0
+SKEW_STEP = 0.5
+MIN_SKEW = 1.0
+# How much more peaked than upright a rotated profile must be to count
+SKEW_GAIN = 1.2
+# ...and than the same amount of ink scattered at random (noise, texture: ~1.5; text: 100+)
+MIN_PROFILE_CONTRAST = 10.0
+DESKEW_SIDE = 400
+
+DOCUMENT_RESULTS = telemetry.Counter(
+    "clearscript_document_total", "Document detection outcome per scan", ("result",))
+telemetry.METRICS.append(DOCUMENT_RESULTS)
+
+
+def otsu_threshold(histogram):
+    """Gray level that best splits a 256-bin histogram into two classes"""
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    weight_bg = sum_bg = 0
+    best_level, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        weight_bg += count
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += level * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def _quad_area(quad):
+    # Shoelace formula
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(quad, quad[1:] + quad[:1]):
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2.0
+
+
+def _grow(mask, size):
+    """MaxFilter(size) of a 0/255 mask: a box mean is non-zero where any pixel is
+    set. BoxBlur costs the same at any size; the rank filter grows with size²."""
+    return mask.filter(ImageFilter.BoxBlur(size // 2)).point(lambda v: 255 if v else 0)
+
+
+def _shrink(mask, size):
+    """MinFilter(size) of a 0/255 mask"""
+    return mask.filter(ImageFilter.BoxBlur(size // 2)).point(lambda v: 255 if v == 255 else 0)
+
+
+def find_page(img):
+    """Corners of the page as (top-left, bottom-left, bottom-right, top-right) in img pixels, or None"""
+    gray = img.convert("L")
+    gray.thumbnail((WORK_SIDE, WORK_SIDE))
+    width, height = gray.size
+
+    level = otsu_threshold(gray.histogram())
+    mask = gray.point(lambda v: 255 if v > level else 0)
+    # Close the holes left by the writing, then drop small bright specks
+    mask = _shrink(_grow(mask, 5), 5)
+    mask = _grow(_shrink(mask, 9), 9)
+
+    # Extreme points of the bright region: min/max of x+y and x-y give the corners.
+    # Along a row both are smallest at its first bright pixel and largest at its
+    # last one, so only those are looked at (found in C by bytes.find/rfind).
+    pixels = mask.tobytes()
+    count = mask.histogram()[255]
+    tl = br = tr = bl = None
+    for y in range(height):
+        row = y * width
+        first = pixels.find(b"\xff", row, row + width)
+        if first < 0:
+            continue
+        first -= row
+        last = pixels.rfind(b"\xff", row, row + width) - row
+        if tl is None or first + y < tl[0]:
+            tl = (first + y, first, y)
+        if br is None or last + y > br[0]:
+            br = (last + y, last, y)
+        if tr is None or last - y > tr[0]:
+            tr = (last - y, last, y)
+        if bl is None or first - y < bl[0]:
+            bl = (first - y, first, y)
+
+    area = count / float(width * height)
+    if not MIN_PAGE_AREA <= area <= MAX_PAGE_AREA:
+        return None
+    quad = [(p[1], p[2]) for p in (tl, bl, br, tr)]
+    quad_area = _quad_area(quad)
+    if quad_area <= 0 or count / quad_area < MIN_QUAD_FILL:
+        return None
+    margin_x, margin_y = EDGE_MARGIN * width, EDGE_MARGIN * height
+    on_edge = sum(
+        1 for x, y in quad
+        if x < margin_x or y < margin_y or x > width - 1 - margin_x or y > height - 1 - margin_y)
+    if on_edge >= 2:
+        return None
+
+    scale_x = img.size[0] / float(width)
+    scale_y = img.size[1] / float(height)
+    return [(x * scale_x, y * scale_y) for x, y in quad]
+
+
+def _distance(a, b):
+    return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
+
+
+def crop_to_page(img, quad):
+    """Map the page quadrilateral onto an upright rectangle"""
+    tl, bl, br, tr = quad
+    width = int((_distance(tl, tr) + _distance(bl, br)) / 2)
+    height = int((_distance(tl, bl) + _distance(tr, br)) / 2)
+    data = tuple(c for point in quad for c in point)
+    return img.transform((width, height), Image.Transform.QUAD, data, Image.Resampling.BICUBIC)
+
+
+def skew_angle(img):
+    """Rotation (degrees) that makes the text lines horizontal: the angle whose
+    row profile of dark pixels is most peaked. 0 unless another angle beats
+    the upright profile by SKEW_GAIN and has text-like contrast (blank, uniform
+    and noisy areas stay as they are)"""
+    gray = img.convert("L")
+    gray.thumbnail((DESKEW_SIDE, DESKEW_SIDE))
+    level = otsu_threshold(gray.histogram())
+    ink = gray.point(lambda v: 255 if v < level else 0)
+
+    # Score every angle on the same central box, one that stays inside the frame
+    # at MAX_SKEW: the filled-in corners of a rotation would otherwise count as profile
+    width, height = ink.size
+    sin, cos = _sin_cos(MAX_SKEW)
+    scale = min(height / (width * sin + height * cos), width / (width * cos + height * sin))
+    box_width, box_height = int(width * scale), int(height * scale)
+    left, top = (width - box_width) // 2, (height - box_height) // 2
+    box = (left, top, left + box_width, top + box_height)
+
+    def score(angle):
+        rotated = ink.rotate(angle, resample=Image.Resampling.NEAREST, fillcolor=0).crop(box)
+        # Row means in one C call
+        rows = rotated.resize((1, box_height), Image.Resampling.BOX).tobytes()
+        mean = sum(rows) / float(box_height)
+        return sum((r - mean) ** 2 for r in rows)
+
+    best_angle = 0.0
+    upright = best_score = score(0.0)
+    steps = int(MAX_SKEW / SKEW_STEP)
+    for i in range(-steps, steps + 1):
+        if i == 0:
+            continue
+        angle = i * SKEW_STEP
+        angle_score = score(angle)
+        if angle_score > best_score:
+            best_angle, best_score = angle, angle_score
+    # Row variance random pixels would give: each row mean is a sample of box_width pixels
+    share = ink.crop(box).histogram()[255] / float(box_width * box_height)
+    noise_floor = box_height * 255 ** 2 * share * (1 - share) / box_width
+    if best_score <= upright * SKEW_GAIN or best_score < noise_floor * MIN_PROFILE_CONTRAST:
+        return 0.0
+    return best_angle
+
+
+def _sin_cos(degrees):
+    radians = math.radians(degrees)
+    return math.sin(radians), math.cos(radians)
+
+
+def straighten(img):
+    """Crop to the page and deskew when it helps; returns the new image (or img)"""
+    if not ENABLED:
+        return img
+    with telemetry.span("document"):
+        outcome = []
+        quad = find_page(img)
+        if quad:
+            img = crop_to_page(img, quad)
+            outcome.append("cropped")
+
+        angle = skew_angle(img)
+        if abs(angle) >= MIN_SKEW:
+            img = img.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor="white")
+            outcome.append("deskewed")
+
+    result = "+".join(outcome) or "unchanged"
+    telemetry.count(DOCUMENT_RESULTS, result)
+    if outcome:
+        print(f"📄 Document {result} ({angle:+.1f}°): {img.size}")
+    return img
@@ -1,3 +1,4 @@
+import gc
 import multiprocessing
 import os
 
@@ -5,13 +6,40 @@ import os
 bind = "0.0.0.0:" + os.environ.get("PORT", "10000")
 
 # Worker Options
-workers = 1
-threads = 4
+# WEB_CONCURRENCY > 1 is safe: the session secret comes from config.py and the
+# caches / quota buckets live in SQLite under DATA_DIR, shared by all workers.
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
 worker_class = "gthread"
 timeout = 120
 keepalive = 5
 
+# Import the app once in the master and fork workers from it
+preload_app = True
+
 # Logging
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
+
+
+def when_ready(server):
+    # Pay for the lazy imports (Gemini SDK, gTTS, PIL codecs, templates) once
+    # here, so no worker's first request does. See warmup.py.
+    from config import WARMUP_ENABLED
+    if WARMUP_ENABLED:
+        import warmup
+        warmup.warm_up()
+
+    # Move everything loaded so far (Flask, templates, translations) out of the
+    # GC's reach, so collections in workers don't touch and copy those pages.
+    gc.collect()
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Model availability check: runs before this worker accepts connections
+    from config import WARMUP_ENABLED
+    if WARMUP_ENABLED:
+        import warmup
+        warmup.warm_worker()
@@ -0,0 +1,140 @@
+"""
+Hedged Gemini calls
+A scan that is slower than a model's usual HEDGE_PERCENTILE latency is sent to
+the next model as well and the first valid answer wins. Under asyncio
+(asgi.py) the other call is cancelled. In the threaded server it can't be: it
+keeps its pool thread and its quota slot until it finishes, and only its
+answer is ignored. Per-model latencies come from recent calls in this process.
+
+Hedges are capped by a budget: every primary call earns HEDGE_MAX_RATE of a
+hedge, and a hedge also needs a free quota slot on the second model right now,
+so hedging never pushes a model into 429s.
+"""
+
+import asyncio
+import collections
+import threading
+
+import telemetry
+from config import HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_DEFAULT_DELAY, HEDGE_MAX_RATE
+from ratelimit import admit_now, RateLimited, SCAN
+
+ENABLED = HEDGE_ENABLED
+
+# Recent successful call durations kept per model
+WINDOW = 200
+# Below this many samples the percentile is noise; use HEDGE_DEFAULT_DELAY
+MIN_SAMPLES = 20
+# Unused hedges carried over, so a short burst of slow calls can all be hedged
+MAX_CREDIT = 2.0
+
+HEDGES = telemetry.Counter(
+    "clearscript_hedges_total", "Hedged scan calls by outcome", ("outcome",))
+telemetry.METRICS.append(HEDGES)
+
+
+class LatencyTracker:
+    """Sliding window of call durations per model"""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = collections.deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, model, q):
+        """q-th quantile of recent durations, or None with too few samples"""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class HedgeBudget:
+    """Allows at most `rate` hedges per primary call"""
+
+    def __init__(self, rate, max_credit=MAX_CREDIT):
+        self.rate = rate
+        self.max_credit = max_credit
+        self.credit = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.credit = min(self.max_credit, self.credit + self.rate)
+
+    def spend(self):
+        with self._lock:
+            if self.credit < 1.0:
+                return False
+            self.credit -= 1.0
+            return True
+
+    def refund(self):
+        with self._lock:
+            self.credit += 1.0
+
+
+latencies = LatencyTracker()
+budget = HedgeBudget(HEDGE_MAX_RATE)
+
+
+def record(model, seconds):
+    """A call to `model` answered successfully in `seconds`"""
+    latencies.record(model, seconds)
+
+
+def delay(model):
+    """How long to wait on `model` before hedging"""
+    observed = latencies.percentile(model, HEDGE_PERCENTILE)
+    return HEDGE_DEFAULT_DELAY if observed is None else observed
+
+
+def primary_started():
+    budget.earn()
+
+
+def try_hedge(model):
+    """True if a hedge on `model` may be sent now (budget and quota both allow it)"""
+    if not budget.spend():
+        telemetry.count(HEDGES, "over_budget")
+        return False
+    try:
+        admit_now(model, SCAN)
+    except RateLimited:
+        budget.refund()
+        telemetry.count(HEDGES, "no_quota")
+        return False
+    telemetry.count(HEDGES, "sent")
+    return True
+
+
+async def try_hedge_async(model):
+    """try_hedge() for the asyncio server: the quota booking runs off the event loop"""
+    if not budget.spend():
+        telemetry.count(HEDGES, "over_budget")
+        return False
+    try:
+        await asyncio.to_thread(admit_now, model, SCAN)
+    except RateLimited:
+        budget.refund()
+        telemetry.count(HEDGES, "no_quota")
+        return False
+    telemetry.count(HEDGES, "sent")
+    return True
+
+
+def next_model(models, model):
+    """The model to hedge `model` with: the next one in the fallback order"""
+    try:
+        index = models.index(model)
+    except ValueError:
+        return None
+    return models[index + 1] if index + 1 < len(models) else None
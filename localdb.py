@@ -0,0 +1,31 @@
+"""
+Small SQLite helper for state shared between gunicorn workers
+Each thread gets its own connection, and a connection inherited through
+fork is never reused (the child opens a fresh one).
+"""
+
+import os
+import sqlite3
+import threading
+
+from config import DATA_DIR
+
+
+class LocalDB:
+    def __init__(self, filename, schema):
+        self.path = os.path.join(DATA_DIR, filename)
+        self.schema = schema
+        self._local = threading.local()
+
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Autocommit; callers use BEGIN IMMEDIATE for read-modify-write
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.schema)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
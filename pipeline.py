@@ -1,6 +1,39 @@
-from PIL import Image, ImageEnhance, ImageFilter
-import json, os, time, io
-from config import get_api_key
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+import asyncio, contextvars, json, os, time, io
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import get_api_key, ADAPTIVE_RESOLUTION, SCAN_START_SIDE, HEDGE_POOL_THREADS
+import telemetry
+import hedging
+import deadline
+import schema
+import quality
+import document
+import usage
+from ratelimit import admit, admit_async, report_quota_error, RateLimited, SCAN
+
+# Longest side (px) of the image sent to the model.
+# The upload form downscales to the same size before sending.
+MAX_IMAGE_SIDE = 1024
+
+# Models to try, in order (using OLD SDK with correct model names)
+SCAN_MODELS = [
+    "gemini-2.5-flash",      # Latest
+    "gemini-2.0-flash",      # Stable
+    "gemini-2.5-pro",        # Most capable
+    "gemini-flash-latest"    # Alias
+]
+ATTEMPTS_PER_MODEL = 3
+
+# Below this schema.confidence(), an answer from the small image is retried at full size
+MIN_CONFIDENCE = 0.75
+JPEG_QUALITY = 90
+
+SCAN_IMAGE_BYTES = telemetry.Histogram(
+    "clearscript_scan_image_bytes", "Encoded image size sent with scan calls", ("variant",),
+    buckets=(25e3, 50e3, 100e3, 200e3, 400e3, 800e3, 1.6e6))
+RESOLUTION_ESCALATIONS = telemetry.Counter(
+    "clearscript_resolution_escalations_total", "Scans re-asked with the full-size image", ("model",))
+telemetry.METRICS.extend([SCAN_IMAGE_BYTES, RESOLUTION_ESCALATIONS])
 
 def clean_json(text):
     text = text.strip()
@@ -10,6 +43,34 @@ def clean_json(text):
         text = text[4:].strip()
     return text
 
+def classify_error(error_msg):
+    """Bucket a model error message: 429 (quota), 404 (model missing) or error"""
+    lowered = error_msg.lower()
+    if "429" in error_msg or "quota" in lowered:
+        return "429"
+    if "404" in error_msg or "not found" in lowered:
+        return "404"
+    return "error"
+
+def error_result(message, **extra):
+    """Pipeline result (JSON string) with no medicines and an error message"""
+    return json.dumps({
+        "error": message,
+        **extra,
+        "english": [],
+        "translated": [],
+        "dangerous_combinations": []
+    })
+
+_configured_key = None
+
+def configure_genai(genai, api_key):
+    """genai.configure() throws away the SDK's clients, so only call it when the key changes"""
+    global _configured_key
+    if api_key != _configured_key:
+        genai.configure(api_key=api_key)
+        _configured_key = api_key
+
 def preprocess_image(img):
     """Enhance image quality for better recognition"""
     try:
@@ -37,10 +98,47 @@ def preprocess_image(img):
         print(f"⚠️ Preprocessing error: {e}")
         return img
 
-def run_pipeline(image_path, language):
-    """Main pipeline for prescription processing"""
-    
-    # Step 1: Load and preprocess image
+def decode_image(image_path):
+    """Decode, orient and downscale the uploaded photo"""
+    with telemetry.span("image_decode"):
+        # Load image
+        img = Image.open(image_path)
+        print(f"📸 Original image: {img.size}, mode: {img.mode}, format: {img.format}")
+        
+        # Let JPEG decode at reduced scale (no-op for WebP/PNG)
+        img.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        
+        # Apply camera EXIF rotation (client uploads are already upright)
+        img = ImageOps.exif_transpose(img)
+        
+        # Resize to optimal size before enhancing, so filters run on fewer pixels.
+        # Images downscaled in the browser already fit and skip this.
+        if max(img.size) > MAX_IMAGE_SIDE:
+            img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.Resampling.LANCZOS)
+    return img
+
+def encode_image(img, variant):
+    """Inline JPEG part for generate_content (we choose the encoding, so its size is known)"""
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=JPEG_QUALITY)
+    data = buf.getvalue()
+    if telemetry.ENABLED:
+        SCAN_IMAGE_BYTES.observe(len(data), variant)
+    print(f"📦 {variant} image: {img.size}, {len(data) // 1024} KB")
+    return {"mime_type": "image/jpeg", "data": data}
+
+def image_parts(img):
+    """Images to send, smallest first: a SCAN_START_SIDE copy (when adaptive), then full size"""
+    parts = []
+    if ADAPTIVE_RESOLUTION and max(img.size) > SCAN_START_SIDE:
+        small = img.copy()
+        small.thumbnail((SCAN_START_SIDE, SCAN_START_SIDE), Image.Resampling.LANCZOS)
+        parts.append(encode_image(small, "small"))
+    parts.append(encode_image(img, "full"))
+    return parts
+
+def prepare(image_path):
+    """Step 1: SDK + API key + image. Returns (genai, image parts, None) or (None, None, error JSON)"""
     try:
         import google.generativeai as genai  # Use OLD SDK that works!
         
@@ -48,39 +146,36 @@ def run_pipeline(image_path, language):
         api_key = get_api_key()
         
         if not api_key:
-            return json.dumps({
-                "error": "API key not configured. Add GOOGLE_API_KEY to environment or create key.json",
-                "english": [],
-                "translated": [],
-                "dangerous_combinations": []
-            })
+            return None, None, error_result(
+                "API key not configured. Add GOOGLE_API_KEY to environment or create key.json")
         
         # Configure API
-        genai.configure(api_key=api_key)
+        configure_genai(genai, api_key)
         
-        # Load image
-        img = Image.open(image_path)
-        print(f"📸 Original image: {img.size}, mode: {img.mode}")
+        img = decode_image(image_path)
         
-        # Preprocess
-        img = preprocess_image(img)
+        # Hopeless photos (dark, blurry, no writing) go straight back with a retake hint
+        issue = quality.check(img)
+        if issue:
+            return None, None, error_result("quality", quality=issue)
         
-        # Resize to optimal size
-        img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+        # Crop to the paper and straighten it, so the model gets fewer, more useful pixels
+        img = document.straighten(img)
         
+        # Preprocess
+        with telemetry.span("preprocess"):
+            img = preprocess_image(img)
         print(f"📸 Preprocessed: {img.size}")
         
+        return genai, image_parts(img), None
+        
     except Exception as e:
         print(f"❌ Image processing error: {e}")
-        return json.dumps({
-            "error": f"Image processing failed: {str(e)}",
-            "english": [],
-            "translated": [],
-            "dangerous_combinations": []
-        })
-    
-    # Step 2: Create prompt
-    prompt = f"""Analyze this prescription image and extract medicine information.
+        return None, None, error_result(f"Image processing failed: {str(e)}")
+
+def build_prompt(language):
+    """Extraction prompt for the vision model"""
+    return f"""Analyze this prescription image and extract medicine information.
 
 Return ONLY valid JSON with this structure:
 {{
@@ -135,69 +230,370 @@ IMPORTANT:
 - If unclear, make educated guess
 - Return ONLY JSON, no markdown"""
 
-    # Step 3: Try models (using OLD SDK with correct model names)
-    models = [
-        "gemini-2.5-flash",      # Latest
-        "gemini-2.0-flash",      # Stable
-        "gemini-2.5-pro",        # Most capable
-        "gemini-flash-latest"    # Alias
-    ]
+def request_options():
+    """Cut the HTTP call off when the request's deadline runs out"""
+    timeout = deadline.timeout()
+    return {"timeout": timeout} if timeout is not None else None
+
+def generation_config(genai):
+    return genai.types.GenerationConfig(
+        temperature=0.1,
+        max_output_tokens=4096,
+        response_mime_type="application/json"
+    )
+
+def parse_response(response, model_name):
+    """Validate a model response. Returns (result JSON or None, outcome)"""
+    if not (response and response.text):
+        return None, "empty"
+    
+    result = clean_json(response.text)
+    print(f"✅ Success with {model_name}")
+    
+    # Validate JSON, repairing what can be fixed locally instead of asking again
+    try:
+        with telemetry.span("json_parse"):
+            data, repairs = schema.normalize_result(schema.extract_json(result))
+        if data is not None:
+            print(f"   Extracted {len(data['english'])} medicines")
+            if repairs:
+                print(f"   🩹 Repaired locally: {', '.join(sorted(set(repairs)))}")
+            return json.dumps(data, ensure_ascii=False), "success"
+        else:
+            print(f"   Invalid response structure ({repairs})")
+    except Exception as parse_error:
+        print(f"   JSON parse error: {parse_error}")
+    return None, "parse_fail"
+
+def out_of_time(model_name):
+    """True (and logged) when another call on model_name can't finish before the deadline"""
+    if deadline.allows(deadline.MIN_MODEL_CALL_SECONDS):
+        return False
+    print(f"⏱️ Deadline: {deadline.remaining():.1f}s left, not trying {model_name}")
+    return True
+
+def backoff_pays_off(seconds):
+    """Only sleep before a retry if a call still fits afterwards"""
+    return deadline.allows(seconds + deadline.MIN_MODEL_CALL_SECONDS)
+
+def handle_model_error(model_name, attempt, e, started):
+    """Log/record a failed call; returns its kind: 429, 404 or error"""
+    error_msg = str(e)
+    error_kind = classify_error(error_msg)
+    telemetry.observe_model_call("scan", model_name, error_kind, time.perf_counter() - started)
+    print(f"⚠️ {model_name} attempt {attempt+1}: {error_msg[:200]}")
     
-    for model_name in models:
+    if error_kind == "429":
+        # Back off together: the next admit() queues or skips this model
+        print("⏳ Quota exceeded, pausing model for 10s...")
+        report_quota_error(model_name, 10)
+    elif error_kind == "404":
+        print(f"❌ {model_name} not available")
+    return error_kind
+
+def call_model(genai, model_name, prompt, img):
+    """One scan call. Returns the result JSON or None; API errors are raised"""
+    started = time.perf_counter()
+    model = genai.GenerativeModel(model_name)
+    response = model.generate_content(
+        [prompt, img], generation_config=generation_config(genai), request_options=request_options())
+    
+    print(f"   Got response from {model_name}")
+    usage.record("scan", model_name, response, image=img)
+    
+    result, outcome = parse_response(response, model_name)
+    elapsed = time.perf_counter() - started
+    telemetry.observe_model_call("scan", model_name, outcome, elapsed)
+    hedging.record(model_name, elapsed)
+    return result
+
+async def call_model_async(genai, model_name, prompt, img):
+    started = time.perf_counter()
+    try:
+        model = genai.GenerativeModel(model_name)
+        response = await model.generate_content_async(
+            [prompt, img], generation_config=generation_config(genai), request_options=request_options())
+    except asyncio.CancelledError:
+        # Lost a hedge race
+        telemetry.observe_model_call("scan", model_name, "cancelled", time.perf_counter() - started)
+        raise
+    
+    print(f"   Got response from {model_name}")
+    usage.record("scan", model_name, response, image=img)
+    
+    result, outcome = parse_response(response, model_name)
+    elapsed = time.perf_counter() - started
+    telemetry.observe_model_call("scan", model_name, outcome, elapsed)
+    hedging.record(model_name, elapsed)
+    return result
+
+_hedge_pool = None
+
+def hedge_pool():
+    # Created on first use, i.e. after gunicorn has forked
+    global _hedge_pool
+    if _hedge_pool is None:
+        _hedge_pool = ThreadPoolExecutor(HEDGE_POOL_THREADS, thread_name_prefix="hedge")
+    return _hedge_pool
+
+def hedge_call(genai, model_name, prompt, img):
+    """call_model for the hedge: its errors are recorded, never raised"""
+    started = time.perf_counter()
+    try:
+        return call_model(genai, model_name, prompt, img)
+    except Exception as e:
+        handle_model_error(model_name, 0, e, started)
+        return None
+
+async def hedge_call_async(genai, model_name, prompt, img):
+    started = time.perf_counter()
+    try:
+        return await call_model_async(genai, model_name, prompt, img)
+    except Exception as e:
+        await asyncio.to_thread(handle_model_error, model_name, 0, e, started)
+        return None
+
+def scan_call(genai, model_name, prompt, img, attempt):
+    """
+    call_model, hedged when HEDGE_ENABLED: if model_name is slower than usual,
+    the next model gets the same request and the first valid answer wins.
+    The losing call can't be cancelled: it runs on in the pool (holding its
+    thread and quota slot) and its answer is ignored.
+    Errors from model_name are raised as for a plain call.
+    """
+    hedge_model = hedging.next_model(SCAN_MODELS, model_name) if hedging.ENABLED else None
+    if not hedge_model:
+        return call_model(genai, model_name, prompt, img)
+    
+    hedging.primary_started()
+    started = time.perf_counter()
+    # copy_context: the pool thread sees this request's deadline and id
+    primary = hedge_pool().submit(contextvars.copy_context().run, call_model, genai, model_name, prompt, img)
+    done, _ = wait([primary], timeout=hedging.delay(model_name))
+    if done or out_of_time(hedge_model) or not usage.allows(hedge_model) or not hedging.try_hedge(hedge_model):
+        return primary.result()
+    
+    print(f"🏁 {model_name} is slow, hedging with {hedge_model}")
+    hedge = hedge_pool().submit(contextvars.copy_context().run, hedge_call, genai, hedge_model, prompt, img)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None and future.result():
+                if future is hedge:
+                    print(f"🏁 {hedge_model} answered first")
+                    telemetry.count(hedging.HEDGES, "won")
+                    # A running call can't be stopped; record how it ends
+                    primary.add_done_callback(
+                        lambda f: f.exception() and handle_model_error(model_name, attempt, f.exception(), started))
+                return future.result()
+    
+    # Neither answered: behave like the unhedged call
+    return primary.result()
+
+async def scan_call_async(genai, model_name, prompt, img, attempt):
+    """scan_call for the asyncio server; the losing call is cancelled"""
+    hedge_model = hedging.next_model(SCAN_MODELS, model_name) if hedging.ENABLED else None
+    if not hedge_model:
+        return await call_model_async(genai, model_name, prompt, img)
+    
+    hedging.primary_started()
+    started = time.perf_counter()
+    primary = asyncio.ensure_future(call_model_async(genai, model_name, prompt, img))
+    done, _ = await asyncio.wait([primary], timeout=hedging.delay(model_name))
+    if done or out_of_time(hedge_model) or not usage.allows(hedge_model) \
+            or not await hedging.try_hedge_async(hedge_model):
+        return await primary
+    
+    print(f"🏁 {model_name} is slow, hedging with {hedge_model}")
+    hedge = asyncio.ensure_future(hedge_call_async(genai, hedge_model, prompt, img))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result():
+                    if task is hedge:
+                        print(f"🏁 {hedge_model} answered first")
+                        telemetry.count(hedging.HEDGES, "won")
+                        if primary.done() and primary.exception():
+                            await asyncio.to_thread(
+                                handle_model_error, model_name, attempt, primary.exception(), started)
+                    return task.result()
+        
+        # Neither answered: behave like the unhedged call
+        return primary.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+def needs_full_image(result, images, model_name):
+    """Confidence of an answer from the small image, or None if it should be kept as is"""
+    if len(images) < 2:
+        return None
+    score = schema.confidence(json.loads(result))
+    if score >= MIN_CONFIDENCE or out_of_time(model_name):
+        return None
+    print(f"🔎 Confidence {score:.2f} at {SCAN_START_SIDE}px, asking {model_name} again at full size")
+    telemetry.count(RESOLUTION_ESCALATIONS, model_name)
+    return score
+
+def better_result(result, retry, score):
+    if retry and schema.confidence(json.loads(retry)) > score:
+        return retry
+    return result
+
+def escalate(genai, model_name, prompt, images, result, attempt):
+    """Adaptive resolution: retry a low-confidence answer with the full-size image, keep the better one"""
+    score = needs_full_image(result, images, model_name)
+    if score is None:
+        return result
+    try:
+        admit(model_name, SCAN)
+    except RateLimited:
+        return result
+    started = time.perf_counter()
+    try:
+        return better_result(result, call_model(genai, model_name, prompt, images[-1]), score)
+    except Exception as e:
+        handle_model_error(model_name, attempt, e, started)
+        return result
+
+async def escalate_async(genai, model_name, prompt, images, result, attempt):
+    score = needs_full_image(result, images, model_name)
+    if score is None:
+        return result
+    try:
+        await admit_async(model_name, SCAN)
+    except RateLimited:
+        return result
+    started = time.perf_counter()
+    try:
+        return better_result(result, await call_model_async(genai, model_name, prompt, images[-1]), score)
+    except Exception as e:
+        await asyncio.to_thread(handle_model_error, model_name, attempt, e, started)
+        return result
+
+def all_failed(busy_retry_after, timed_out=False):
+    print("❌ All models failed")
+    if busy_retry_after is not None:
+        return error_result("busy", retry_after=int(busy_retry_after + 0.999))
+    if timed_out:
+        return error_result("timeout", timed_out=True)
+    return error_result("Could not process prescription. Please try again with a clearer image.")
+
+def run_pipeline(image_path, language):
+    """Main pipeline for prescription processing"""
+    
+    # Step 1: Load and preprocess image
+    genai, images, error = prepare(image_path)
+    if error:
+        return error
+    
+    # Step 2: Create prompt
+    prompt = build_prompt(language)
+
+    # Step 3: Try models
+    busy_retry_after = None  # set when quota, not errors, stopped us
+    timed_out = False
+    
+    # Models near their daily token budget are tried last
+    for model_name in usage.route(SCAN_MODELS):
         print(f"🤖 Trying {model_name}...")
         
-        for attempt in range(3):
+        for attempt in range(ATTEMPTS_PER_MODEL):
+            timed_out = out_of_time(model_name)
+            if timed_out:
+                break
+            
+            # Wait for a quota slot shared with other threads/workers, or move on
+            try:
+                admit(model_name, SCAN)
+            except RateLimited as busy:
+                print(f"🚦 {busy}")
+                telemetry.observe_model_call("scan", model_name, "shed", 0.0)
+                busy_retry_after = min(busy_retry_after or busy.retry_after, busy.retry_after)
+                break
+            
+            started = time.perf_counter()
             try:
-                print(f"   Attempt {attempt + 1}/3...")
+                print(f"   Attempt {attempt + 1}/{ATTEMPTS_PER_MODEL}...")
                 
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content(
-                    [prompt, img],
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=0.1,
-                        max_output_tokens=4096,
-                        response_mime_type="application/json"
-                    )
-                )
+                result = scan_call(genai, model_name, prompt, images[0], attempt)
+                if result:
+                    result = escalate(genai, model_name, prompt, images, result, attempt)
+                    return result
                 
-                print(f"   Got response from {model_name}")
+                print(f"⚠️ Empty or invalid response from {model_name}")
+                
+            except Exception as e:
+                error_kind = handle_model_error(model_name, attempt, e, started)
+                if error_kind == "404":
+                    break
+                elif error_kind == "error" and backoff_pays_off(2):
+                    with telemetry.span("backoff"):
+                        time.sleep(2)
+        if timed_out:
+            break
+    
+    # All failed
+    return all_failed(busy_retry_after, timed_out)
+
+async def run_pipeline_async(image_path, language):
+    """run_pipeline for the asyncio server: model calls, quota waits and backoff
+    are awaited, so a waiting scan holds no thread. Image decoding runs in a
+    worker thread."""
+    
+    # Step 1: Load and preprocess image
+    genai, images, error = await asyncio.to_thread(prepare, image_path)
+    if error:
+        return error
+    
+    # Step 2: Create prompt
+    prompt = build_prompt(language)
+
+    # Step 3: Try models
+    busy_retry_after = None
+    timed_out = False
+    
+    # Models near their daily token budget are tried last
+    for model_name in usage.route(SCAN_MODELS):
+        print(f"🤖 Trying {model_name}...")
+        
+        for attempt in range(ATTEMPTS_PER_MODEL):
+            timed_out = out_of_time(model_name)
+            if timed_out:
+                break
+            
+            try:
+                await admit_async(model_name, SCAN)
+            except RateLimited as busy:
+                print(f"🚦 {busy}")
+                telemetry.observe_model_call("scan", model_name, "shed", 0.0)
+                busy_retry_after = min(busy_retry_after or busy.retry_after, busy.retry_after)
+                break
+            
+            started = time.perf_counter()
+            try:
+                print(f"   Attempt {attempt + 1}/{ATTEMPTS_PER_MODEL}...")
                 
-                if response and response.text:
-                    result = clean_json(response.text)
-                    print(f"✅ Success with {model_name}")
-                    
-                    # Validate JSON
-                    try:
-                        data = json.loads(result)
-                        if 'english' in data or 'translated' in data:
-                            print(f"   Extracted {len(data.get('english', []))} medicines")
-                            return result
-                        else:
-                            print(f"   Invalid response structure")
-                    except Exception as parse_error:
-                        print(f"   JSON parse error: {parse_error}")
+                result = await scan_call_async(genai, model_name, prompt, images[0], attempt)
+                if result:
+                    result = await escalate_async(genai, model_name, prompt, images, result, attempt)
+                    return result
                 
                 print(f"⚠️ Empty or invalid response from {model_name}")
                 
             except Exception as e:
-                error_msg = str(e)
-                print(f"⚠️ {model_name} attempt {attempt+1}: {error_msg[:200]}")
-                
-                if "429" in error_msg or "quota" in error_msg.lower():
-                    print("⏳ Quota exceeded, waiting 10s...")
-                    time.sleep(10)
-                    continue
-                elif "404" in error_msg or "not found" in error_msg.lower():
-                    print(f"❌ {model_name} not available")
+                # A 429 writes the shared back-off to SQLite
+                error_kind = await asyncio.to_thread(handle_model_error, model_name, attempt, e, started)
+                if error_kind == "404":
                     break
-                else:
-                    time.sleep(2)
+                elif error_kind == "error" and backoff_pays_off(2):
+                    with telemetry.span("backoff"):
+                        await asyncio.sleep(2)
+        if timed_out:
+            break
     
     # All failed
-    print("❌ All models failed")
-    return json.dumps({
-        "error": "Could not process prescription. Please try again with a clearer image.",
-        "english": [],
-        "translated": [],
-        "dangerous_combinations": []
-    })
+    return all_failed(busy_retry_after, timed_out)
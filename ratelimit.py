@@ -0,0 +1,250 @@
+"""
+Quota-aware admission control for Gemini calls
+One token bucket per model for requests-per-minute and one for
+tokens-per-minute, kept in SQLite so every thread and every gunicorn
+worker draws from the same quota.
+
+Callers either get a slot (possibly after a short queue) or a RateLimited
+error carrying how long to wait. Scans may use the whole bucket; chat and
+translation must leave CHAT_QUOTA_RESERVE of it free, so vision requests win
+when quota is tight.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import deadline
+import telemetry
+from config import (
+    RATE_LIMIT_ENABLED, CHAT_QUOTA_RESERVE,
+    SCAN_MAX_QUEUE_SECONDS, CHAT_MAX_QUEUE_SECONDS,
+)
+from localdb import LocalDB
+
+# Priorities
+SCAN = "scan"
+CHAT = "chat"
+
+# Rough token cost per call, charged up front (prompt + image + typical answer)
+# and corrected with the answer's usage_metadata (settle())
+SCAN_TOKEN_ESTIMATE = 3000
+CHAT_TOKEN_ESTIMATE = 600
+
+# (requests per minute, tokens per minute) - Gemini free tier defaults.
+# Override with MODEL_RATE_LIMITS='{"gemini-2.5-flash": [1000, 1000000]}'
+DEFAULT_LIMITS = {
+    "gemini-2.5-flash": (10, 250000),
+    "gemini-2.0-flash": (15, 1000000),
+    "gemini-2.5-pro": (5, 250000),
+    "gemini-flash-latest": (10, 250000),
+    "gemini-2.0-flash-lite": (30, 1000000),
+}
+FALLBACK_LIMIT = (10, 250000)
+
+
+class RateLimited(Exception):
+    """No quota for this model within the caller's queue tolerance"""
+
+    def __init__(self, model, retry_after):
+        self.model = model
+        self.retry_after = retry_after
+        super().__init__(f"{model} busy, retry in {retry_after:.0f}s")
+
+
+def load_limits():
+    limits = dict(DEFAULT_LIMITS)
+    override = os.environ.get("MODEL_RATE_LIMITS")
+    if override:
+        try:
+            for model, (rpm, tpm) in json.loads(override).items():
+                limits[model] = (float(rpm), float(tpm))
+        except Exception as e:
+            print(f"⚠️ Ignoring invalid MODEL_RATE_LIMITS: {e}")
+    return limits
+
+
+class QuotaLimiter:
+    def __init__(self, filename, limits, chat_reserve=CHAT_QUOTA_RESERVE):
+        self.db = LocalDB(filename, """
+            CREATE TABLE IF NOT EXISTS buckets (
+                model TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL);
+        """)
+        self.limits = limits
+        self.chat_reserve = chat_reserve
+        self._unsettled = {}  # model -> tokens used beyond the estimates (negative: fewer)
+        self._lock = threading.Lock()
+
+    def _refilled(self, conn, model, now):
+        rpm, tpm = self.limits.get(model, FALLBACK_LIMIT)
+        row = conn.execute(
+            "SELECT requests, tokens, updated FROM buckets WHERE model = ?", (model,)).fetchone()
+        if row is None:
+            return rpm, tpm, rpm, tpm
+        requests, tokens, updated = row
+        elapsed = max(0.0, now - updated)
+        requests = min(rpm, requests + elapsed * rpm / 60.0)
+        tokens = min(tpm, tokens + elapsed * tpm / 60.0)
+        return requests, tokens, rpm, tpm
+
+    def _store(self, conn, model, requests, tokens, now):
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (model, requests, tokens, updated) VALUES (?, ?, ?, ?)",
+            (model, requests, tokens, now))
+
+    def reserve(self, model, tokens, priority=SCAN, max_wait=0.0):
+        """
+        Take one request + `tokens` from the model's buckets.
+        Returns how many seconds the caller must wait before calling
+        (the slot is already booked), or raises RateLimited.
+        """
+        with self._lock:
+            unsettled = self._unsettled.pop(model, 0.0)
+        conn = self.db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            requests, available_tokens, rpm, tpm = self._refilled(conn, model, now)
+            available_tokens = min(tpm, available_tokens - unsettled)
+            tokens = min(tokens, tpm)
+            reserve = self.chat_reserve if priority == CHAT else 0.0
+
+            missing_requests = 1 + reserve * rpm - requests
+            missing_tokens = tokens + reserve * tpm - available_tokens
+            wait = max(0.0, missing_requests * 60.0 / rpm, missing_tokens * 60.0 / tpm)
+
+            if wait > max_wait:
+                self._store(conn, model, requests, available_tokens, now)
+                conn.execute("COMMIT")
+                raise RateLimited(model, wait)
+
+            # Buckets may go negative: that books a place in the queue for later callers
+            self._store(conn, model, requests - 1, available_tokens - tokens, now)
+            conn.execute("COMMIT")
+            return wait
+        except RateLimited:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            self.settle(model, unsettled)
+            raise
+
+    def settle(self, model, extra_tokens):
+        """
+        Correct an up-front estimate with the call's real token count
+        (`extra_tokens` = actual - estimated). Kept in memory and applied with
+        this worker's next booking for `model`: no extra write, so answers
+        handled on the event loop never wait on SQLite.
+        """
+        if extra_tokens:
+            with self._lock:
+                self._unsettled[model] = self._unsettled.get(model, 0.0) + extra_tokens
+
+    def penalize(self, model, seconds):
+        """Gemini answered 429: stop every thread/worker from calling `model` for `seconds`"""
+        conn = self.db.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            requests, tokens, rpm, tpm = self._refilled(conn, model, now)
+            self._store(conn, model, min(requests, -rpm * seconds / 60.0), tokens, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class _NoLimit:
+    """Used when RATE_LIMIT_ENABLED is off: everything is admitted immediately"""
+
+    def reserve(self, model, tokens, priority=SCAN, max_wait=0.0):
+        return 0.0
+
+    def settle(self, model, extra_tokens):
+        pass
+
+    def penalize(self, model, seconds):
+        pass
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if RATE_LIMIT_ENABLED:
+                    _limiter = QuotaLimiter("ratelimit.sqlite3", load_limits())
+                else:
+                    _limiter = _NoLimit()
+    return _limiter
+
+
+def token_estimate(priority):
+    return SCAN_TOKEN_ESTIMATE if priority == SCAN else CHAT_TOKEN_ESTIMATE
+
+
+def _book(model, priority, max_wait=None):
+    """Book a quota slot; returns seconds to wait. Fails open if the shared store is unusable."""
+    tokens = token_estimate(priority)
+    if max_wait is None:
+        max_wait = SCAN_MAX_QUEUE_SECONDS if priority == SCAN else CHAT_MAX_QUEUE_SECONDS
+    # Never queue past the point where the call itself no longer fits in the request
+    max_wait = max(0.0, min(max_wait, deadline.remaining() - deadline.MIN_MODEL_CALL_SECONDS))
+    try:
+        return get_limiter().reserve(model, tokens, priority, max_wait)
+    except RateLimited:
+        raise
+    except Exception as e:
+        print(f"⚠️ Rate limiter unavailable, admitting {model}: {e}")
+        return 0.0
+
+
+def admit(model, priority):
+    """
+    Wait for quota on `model` using the configured queue tolerance for `priority`.
+    Raises RateLimited when the model is too busy.
+    """
+    wait = _book(model, priority)
+    if wait > 0:
+        print(f"⏳ Queued {wait:.1f}s for {model} quota")
+        with telemetry.span("quota_wait"):
+            time.sleep(wait)
+    return wait
+
+
+async def admit_async(model, priority):
+    """admit() for the asyncio server: the queue wait doesn't hold a thread, and
+    the booking (a SQLite write that may wait on the lock) runs off the event loop"""
+    wait = await asyncio.to_thread(_book, model, priority)
+    if wait > 0:
+        print(f"⏳ Queued {wait:.1f}s for {model} quota")
+        with telemetry.span("quota_wait"):
+            await asyncio.sleep(wait)
+    return wait
+
+
+def admit_now(model, priority):
+    """Take a slot only if one is free right now (hedged calls never queue)"""
+    _book(model, priority, max_wait=0.0)
+
+
+def settle(model, priority, actual_tokens):
+    """Report a call's real token count (usage_metadata) against what _book() charged"""
+    try:
+        get_limiter().settle(model, actual_tokens - token_estimate(priority))
+    except Exception as e:
+        print(f"⚠️ Rate limiter unavailable: {e}")
+
+
+def report_quota_error(model, seconds=10):
+    """Shared back-off after a 429 (replaces each thread sleeping on its own)"""
+    try:
+        get_limiter().penalize(model, seconds)
+    except Exception as e:
+        print(f"⚠️ Rate limiter unavailable: {e}")
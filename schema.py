@@ -0,0 +1,206 @@
+"""
+Local validation and repair of the model's medicine JSON
+Small mistakes (dosage written "1 - 0 - 1" or "BD", OD/TDS/AC/PC left
+unexpanded in the English text, missing fields, a bare list instead of the object) are fixed
+here instead of throwing the answer away and paying for another generation.
+Only answers with no medicine list at all are rejected.
+"""
+
+import json
+import re
+
+import telemetry
+
+SCHEMA_REPAIRS = telemetry.Counter(
+    "clearscript_schema_repairs_total", "Model answers fixed locally instead of retried", ("kind",))
+telemetry.METRICS.append(SCHEMA_REPAIRS)
+
+MEDICINE_FIELDS = (
+    "name", "medicine_type", "purpose", "dosage", "visual_timing", "timing", "frequency",
+    "duration", "warnings", "precautions", "generic_alternative", "application_instructions",
+)
+COMBINATION_FIELDS = ("medicines", "risk", "risk_translated", "severity")
+
+# Keys models sometimes use instead of ours
+LIST_ALIASES = {"medicines": "english", "medications": "english", "prescription": "english"}
+FIELD_ALIASES = {"medicine_name": "name", "drug": "name", "type": "medicine_type", "form": "medicine_type"}
+
+# Morning-Afternoon-Night, any dash/x/space separator: "1-0-1", "1 – 0 – 1", "1x0x1", "½-0-½"
+DOSAGE_RE = re.compile(r"^\s*([0-9½]+)\s*[-–—xX/]\s*([0-9½]+)\s*[-–—xX/]\s*([0-9½]+)\s*$")
+
+# Frequency abbreviation -> dosage pattern (only when that's the whole dosage)
+FREQUENCY_DOSAGE = {
+    "OD": "1-0-0", "QD": "1-0-0", "ONCE DAILY": "1-0-0",
+    "BD": "1-0-1", "BID": "1-0-1", "TWICE DAILY": "1-0-1",
+    "TDS": "1-1-1", "TID": "1-1-1", "THRICE DAILY": "1-1-1",
+    "HS": "0-0-1",
+}
+FREQUENCY_DOSAGE_RE = re.compile(
+    r"^\s*(" + "|".join(sorted(map(re.escape, FREQUENCY_DOSAGE), key=len, reverse=True)) + r")\.?\s*$",
+    re.IGNORECASE)
+
+# Prescription shorthand inside free text (upper case only, so words aren't touched).
+# English only: the expansions would put English phrases into translated text.
+ABBREVIATIONS = {
+    "OD": "once daily", "QD": "once daily", "BD": "twice daily", "BID": "twice daily",
+    "TDS": "three times a day", "TID": "three times a day", "QID": "four times a day",
+    "AC": "before food", "PC": "after food", "HS": "at bedtime", "SOS": "when needed",
+    "PRN": "when needed",
+}
+ABBREVIATION_RE = re.compile(r"\b(" + "|".join(ABBREVIATIONS) + r")\b\.?")
+ABBREVIATED_FIELDS = ("timing", "frequency", "duration", "warnings", "precautions")
+
+SLOT_EMOJIS = ("☀️", "🌤️", "🌙")
+
+
+def extract_json(text):
+    """Parse text as JSON, falling back to the outermost {...} (prose around the object)"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end <= start:
+            raise
+        data = json.loads(text[start:end + 1])
+        telemetry.count(SCHEMA_REPAIRS, "json_extract")
+        return data
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ", ".join(_text(v) for v in value if v not in (None, ""))
+    return str(value).strip()
+
+
+def normalize_dosage(dosage):
+    """Canonical M-A-N form, or the input unchanged if it isn't a pattern we know"""
+    match = DOSAGE_RE.match(dosage)
+    if match:
+        return "-".join(match.groups())
+    match = FREQUENCY_DOSAGE_RE.match(dosage)
+    if match:
+        return FREQUENCY_DOSAGE[match.group(1).upper()]
+    return dosage
+
+
+def visual_timing(dosage):
+    """☀️ 🌤️ 🌙 for the non-zero slots of an M-A-N dosage ("--" for skipped), or None"""
+    match = DOSAGE_RE.match(dosage)
+    if not match:
+        return None
+    return " ".join(emoji if dose not in ("0", "") else "--" for emoji, dose in zip(SLOT_EMOJIS, match.groups()))
+
+
+def expand_abbreviations(text):
+    return ABBREVIATION_RE.sub(lambda m: ABBREVIATIONS[m.group(1)], text)
+
+
+def normalize_medicine(med, repairs, expand=True):
+    if not isinstance(med, dict):
+        if isinstance(med, str) and med.strip():
+            med = {"name": med}
+            repairs.append("structure")
+        else:
+            return None
+
+    for alias, field in FIELD_ALIASES.items():
+        if alias in med and not med.get(field):
+            med[field] = med[alias]
+
+    out = {}
+    for field in MEDICINE_FIELDS:
+        value = med.get(field)
+        if value is None:
+            repairs.append("default")
+        elif not isinstance(value, str):
+            repairs.append("type")
+        out[field] = _text(value)
+
+    dosage = normalize_dosage(out["dosage"])
+    if dosage != out["dosage"]:
+        out["dosage"] = dosage
+        repairs.append("dosage")
+
+    derived = visual_timing(dosage)
+    if derived and out["visual_timing"] != derived:
+        out["visual_timing"] = derived
+        repairs.append("visual_timing")
+
+    if expand:
+        for field in ABBREVIATED_FIELDS:
+            expanded = expand_abbreviations(out[field])
+            if expanded != out[field]:
+                out[field] = expanded
+                repairs.append("abbreviation")
+
+    # The prompt asks for these pairs to match; fill one from the other
+    for a, b in (("frequency", "timing"), ("precautions", "warnings")):
+        if not out[a] and out[b]:
+            out[a] = out[b]
+        elif not out[b] and out[a]:
+            out[b] = out[a]
+    return out
+
+
+def normalize_combination(combo, repairs):
+    if not isinstance(combo, dict):
+        return None
+    out = {field: _text(combo.get(field)) for field in COMBINATION_FIELDS}
+    if not out["risk_translated"]:
+        out["risk_translated"] = out["risk"]
+    severity = out["severity"].lower()
+    if severity not in ("high", "medium"):
+        severity = "high" if "high" in severity or "severe" in severity else "medium"
+        repairs.append("severity")
+    out["severity"] = severity
+    return out if out["medicines"] or out["risk"] else None
+
+
+def normalize_result(data):
+    """
+    Validate and repair a parsed model answer.
+    Returns (clean dict, list of repair kinds) or (None, reason) when there
+    is nothing usable and the model should be asked again.
+    """
+    repairs = []
+    if isinstance(data, list):
+        data = {"english": data}
+        repairs.append("structure")
+    if not isinstance(data, dict):
+        return None, "not an object"
+
+    for alias, key in LIST_ALIASES.items():
+        if key not in data and isinstance(data.get(alias), list):
+            data[key] = data[alias]
+            repairs.append("structure")
+
+    if not isinstance(data.get("english"), list) and not isinstance(data.get("translated"), list):
+        return None, "no medicine list"
+
+    result = {}
+    for key in ("english", "translated"):
+        meds = data.get(key)
+        if not isinstance(meds, list):
+            meds = []
+        expand = key == "english"
+        result[key] = [m for m in (normalize_medicine(med, repairs, expand) for med in meds) if m]
+
+    combos = data.get("dangerous_combinations")
+    if not isinstance(combos, list):
+        combos = []
+    result["dangerous_combinations"] = [
+        c for c in (normalize_combination(combo, repairs) for combo in combos) if c]
+
+    for kind in set(repairs):
+        telemetry.count(SCHEMA_REPAIRS, kind)
+    return result, repairs
+
+
+def confidence(data):
+    """0-1: share of medicines that came back with a name and a dosage (0 with none)"""
+    meds = data.get("english") or data.get("translated") or []
+    if not meds:
+        return 0.0
+    return sum(1 for med in meds if med.get("name") and med.get("dosage")) / float(len(meds))
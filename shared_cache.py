@@ -0,0 +1,95 @@
+"""
+TTL cache shared by all gunicorn workers (SQLite under DATA_DIR)
+Used for pipeline results (keyed by image bytes + language), generated audio
+(keyed by text + language) and chat translations, so a hit in one worker is
+a hit in all of them. Rendered scan results are kept here too, under a short
+random id, for /r/<id> permalinks.
+"""
+
+import hashlib
+import random
+import time
+
+import telemetry
+from config import RESULT_CACHE_TTL, AUDIO_CACHE_TTL, TRANSLATION_CACHE_TTL, RESULT_PAGE_TTL
+from localdb import LocalDB
+
+_db = LocalDB("cache.sqlite3", """
+    CREATE TABLE IF NOT EXISTS cache (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    ) WITHOUT ROWID;
+""")
+
+# Roughly one write in PURGE_EVERY also deletes expired rows
+PURGE_EVERY = 200
+
+
+def cache_key(*parts):
+    """Stable key from str/bytes parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """sha256 of a file's bytes (used to recognise re-uploads of the same photo)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SharedCache:
+    def __init__(self, namespace, ttl):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        try:
+            row = _db.conn().execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires > ?",
+                (self.namespace, key, time.time())).fetchone()
+        except Exception as e:
+            print(f"⚠️ Cache read failed ({self.namespace}): {e}")
+            return None
+        telemetry.count(telemetry.CACHE_LOOKUPS, self.namespace, "hit" if row else "miss")
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        """Store value; returns False if the cache is off or the write failed"""
+        if self.ttl <= 0:
+            return False
+        try:
+            conn = _db.conn()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, value, now + (ttl or self.ttl)))
+            if random.randrange(PURGE_EVERY) == 0:
+                conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+            return True
+        except Exception as e:
+            print(f"⚠️ Cache write failed ({self.namespace}): {e}")
+            return False
+
+    def delete(self, key):
+        try:
+            _db.conn().execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+        except Exception as e:
+            print(f"⚠️ Cache delete failed ({self.namespace}): {e}")
+
+
+results = SharedCache("result", RESULT_CACHE_TTL)
+audio = SharedCache("audio", AUDIO_CACHE_TTL)
+translations = SharedCache("translation", TRANSLATION_CACHE_TTL)
+pages = SharedCache("page", RESULT_PAGE_TTL)
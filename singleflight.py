@@ -0,0 +1,85 @@
+"""
+Single-flight coalescing
+Identical requests that arrive while the first one is still running (a
+double-tapped submit, the same photo from two phones) wait for that call and
+share its result or error instead of starting their own upstream call.
+
+Keys are content hashes (shared_cache.cache_key). Coalescing is per process;
+across workers, the shared caches serve repeats once the first call finishes.
+"""
+
+import asyncio
+import threading
+
+import telemetry
+
+COALESCED_CALLS = telemetry.Counter(
+    "clearscript_coalesced_calls_total",
+    "Upstream calls saved by joining an identical in-flight call", ("call",))
+telemetry.METRICS.append(COALESCED_CALLS)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """One in-flight call per key; concurrent callers with the same key share it"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _joined(self):
+        print(f"🔗 Joining in-flight {self.name} call")
+        telemetry.count(COALESCED_CALLS, self.name)
+
+    def do(self, key, fn, *args):
+        """fn(*args), unless another thread is already running it for `key`"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._joined()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn, *args):
+        """do() for coroutine functions on the server's event loop"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+        else:
+            self._joined()
+        # shield: one caller giving up must not cancel the call for the others
+        return await asyncio.shield(task)
+
+
+scans = SingleFlight("scan")
+speech = SingleFlight("speech")
+questions = SingleFlight("ask")
@@ -0,0 +1,245 @@
+"""
+Lightweight tracing and Prometheus metrics
+Every request gets an id, every pipeline stage a timed span, and every model
+call is recorded per model and outcome. Exposed as text at /metrics.
+
+When METRICS_ENABLED is off, span() hands back a shared no-op context manager
+(unless METRICS_LOG_SPANS is on, or traffic capture asked for this request's
+stage timings) and the observe_* helpers return immediately.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+import uuid
+
+from config import METRICS_ENABLED, METRICS_LOG_SPANS
+
+ENABLED = METRICS_ENABLED
+# Spans are timed when something reads them (capture.py can also ask per request)
+TIMED_SPANS = METRICS_ENABLED or METRICS_LOG_SPANS
+
+# Seconds. Model calls are slow, so the upper buckets go past the gunicorn timeout.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_request_id = contextvars.ContextVar("request_id", default="-")
+_request_started = contextvars.ContextVar("request_started", default=None)
+# Span timings of the current request, when something asked for them (capture.py)
+_stages = contextvars.ContextVar("stages", default=None)
+
+
+class Histogram:
+    """Prometheus-style histogram keyed by a fixed tuple of label values"""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count]
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._series.get(label_values)
+            if counts is None:
+                counts = self._series[label_values] = [0] * (len(self.buckets) + 1)
+                self._sums[label_values] = 0.0
+            counts[slot] += 1
+            self._sums[label_values] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(k, list(v), self._sums[k]) for k, v in self._series.items()]
+        for label_values, counts, total in series:
+            labels = _format_labels(self.label_names, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {cumulative}')
+            lines.append(f"{_series_name(self.name + '_sum', labels)} {total}")
+            lines.append(f"{_series_name(self.name + '_count', labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic count keyed by label values"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{_series_name(self.name, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value that goes up and down (e.g. requests in flight)"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{_series_name(self.name, labels)} {value}")
+        return lines
+
+
+def _format_labels(names, values):
+    # Trailing comma so histogram buckets can append le="..."
+    return "".join(f'{n}="{_escape(v)}",' for n, v in zip(names, values))
+
+
+def _series_name(name, labels):
+    labels = labels.rstrip(",")
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "clearscript_request_seconds", "End-to-end HTTP request latency", ("endpoint", "status"))
+STAGE_SECONDS = Histogram(
+    "clearscript_stage_seconds", "Time spent in each processing stage", ("stage", "result"))
+MODEL_CALL_SECONDS = Histogram(
+    "clearscript_model_call_seconds", "Gemini call latency per model and outcome",
+    ("endpoint", "model", "outcome"))
+REQUESTS_IN_FLIGHT = Gauge(
+    "clearscript_requests_in_flight", "Requests currently being handled by this worker")
+CACHE_LOOKUPS = Counter(
+    "clearscript_cache_lookups_total", "Shared cache lookups by cache and result", ("cache", "result"))
+
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, MODEL_CALL_SECONDS, REQUESTS_IN_FLIGHT, CACHE_LOOKUPS]
+
+
+# --- Request scope ---
+
+def begin_request(request_id=None):
+    """Start tracing a request; returns its id (incoming X-Request-ID is reused)"""
+    request_id = (request_id or uuid.uuid4().hex[:12])[:64]
+    _request_id.set(request_id)
+    _stages.set(None)
+    if ENABLED:
+        _request_started.set(time.perf_counter())
+        REQUESTS_IN_FLIGHT.inc()
+    return request_id
+
+
+def end_request(endpoint, status):
+    """Record the request latency; safe to call when begin_request was skipped"""
+    if not ENABLED:
+        return
+    started = _request_started.get()
+    if started is None:
+        return
+    _request_started.set(None)
+    REQUESTS_IN_FLIGHT.dec()
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint or "unknown", str(status))
+
+
+def request_id():
+    return _request_id.get()
+
+
+def request_seconds():
+    """Time since begin_request, or None (metrics off, or outside a request)"""
+    started = _request_started.get()
+    return None if started is None else time.perf_counter() - started
+
+
+def collect_stages():
+    """Keep (stage, seconds) of every span in this request, metrics on or off; returns the list"""
+    stages = []
+    _stages.set(stages)
+    return stages
+
+
+# --- Spans ---
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        if ENABLED:
+            STAGE_SECONDS.observe(elapsed, self.stage, "error" if exc_type else "ok")
+        stages = _stages.get()
+        if stages is not None:
+            stages.append((self.stage, round(elapsed, 4)))
+        if METRICS_LOG_SPANS:
+            print(f"⏱️ [{request_id()}] {self.stage}: {elapsed * 1000:.1f} ms")
+        return False
+
+
+_NOOP_SPAN = contextlib.nullcontext()
+
+
+def span(stage):
+    """Time a block as one stage: `with telemetry.span("preprocess"): ...`"""
+    if not TIMED_SPANS and _stages.get() is None:
+        return _NOOP_SPAN
+    return _Span(stage)
+
+
+def observe_model_call(endpoint, model, outcome, seconds):
+    """Record one generate_content call (outcome: success/429/404/parse_fail/empty/error)"""
+    if ENABLED:
+        MODEL_CALL_SECONDS.observe(seconds, endpoint, model, outcome)
+
+
+def count(counter, *label_values):
+    """Increment a Counter when metrics are on"""
+    if ENABLED:
+        counter.inc(*label_values)
+
+
+def render_metrics():
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# The modules live at the repository root and read config at import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="clearscript-tests-"))
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+from flask import Flask, request
+
+import capture
+
+
+def test_digest_is_a_short_stable_prefix():
+    assert capture.digest("ibuprofen") == capture.digest(b"ibuprofen")
+    assert len(capture.digest("ibuprofen")) == capture.DIGEST_CHARS
+    assert capture.digest("ibuprofen") != capture.digest("Ibuprofen")
+
+
+def test_anonymize_keeps_only_the_shape_of_text():
+    assert capture.anonymize("Can I take this with milk?") == {
+        "sha256": capture.digest("Can I take this with milk?"), "chars": 26}
+    assert capture.anonymize(["a", "b"])["items"] == 2
+    assert capture.anonymize({"b": 1, "a": 2}) == capture.anonymize({"a": 2, "b": 1})
+    assert capture.anonymize(3) == 3
+    assert capture.anonymize(True) is True
+
+
+@pytest.fixture
+def capture_file(monkeypatch, tmp_path):
+    path = tmp_path / "capture.jsonl"
+    monkeypatch.setattr(capture, "ENABLED", True)
+    monkeypatch.setattr(capture, "CAPTURE_FILE", str(path))
+    monkeypatch.setattr(capture, "_fd", None)
+    return path
+
+
+@pytest.fixture
+def client(capture_file):
+    """A tiny app wired like app.py"""
+    app = Flask(__name__)
+
+    @app.route("/ask", methods=["POST"])
+    def ask_question():
+        return {"answer": "ok"}
+
+    @app.route("/health")
+    def health():
+        return "ok"
+
+    @app.before_request
+    def before():
+        capture.begin(request)
+
+    @app.after_request
+    def after(response):
+        capture.end(request, response, "en")
+        return response
+
+    return app.test_client()
+
+
+def records(path):
+    capture.flush()
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_captured_request_has_no_free_text(client, capture_file):
+    client.post("/ask", json={"question": "Is aspirin safe for me?", "language": "hi"},
+                headers={"Cookie": "session=secret"})
+    [record] = records(capture_file)
+    assert record["endpoint"] == "ask_question"
+    assert record["status"] == 200
+    assert record["json"]["language"] == "hi"
+    assert record["json"]["question"] == capture.anonymize("Is aspirin safe for me?")
+    text = json.dumps(record)
+    assert "aspirin" not in text and "secret" not in text
+
+
+def test_other_endpoints_are_not_captured(client, capture_file):
+    client.get("/health")
+    assert records(capture_file) == []
@@ -0,0 +1,59 @@
+import asyncio
+import math
+
+import pytest
+
+import deadline
+
+
+@pytest.fixture(autouse=True)
+def no_deadline_after():
+    yield
+    deadline.start(0)
+
+
+def test_unbounded_outside_a_request():
+    deadline.start(0)
+    assert deadline.remaining() == math.inf
+    assert deadline.timeout() is None
+    assert deadline.allows(10 ** 6)
+    deadline.start(-1)
+    assert deadline.remaining() == math.inf
+
+
+def test_remaining_counts_down():
+    deadline.start(30)
+    assert 29 < deadline.remaining() <= 30
+    assert 29 < deadline.timeout() <= 30
+    assert deadline.allows(deadline.MIN_MODEL_CALL_SECONDS)
+    assert not deadline.allows(31)
+
+
+def test_expired_deadline_leaves_nothing():
+    deadline.start(0.001)
+    while deadline.remaining() > 0:
+        pass
+    assert deadline.remaining() == 0.0
+    assert not deadline.allows(0)
+
+
+def test_reserve_holds_time_back_for_later_work():
+    deadline.start(30)
+    with deadline.reserve(10):
+        assert 19 < deadline.remaining() <= 20
+    assert 29 < deadline.remaining() <= 30
+
+
+def test_reserve_without_a_deadline_is_unbounded():
+    deadline.start(0)
+    with deadline.reserve(10):
+        assert deadline.remaining() == math.inf
+
+
+def test_deadline_follows_the_request_into_threads():
+    deadline.start(30)
+
+    async def left_in_thread():
+        return await asyncio.to_thread(deadline.remaining)
+
+    assert 29 < asyncio.run(left_in_thread()) <= 30
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+import document
+
+
+def text_page(angle=0.0):
+    """White page with rows of word-sized dark bars, rotated by `angle` degrees"""
+    img = Image.new("L", (600, 800), 255)
+    draw = ImageDraw.Draw(img)
+    rng = random.Random(1)
+    for y in range(80, 740, 36):
+        x = 60
+        while x < 540:
+            width = rng.randint(20, 70)
+            draw.rectangle([x, y, min(x + width, 540), y + 14], fill=0)
+            x += width + 12
+    return img.rotate(angle, resample=Image.Resampling.BICUBIC, fillcolor=255, expand=True)
+
+
+@pytest.mark.parametrize("angle", [0.0, 1.5, 3.0, -5.0, 7.0])
+def test_skew_angle_undoes_rotation(angle):
+    assert document.skew_angle(text_page(angle)) == pytest.approx(-angle, abs=document.SKEW_STEP)
+
+
+@pytest.mark.parametrize("color", ["white", (128, 128, 128), (20, 20, 20)])
+def test_skew_angle_leaves_blank_and_uniform_pages_upright(color):
+    assert document.skew_angle(Image.new("RGB", (600, 800), color)) == 0.0
+
+
+@pytest.mark.parametrize("sigma", [20, 40, 80])
+def test_skew_angle_leaves_noise_upright(sigma):
+    # Random: a few draws, any of which used to beat upright by SKEW_GAIN by chance
+    for _ in range(5):
+        assert document.skew_angle(Image.effect_noise((600, 800), sigma)) == 0.0
+
+
+def photo_of(page, angle=0.0, background=40, size=(1000, 1300)):
+    """`page` lying on a dark table, centred and turned by `angle` degrees"""
+    mask = Image.new("L", page.size, 255).rotate(angle, expand=True)
+    page = page.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True)
+    photo = Image.new("L", size, background)
+    offset = ((size[0] - page.size[0]) // 2, (size[1] - page.size[1]) // 2)
+    photo.paste(page, offset, mask)
+    return photo.convert("RGB")
+
+
+@pytest.mark.parametrize("angle", [0.0, 6.0, -4.0])
+def test_page_on_a_dark_background_is_cropped_to_the_page(angle):
+    photo = photo_of(text_page(), angle)
+    quad = document.find_page(photo)
+    assert quad is not None
+    cropped = document.crop_to_page(photo, quad)
+    assert cropped.size == pytest.approx((600, 800), rel=0.05)
+    # At most a sliver of the table is left along the edges
+    inner = cropped.convert("L").crop((8, 8, cropped.width - 8, cropped.height - 8))
+    width, height = inner.size
+    for band in [(0, 0, width, 20), (0, height - 20, width, height), (0, 0, 20, height), (width - 20, 0, width, height)]:
+        assert inner.crop(band).histogram()[:128] == [0] * 128
+
+
+@pytest.mark.parametrize("photo", [
+    text_page(),  # already cropped: the page fills the frame
+    photo_of(text_page(), size=(640, 840)),  # page runs to the edges
+    Image.new("RGB", (600, 800), "white"),
+    Image.effect_noise((600, 800), 60).convert("RGB"),
+], ids=["filled", "edges", "blank", "noise"])
+def test_page_without_a_clear_border_is_left_uncropped(photo):
+    assert document.find_page(photo) is None
+
+
+def test_straighten_crops_and_deskews(monkeypatch):
+    monkeypatch.setattr(document, "ENABLED", True)
+    straightened = document.straighten(photo_of(text_page(), 5.0))
+    assert straightened.size[0] < 800 and straightened.size[1] < 1000
+    assert document.skew_angle(straightened) == 0.0
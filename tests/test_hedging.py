@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+import pytest
+
+import hedging
+from ratelimit import RateLimited
+
+
+@pytest.fixture
+def bookings(monkeypatch):
+    """Quota bookings made by try_hedge, as (model, thread name)"""
+    booked = []
+    monkeypatch.setattr(hedging, "admit_now",
+                        lambda model, priority: booked.append((model, threading.current_thread().name)))
+    monkeypatch.setattr(hedging, "budget", hedging.HedgeBudget(0.5))
+    return booked
+
+
+def test_next_model_follows_the_fallback_order():
+    assert hedging.next_model(["a", "b", "c"], "a") == "b"
+    assert hedging.next_model(["a", "b", "c"], "c") is None
+    assert hedging.next_model(["a", "b"], "x") is None
+
+
+def test_delay_uses_the_default_until_there_are_enough_samples(monkeypatch):
+    monkeypatch.setattr(hedging, "latencies", hedging.LatencyTracker())
+    assert hedging.delay("m") == hedging.HEDGE_DEFAULT_DELAY
+    for i in range(hedging.MIN_SAMPLES):
+        hedging.record("m", i / 10)
+    assert hedging.delay("m") == pytest.approx(hedging.HEDGE_PERCENTILE * hedging.MIN_SAMPLES / 10, abs=0.1)
+
+
+def test_hedges_are_capped_by_the_budget(bookings):
+    hedging.primary_started()
+    assert not hedging.try_hedge("b")
+    hedging.primary_started()
+    assert hedging.try_hedge("b")
+    assert not hedging.try_hedge("b")
+    assert [model for model, _ in bookings] == ["b"]
+
+
+def test_a_hedge_without_quota_gives_its_budget_back(bookings, monkeypatch):
+    def busy(model, priority):
+        raise RateLimited(model, 5.0)
+    monkeypatch.setattr(hedging, "admit_now", busy)
+    hedging.primary_started()
+    hedging.primary_started()
+    assert not hedging.try_hedge("b")
+    assert hedging.budget.credit == 1.0
+
+
+def test_try_hedge_async_books_off_the_event_loop(bookings):
+    hedging.primary_started()
+    hedging.primary_started()
+    assert asyncio.run(hedging.try_hedge_async("b"))
+    [(model, thread)] = bookings
+    assert model == "b" and thread != threading.main_thread().name
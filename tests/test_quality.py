@@ -0,0 +1,73 @@
+import os
+import random
+
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+import quality
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "uploads", "sample.jpg")
+
+
+def text_page(paper=235, ink=30):
+    """Light page with rows of word-sized dark bars"""
+    img = Image.new("L", (600, 800), paper)
+    draw = ImageDraw.Draw(img)
+    rng = random.Random(1)
+    for y in range(80, 740, 36):
+        x = 60
+        while x < 540:
+            width = rng.randint(20, 70)
+            draw.rectangle([x, y, min(x + width, 540), y + 14], fill=ink)
+            x += width + 12
+    return img
+
+
+def test_sharp_text_passes():
+    assert quality.check(text_page()) is None
+
+
+def test_sample_photo_passes():
+    with Image.open(SAMPLE) as img:
+        assert quality.check(img) is None
+
+
+@pytest.mark.parametrize("level, reason", [
+    (10, quality.TOO_DARK),
+    (252, quality.TOO_BRIGHT),
+    (128, quality.NO_TEXT),  # no contrast: blank page, wall, covered lens
+])
+def test_uniform_frames_are_rejected(level, reason):
+    assert quality.check(Image.new("L", (600, 800), level)) == reason
+
+
+def test_dark_text_page_is_too_dark():
+    assert quality.check(text_page(paper=35, ink=0)) == quality.TOO_DARK
+
+
+def test_blurred_text_is_blurry():
+    assert quality.check(text_page().filter(ImageFilter.GaussianBlur(6))) == quality.BLURRY
+
+
+def test_sharp_frame_without_writing_has_no_text():
+    img = Image.new("L", (600, 800), 200)
+    ImageDraw.Draw(img).rectangle([0, 0, 600, 300], fill=60)
+    assert quality.check(img) == quality.NO_TEXT
+
+
+@pytest.mark.parametrize("threshold, value, reason", [
+    ("QUALITY_MIN_BRIGHTNESS", 200, quality.TOO_DARK),
+    ("QUALITY_MAX_BRIGHTNESS", 150, quality.TOO_BRIGHT),
+    ("QUALITY_MIN_CONTRAST", 100, quality.NO_TEXT),
+    ("QUALITY_MIN_SHARPNESS", 5000, quality.BLURRY),
+    ("QUALITY_MIN_TEXT_DENSITY", 0.5, quality.NO_TEXT),
+])
+def test_thresholds_are_configurable(monkeypatch, threshold, value, reason):
+    # The text page measures brightness ~187, contrast ~85, sharpness ~2000, text ~0.11
+    monkeypatch.setattr(quality, threshold, value)
+    assert quality.check(text_page()) == reason
+
+
+def test_disabled_gate_passes_everything(monkeypatch):
+    monkeypatch.setattr(quality, "ENABLED", False)
+    assert quality.check(Image.new("L", (600, 800), 0)) is None
@@ -0,0 +1,87 @@
+import uuid
+
+import pytest
+
+import ratelimit
+from ratelimit import QuotaLimiter, RateLimited, SCAN, CHAT
+
+MODEL = "test-model"
+
+
+def limiter(rpm, tpm, chat_reserve=0.0):
+    return QuotaLimiter(f"ratelimit-{uuid.uuid4().hex}.sqlite3", {MODEL: (rpm, tpm)}, chat_reserve)
+
+
+def test_reserve_admits_up_to_the_rate_then_queues():
+    quota = limiter(rpm=60, tpm=1000000)
+    assert [quota.reserve(MODEL, 10) for _ in range(60)] == [0.0] * 60
+    # The next request is booked one refill (60 s / 60 rpm) later
+    assert quota.reserve(MODEL, 10, max_wait=5) == pytest.approx(1.0, abs=0.1)
+    assert quota.reserve(MODEL, 10, max_wait=5) == pytest.approx(2.0, abs=0.1)
+
+
+def test_reserve_refuses_beyond_max_wait_without_booking():
+    quota = limiter(rpm=60, tpm=1000000)
+    for _ in range(60):
+        quota.reserve(MODEL, 10)
+    with pytest.raises(RateLimited) as busy:
+        quota.reserve(MODEL, 10, max_wait=0.5)
+    assert busy.value.retry_after == pytest.approx(1.0, abs=0.1)
+    # Refused calls didn't take a place in the queue
+    assert quota.reserve(MODEL, 10, max_wait=5) == pytest.approx(1.0, abs=0.1)
+
+
+def test_reserve_waits_for_tokens():
+    quota = limiter(rpm=1000, tpm=1000)
+    assert quota.reserve(MODEL, 600) == 0.0
+    # 200 tokens short at 1000 tokens/min
+    assert quota.reserve(MODEL, 600, max_wait=20) == pytest.approx(12.0, abs=0.1)
+
+
+def test_chat_leaves_the_reserve_to_scans():
+    quota = limiter(rpm=2, tpm=1000000, chat_reserve=0.5)
+    assert quota.reserve(MODEL, 10, CHAT) == 0.0
+    with pytest.raises(RateLimited):
+        quota.reserve(MODEL, 10, CHAT)
+    assert quota.reserve(MODEL, 10, SCAN) == 0.0
+
+
+def test_penalize_pauses_the_model():
+    quota = limiter(rpm=60, tpm=1000000)
+    quota.penalize(MODEL, 10)
+    with pytest.raises(RateLimited) as busy:
+        quota.reserve(MODEL, 10)
+    assert busy.value.retry_after == pytest.approx(11.0, abs=0.1)
+
+
+def test_settle_charges_the_real_token_count():
+    quota = limiter(rpm=1000, tpm=1000)
+    assert quota.reserve(MODEL, 100) == 0.0
+    # The call used 900 tokens, not 100
+    quota.settle(MODEL, 800)
+    with pytest.raises(RateLimited) as busy:
+        quota.reserve(MODEL, 200)
+    assert busy.value.retry_after == pytest.approx(6.0, abs=0.1)
+
+
+def test_settle_returns_unused_tokens():
+    quota = limiter(rpm=1000, tpm=1000)
+    assert quota.reserve(MODEL, 900) == 0.0
+    quota.settle(MODEL, -800)
+    assert quota.reserve(MODEL, 800) == 0.0
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.settled = []
+
+    def settle(self, model, extra_tokens):
+        self.settled.append((model, extra_tokens))
+
+
+def test_settle_compares_with_the_estimate(monkeypatch):
+    recorder = RecordingLimiter()
+    monkeypatch.setattr(ratelimit, "_limiter", recorder)
+    ratelimit.settle(MODEL, SCAN, ratelimit.SCAN_TOKEN_ESTIMATE + 500)
+    ratelimit.settle(MODEL, CHAT, ratelimit.CHAT_TOKEN_ESTIMATE - 100)
+    assert recorder.settled == [(MODEL, 500), (MODEL, -100)]
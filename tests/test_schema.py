@@ -0,0 +1,78 @@
+import pytest
+
+import schema
+
+
+@pytest.mark.parametrize("dosage, expected", [
+    ("1-0-1", "1-0-1"),
+    ("1 - 0 - 1", "1-0-1"),
+    ("1 – 1 – 1", "1-1-1"),
+    ("1x0x1", "1-0-1"),
+    ("½-0-½", "½-0-½"),
+    ("BD", "1-0-1"),
+    ("od.", "1-0-0"),
+    ("Twice daily", "1-0-1"),
+    ("HS", "0-0-1"),
+    ("2 puffs as needed", "2 puffs as needed"),
+])
+def test_normalize_dosage(dosage, expected):
+    assert schema.normalize_dosage(dosage) == expected
+
+
+def test_normalize_result_repairs_dosage_and_timing():
+    result, repairs = schema.normalize_result({"english": [{"name": "Paracetamol", "dosage": "1 - 0 - 1"}]})
+    med = result["english"][0]
+    assert med["dosage"] == "1-0-1"
+    assert med["visual_timing"] == "☀️ -- 🌙"
+    assert "dosage" in repairs and "default" in repairs
+    assert set(med) == set(schema.MEDICINE_FIELDS)
+
+
+def test_normalize_result_expands_english_abbreviations():
+    result, repairs = schema.normalize_result({"english": [
+        {"name": "Pantoprazole", "dosage": "OD", "frequency": "OD AC", "precautions": "Take PC if upset"}]})
+    med = result["english"][0]
+    assert med["dosage"] == "1-0-0"
+    assert med["frequency"] == "once daily before food"
+    assert med["timing"] == "once daily before food"
+    assert med["precautions"] == "Take after food if upset"
+    assert "abbreviation" in repairs
+
+
+def test_normalize_result_leaves_lowercase_words_alone():
+    result, _ = schema.normalize_result({"english": [{"name": "X", "frequency": "Good for body aches"}]})
+    assert result["english"][0]["frequency"] == "Good for body aches"
+
+
+def test_normalize_result_keeps_translated_abbreviations():
+    result, _ = schema.normalize_result({
+        "english": [{"name": "Amoxicillin", "dosage": "BD", "frequency": "BD PC"}],
+        "translated": [{"name": "एमोक्सिसिलिन", "dosage": "BD", "frequency": "BD, खाने के बाद"}],
+    })
+    english, translated = result["english"][0], result["translated"][0]
+    assert english["frequency"] == "twice daily after food"
+    # No English phrases in the Hindi text; the dosage pattern is language-neutral
+    assert translated["frequency"] == "BD, खाने के बाद"
+    assert translated["dosage"] == "1-0-1"
+
+
+def test_normalize_result_accepts_a_bare_list_and_aliases():
+    result, repairs = schema.normalize_result([{"medicine_name": "Cetirizine", "dosage": "0-0-1"}])
+    assert result["english"][0]["name"] == "Cetirizine"
+    assert "structure" in repairs
+
+
+def test_normalize_result_rejects_answers_without_medicines():
+    assert schema.normalize_result({"note": "unreadable"}) == (None, "no medicine list")
+    assert schema.normalize_result("text") == (None, "not an object")
+
+
+def test_normalize_result_fixes_combination_severity():
+    result, repairs = schema.normalize_result({
+        "english": [],
+        "dangerous_combinations": [{"medicines": "A + B", "risk": "bleeding", "severity": "Severe"}],
+    })
+    combo = result["dangerous_combinations"][0]
+    assert combo["severity"] == "high"
+    assert combo["risk_translated"] == "bleeding"
+    assert "severity" in repairs
@@ -0,0 +1,58 @@
+import os
+import time
+
+from localdb import LocalDB
+from shared_cache import SharedCache, cache_key, file_digest
+
+
+def test_cache_key_is_stable_and_separates_parts():
+    assert cache_key("photo", "Hindi") == cache_key(b"photo", "Hindi")
+    assert cache_key("photo", "Hindi") != cache_key("photo", "Tamil")
+    assert cache_key("ab", "c") != cache_key("a", "bc")
+
+
+def test_file_digest_matches_bytes(tmp_path):
+    a, b = tmp_path / "a.jpg", tmp_path / "b.jpg"
+    a.write_bytes(b"\xff\xd8same photo")
+    b.write_bytes(b"\xff\xd8same photo")
+    assert file_digest(str(a)) == file_digest(str(b))
+    b.write_bytes(b"\xff\xd8other photo")
+    assert file_digest(str(a)) != file_digest(str(b))
+
+
+def test_set_and_get_by_namespace():
+    results, audio = SharedCache("test-results", 60), SharedCache("test-audio", 60)
+    key = cache_key(os.urandom(8))
+    assert results.get(key) is None
+    results.set(key, '{"english": []}')
+    assert results.get(key) == '{"english": []}'
+    assert audio.get(key) is None
+
+
+def test_entries_expire():
+    cache = SharedCache("test-expiry", 60)
+    key = cache_key(os.urandom(8))
+    cache.set(key, "value", ttl=0.05)
+    time.sleep(0.1)
+    assert cache.get(key) is None
+
+
+def test_zero_ttl_disables_the_cache():
+    cache = SharedCache("test-off", 0)
+    cache.set("key", "value")
+    assert cache.get("key") is None
+
+
+def test_set_reports_whether_the_value_was_stored():
+    assert SharedCache("test-stored", 60).set(cache_key(os.urandom(8)), "value")
+    assert not SharedCache("test-off", 0).set("key", "value")
+
+
+def test_workers_share_entries():
+    # Another worker: same database file, its own connection
+    key = cache_key(os.urandom(8))
+    SharedCache("test-shared", 60).set(key, "from worker 1")
+    other = LocalDB("cache.sqlite3", "")
+    row = other.conn().execute(
+        "SELECT value FROM cache WHERE namespace = ? AND key = ?", ("test-shared", key)).fetchone()
+    assert row == ("from worker 1",)
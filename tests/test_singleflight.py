@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+CALLERS = 5
+
+
+def run_together(flight, outcome):
+    """CALLERS threads calling flight.do("key", ...) while the first call is
+    still running; returns their futures and how many times the call ran"""
+    release, calls = threading.Event(), []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    pool = ThreadPoolExecutor(CALLERS)
+    futures = [pool.submit(flight.do, "key", fn)]
+    while "key" not in flight._calls:
+        time.sleep(0.001)
+    futures += [pool.submit(flight.do, "key", fn) for _ in range(CALLERS - 1)]
+    time.sleep(0.1)  # let them join before the first call returns
+    release.set()
+    pool.shutdown(wait=True)
+    return futures, len(calls)
+
+
+def test_concurrent_callers_share_one_result():
+    flight = SingleFlight("test")
+    result = object()
+    futures, calls = run_together(flight, result)
+    assert [f.result() for f in futures] == [result] * CALLERS
+    assert calls == 1
+    assert flight._calls == {}
+
+
+def test_concurrent_callers_share_one_exception():
+    flight = SingleFlight("test")
+    error = ValueError("upstream failed")
+    futures, calls = run_together(flight, error)
+    for future in futures:
+        with pytest.raises(ValueError) as raised:
+            future.result()
+        assert raised.value is error
+    assert calls == 1
+
+
+def test_calls_after_completion_run_again():
+    flight, calls = SingleFlight("test"), []
+    assert flight.do("key", lambda: calls.append(1) or len(calls)) == 1
+    assert flight.do("key", lambda: calls.append(1) or len(calls)) == 2
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight("test")
+    assert flight.do("a", lambda: "a") == "a"
+    assert flight.do("b", lambda: "b") == "b"
+
+
+def test_do_async_shares_one_call_and_one_exception():
+    flight, calls = SingleFlight("test"), []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        if value == "fail":
+            raise KeyError(value)
+        return value
+
+    async def main():
+        results = await asyncio.gather(*(flight.do_async("k", fetch, "ok") for _ in range(CALLERS)))
+        errors = await asyncio.gather(
+            *(flight.do_async("e", fetch, "fail") for _ in range(CALLERS)), return_exceptions=True)
+        return results, errors
+
+    results, errors = asyncio.run(main())
+    assert results == ["ok"] * CALLERS
+    assert all(isinstance(e, KeyError) for e in errors) and len({id(e) for e in errors}) == 1
+    assert calls == ["ok", "fail"]
+    assert flight._tasks == {}
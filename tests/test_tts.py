@@ -0,0 +1,94 @@
+import pytest
+
+import deadline
+import tts
+from hedging import MIN_SAMPLES, LatencyTracker
+
+
+class FakeBackend:
+    extension = ".wav"
+
+    def __init__(self, name, typical_seconds=1.0, fails=False, languages=("en", "hi")):
+        self.name = name
+        self.typical_seconds = typical_seconds
+        self.fails = fails
+        self.languages = languages
+        self.calls = 0
+
+    def available(self, lang_code):
+        return lang_code in self.languages
+
+    def synthesize(self, text, lang_code, path, timeout):
+        self.calls += 1
+        if self.fails:
+            raise RuntimeError(f"{self.name} down")
+        with open(path, "wb") as f:
+            f.write(text.encode("utf-8"))
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(tts, "latencies", LatencyTracker())
+    monkeypatch.setattr(tts, "_failed_at", {})
+    yield
+    deadline.start(0)
+
+
+def names(backends):
+    return [b.name for b in backends]
+
+
+def test_quality_policy_keeps_the_configured_order(monkeypatch):
+    monkeypatch.setattr(tts, "BACKENDS", [FakeBackend("gtts", 1.5), FakeBackend("espeak", 0.3)])
+    assert names(tts.candidates("en", "quality")) == ["gtts", "espeak"]
+
+
+def test_latency_policy_puts_the_fastest_first(monkeypatch):
+    monkeypatch.setattr(tts, "BACKENDS", [FakeBackend("gtts", 1.5), FakeBackend("espeak", 0.3)])
+    assert names(tts.candidates("en", "latency")) == ["espeak", "gtts"]
+    # Measured latency replaces the typical one once there are enough samples
+    for _ in range(MIN_SAMPLES):
+        tts.latencies.record(("espeak", "en"), 4.0)
+    assert names(tts.candidates("en", "latency")) == ["gtts", "espeak"]
+
+
+def test_unavailable_languages_are_left_out(monkeypatch):
+    monkeypatch.setattr(tts, "BACKENDS", [FakeBackend("gtts"), FakeBackend("espeak", languages=("en",))])
+    assert names(tts.candidates("hi", "quality")) == ["gtts"]
+
+
+def test_backends_that_do_not_fit_the_deadline_move_back(monkeypatch):
+    monkeypatch.setattr(tts, "BACKENDS", [FakeBackend("gtts", 5.0), FakeBackend("espeak", 0.3)])
+    deadline.start(3)
+    assert names(tts.candidates("en", "quality")) == ["espeak", "gtts"]
+
+
+def test_synthesize_falls_back_and_cools_the_failed_backend_down(monkeypatch, tmp_path):
+    gtts, espeak = FakeBackend("gtts", fails=True), FakeBackend("espeak")
+    monkeypatch.setattr(tts, "BACKENDS", [gtts, espeak])
+    filename = tts.synthesize("Paracetamol", "en", str(tmp_path), prefix="chat_")
+    assert filename.startswith("chat_") and filename.endswith(".wav")
+    assert (tmp_path / filename).read_bytes() == b"Paracetamol"
+    assert (gtts.calls, espeak.calls) == (1, 1)
+    # The failed backend is tried last until TTS_FAILURE_COOLDOWN has passed
+    assert names(tts.candidates("en", "quality")) == ["espeak", "gtts"]
+
+
+def test_synthesize_raises_when_every_backend_fails(monkeypatch, tmp_path):
+    monkeypatch.setattr(tts, "BACKENDS", [FakeBackend("gtts", fails=True), FakeBackend("espeak", fails=True)])
+    with pytest.raises(tts.TTSError) as error:
+        tts.synthesize("Paracetamol", "en", str(tmp_path))
+    assert "gtts" in str(error.value) and "espeak" in str(error.value)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_transcode_keeps_the_file_without_ffmpeg(monkeypatch, tmp_path):
+    monkeypatch.setattr(tts, "FFMPEG", None)
+    (tmp_path / "speech.wav").write_bytes(b"RIFF")
+    assert tts.transcode(str(tmp_path), "speech.wav", "opus") == "speech.wav"
+    assert (tmp_path / "speech.wav").exists()
+
+
+def test_transcode_skips_files_already_in_the_target_format(tmp_path):
+    (tmp_path / "speech.mp3").write_bytes(b"ID3")
+    assert tts.transcode(str(tmp_path), "speech.mp3", "mp3") == "speech.mp3"
@@ -0,0 +1,90 @@
+import os
+import threading
+import types
+import uuid
+
+import pytest
+
+import ratelimit
+import usage
+
+PRO, FLASH, LITE = "gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.0-flash-lite"
+MODELS = [PRO, FLASH]
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    """A fresh tracker that never flushes on its own, with 1000-token budgets"""
+    tracker = usage.UsageTracker(f"usage-{uuid.uuid4().hex}.sqlite3", flush_seconds=3600)
+    monkeypatch.setattr(usage, "_tracker", tracker)
+    monkeypatch.setattr(usage, "ENABLED", True)
+    monkeypatch.setattr(usage, "BUDGETS", {PRO: 1000, FLASH: 1000, LITE: 1000})
+    monkeypatch.setattr(usage, "BUDGET_DOWNGRADE_AT", 0.8)
+    monkeypatch.setattr(usage, "BUDGET_DOWNGRADE_MODEL", LITE)
+    return tracker
+
+
+def spend(tracker, model, tokens):
+    tracker.add("scan", model, "English", tokens, 0, 0)
+
+
+def test_route_keeps_the_order_within_budget(tracker):
+    spend(tracker, PRO, 500)
+    assert usage.route(MODELS) == MODELS
+
+
+def test_route_demotes_a_model_near_its_budget(tracker):
+    spend(tracker, PRO, 850)
+    # The cheap model goes in front of the demoted one
+    assert usage.route(MODELS) == [FLASH, LITE, PRO]
+
+
+def test_route_skips_a_spent_model(tracker):
+    spend(tracker, PRO, 1000)
+    assert usage.route(MODELS) == [FLASH]
+
+
+def test_route_does_not_repeat_the_downgrade_model(tracker):
+    spend(tracker, PRO, 900)
+    assert usage.route([PRO, LITE, FLASH]) == [LITE, FLASH, PRO]
+
+
+def test_route_adds_no_downgrade_model_that_is_over_budget_itself(tracker):
+    spend(tracker, PRO, 900)
+    spend(tracker, LITE, 900)
+    assert usage.route(MODELS) == [FLASH, PRO]
+
+
+def test_route_is_unchanged_without_budgets_or_tracking(tracker, monkeypatch):
+    spend(tracker, PRO, 5000)
+    monkeypatch.setattr(usage, "ENABLED", False)
+    assert usage.route(MODELS) == MODELS
+    monkeypatch.setattr(usage, "ENABLED", True)
+    monkeypatch.setattr(usage, "BUDGETS", {})
+    assert usage.route(MODELS) == MODELS
+
+
+def test_budget_counts_tokens_flushed_by_other_workers(tracker):
+    other = usage.UsageTracker(os.path.basename(tracker.db.path), flush_seconds=3600)
+    spend(other, PRO, 900)
+    other.flush()
+    tracker.flush()
+    assert usage.budget_state(PRO) == usage.DOWNGRADE
+
+
+def test_add_flushes_in_the_background(tracker):
+    flushed, threads = threading.Event(), []
+    tracker.flush_seconds = 0
+    tracker.flush = lambda: threads.append(threading.current_thread()) or flushed.set()
+    spend(tracker, PRO, 10)
+    assert flushed.wait(5)
+    assert threads != [threading.current_thread()]
+
+
+def test_record_accounts_tokens_and_settles_the_rate_limiter(tracker, monkeypatch):
+    settled = []
+    monkeypatch.setattr(ratelimit, "settle", lambda *args: settled.append(args))
+    meta = types.SimpleNamespace(prompt_token_count=1200, candidates_token_count=300, thoughts_token_count=100)
+    usage.record("chat", FLASH, types.SimpleNamespace(usage_metadata=meta), "Hindi")
+    assert tracker.day_tokens(FLASH) == 1600
+    assert settled == [(FLASH, ratelimit.CHAT, 1600)]
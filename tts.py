@@ -0,0 +1,224 @@
+"""
+Text-to-speech backends
+gTTS sends every sentence to Google's translate TTS: good voices, but a
+network round trip that fails when that service is slow. espeak-ng runs on
+the machine: robotic, but fast and offline. Both speak all the languages in
+LANG_CODE_MAP.
+
+For each request the backends are ordered by TTS_POLICY ("quality" keeps the
+TTS_BACKENDS order, "latency" puts the one that has been fastest for that
+language first), and the next one is tried when a backend fails. A backend
+that just failed, or whose usual latency no longer fits in the request's
+deadline, moves to the back.
+
+The result is then re-encoded with ffmpeg to low-bitrate mono (AUDIO_FORMAT):
+espeak-ng writes ~350 kbps WAV, far too much for a 2G connection.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+import deadline
+import telemetry
+from config import (
+    TTS_BACKENDS, TTS_POLICY, TTS_LOCAL_PROCESSES, TTS_FAILURE_COOLDOWN, AUDIO_FORMAT, AUDIO_BITRATE,
+)
+from hedging import LatencyTracker
+
+# Recent latency used to check that a backend still fits in the deadline
+FIT_PERCENTILE = 0.9
+
+# AUDIO_FORMAT -> (extension, default bitrate, ffmpeg encoder options).
+# Speech needs little bandwidth: 24 kHz keeps it clear, and Opus's voip mode is tuned for it.
+AUDIO_FORMATS = {
+    "mp3": (".mp3", "32k", ["-ar", "24000", "-c:a", "libmp3lame"]),
+    "opus": (".ogg", "16k", ["-ar", "24000", "-c:a", "libopus", "-application", "voip"]),
+}
+# Don't start a transcode with less time than this left; the original is kept
+MIN_TRANSCODE_SECONDS = 1.0
+
+TTS_SECONDS = telemetry.Histogram(
+    "clearscript_tts_seconds", "Speech synthesis time per backend, language and outcome",
+    ("backend", "language", "outcome"))
+TTS_FALLBACKS = telemetry.Counter(
+    "clearscript_tts_fallbacks_total", "Syntheses that moved on to the next backend", ("backend",))
+AUDIO_BYTES = telemetry.Histogram(
+    "clearscript_audio_bytes", "Size of each generated audio file as served",
+    ("format",), buckets=(4096, 16384, 32768, 65536, 131072, 262144, 524288, 1048576, 4194304))
+TTFA_SECONDS = telemetry.Histogram(
+    "clearscript_time_to_first_audio_seconds",
+    "From the start of a request until its audio URL is ready, by endpoint and source (cached/synthesized)",
+    ("endpoint", "source"))
+telemetry.METRICS.extend([TTS_SECONDS, TTS_FALLBACKS, AUDIO_BYTES, TTFA_SECONDS])
+
+
+class TTSError(Exception):
+    pass
+
+
+class GttsBackend:
+    """Google translate TTS over the network (MP3)"""
+
+    name = "gtts"
+    extension = ".mp3"
+    # Expected seconds before any call has been measured
+    typical_seconds = 1.5
+
+    def available(self, lang_code):
+        return True
+
+    def synthesize(self, text, lang_code, path, timeout):
+        from gtts import gTTS  # Lazy Load
+        gTTS(text=text, lang=lang_code, timeout=timeout).save(path)
+
+
+class EspeakBackend:
+    """espeak-ng on this machine (WAV), at most `processes` at a time"""
+
+    name = "espeak"
+    extension = ".wav"
+    typical_seconds = 0.3
+
+    VOICES = {"en": "en-us", "hi": "hi", "ta": "ta", "te": "te", "kn": "kn", "ml": "ml"}
+    # Words per minute: a little slower than the default 175 for older listeners
+    SPEED = 150
+
+    def __init__(self, processes=TTS_LOCAL_PROCESSES):
+        self.binary = shutil.which("espeak-ng") or shutil.which("espeak")
+        self.slots = threading.BoundedSemaphore(processes)
+
+    def available(self, lang_code):
+        return self.binary is not None and lang_code in self.VOICES
+
+    def synthesize(self, text, lang_code, path, timeout):
+        started = time.monotonic()
+        if not self.slots.acquire(timeout=timeout):
+            raise TTSError("no free espeak-ng process")
+        try:
+            left = None if timeout is None else max(0.1, timeout - (time.monotonic() - started))
+            subprocess.run(
+                [self.binary, "-v", self.VOICES[lang_code], "-s", str(self.SPEED), "-w", path, "--stdin"],
+                input=text.encode("utf-8"), capture_output=True, timeout=left, check=True)
+        finally:
+            self.slots.release()
+
+
+BACKEND_TYPES = {"gtts": GttsBackend, "espeak": EspeakBackend}
+
+
+def load_backends(names):
+    backends = []
+    for name in names:
+        if name in BACKEND_TYPES:
+            backends.append(BACKEND_TYPES[name]())
+        else:
+            print(f"⚠️ Unknown TTS backend {name!r} (known: {', '.join(BACKEND_TYPES)})")
+    return backends
+
+
+BACKENDS = load_backends(TTS_BACKENDS)
+latencies = LatencyTracker()  # keyed by (backend, lang_code)
+_failed_at = {}  # backend name -> monotonic time of its last failure
+
+
+def expected_seconds(backend, lang_code, q=0.5):
+    observed = latencies.percentile((backend.name, lang_code), q)
+    return backend.typical_seconds if observed is None else observed
+
+
+def cooling_down(backend):
+    failed = _failed_at.get(backend.name)
+    return failed is not None and time.monotonic() - failed < TTS_FAILURE_COOLDOWN
+
+
+def candidates(lang_code, policy=TTS_POLICY):
+    """Backends that can speak `lang_code`, in the order to try them for this request"""
+    usable = [b for b in BACKENDS if b.available(lang_code)]
+    if policy == "latency":
+        usable.sort(key=lambda b: expected_seconds(b, lang_code))
+    # Stable sort: healthy backends that fit the deadline keep their order up front
+    left = deadline.remaining()
+    return sorted(usable, key=lambda b: cooling_down(b) or expected_seconds(b, lang_code, FIT_PERCENTILE) > left)
+
+
+def synthesize(text, lang_code, folder, prefix=""):
+    """Speak `text` into a new file under `folder`; returns its name.
+    Raises TTSError when no backend managed it."""
+    errors = []
+    for backend in candidates(lang_code):
+        if not deadline.allows(deadline.MIN_TTS_SECONDS):
+            errors.append("deadline")
+            break
+        if errors:
+            telemetry.count(TTS_FALLBACKS, backend.name)
+        filename = f"{prefix}{uuid.uuid4()}{backend.extension}"
+        path = os.path.join(folder, filename)
+        started = time.perf_counter()
+        try:
+            backend.synthesize(text, lang_code, path, deadline.timeout())
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            _failed_at[backend.name] = time.monotonic()
+            if telemetry.ENABLED:
+                TTS_SECONDS.observe(elapsed, backend.name, lang_code, "error")
+            print(f"🔇 {backend.name} failed for {lang_code} after {elapsed:.1f}s: {e}")
+            errors.append(f"{backend.name}: {e}")
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+
+        elapsed = time.perf_counter() - started
+        latencies.record((backend.name, lang_code), elapsed)
+        _failed_at.pop(backend.name, None)
+        if telemetry.ENABLED:
+            TTS_SECONDS.observe(elapsed, backend.name, lang_code, "success")
+        return filename
+
+    raise TTSError("; ".join(errors) or f"no TTS backend for {lang_code}")
+
+
+# --- Transcoding ---
+
+FFMPEG = shutil.which("ffmpeg")
+
+
+def transcode(folder, filename, audio_format=AUDIO_FORMAT):
+    """Re-encode a synthesized file to low-bitrate mono; returns the name of the
+    file to serve (the original when there's nothing to gain or it fails)"""
+    path = os.path.join(folder, filename)
+    target = AUDIO_FORMATS.get(audio_format)
+    stem, extension = os.path.splitext(filename)
+    # gTTS already sends 32 kbps mono MP3: re-encoding it to MP3 would only lose quality
+    if target is None or FFMPEG is None or extension == target[0] \
+            or not deadline.allows(MIN_TRANSCODE_SECONDS):
+        _observe_size(path, extension)
+        return filename
+
+    out_extension, default_bitrate, options = target
+    out_filename = stem + out_extension
+    out_path = os.path.join(folder, out_filename)
+    try:
+        with telemetry.span("transcode"):
+            subprocess.run(
+                [FFMPEG, "-nostdin", "-loglevel", "error", "-y", "-i", path, "-ac", "1", *options,
+                 "-b:a", AUDIO_BITRATE or default_bitrate, out_path],
+                capture_output=True, timeout=deadline.timeout(), check=True)
+    except Exception as e:
+        print(f"⚠️ Transcode to {audio_format} failed, serving {extension}: {e}")
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        _observe_size(path, extension)
+        return filename
+
+    os.remove(path)
+    _observe_size(out_path, out_extension)
+    return out_filename
+
+
+def _observe_size(path, extension):
+    if telemetry.ENABLED:
+        AUDIO_BYTES.observe(os.path.getsize(path), extension.lstrip("."))
@@ -0,0 +1,335 @@
+"""
+Token and cost accounting for Gemini calls
+Every answer carries usage_metadata; its input, output and image tokens are
+added up in memory per day, endpoint, model and language, and each worker
+adds its counts to DATA_DIR/usage.sqlite3 every USAGE_FLUSH_SECONDS, so the
+table holds the totals of all workers. GET /usage summarises it with an
+estimated cost.
+
+Daily token budgets (DAILY_TOKEN_BUDGETS) steer which models are tried:
+past BUDGET_DOWNGRADE_AT of its budget a model goes to the back of the list,
+behind the cheap BUDGET_DOWNGRADE_MODEL, and at 100% it is skipped. Other
+workers' calls are only seen after a flush, which is why the downgrade starts
+before the limit.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import datetime
+import io
+import json
+import math
+import os
+import threading
+import time
+
+import ratelimit
+import telemetry
+from config import (
+    USAGE_TRACKING_ENABLED, USAGE_FLUSH_SECONDS, BUDGET_DOWNGRADE_AT, BUDGET_DOWNGRADE_MODEL,
+)
+from localdb import LocalDB
+
+ENABLED = USAGE_TRACKING_ENABLED
+
+# Gemini counts an image as 258 tokens per 768x768 tile (a single tile up to 384 px)
+IMAGE_TILE_SIDE = 768
+IMAGE_SMALL_SIDE = 384
+IMAGE_TILE_TOKENS = 258
+
+# USD per million (input, output) tokens, paid tier.
+# Override with MODEL_PRICES='{"gemini-2.5-flash": [0.3, 2.5]}'
+DEFAULT_PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-flash-latest": (0.30, 2.50),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+FALLBACK_PRICE = (0.30, 2.50)
+
+# Budget states
+WITHIN = "within"
+DOWNGRADE = "downgrade"
+EXHAUSTED = "exhausted"
+
+TOKENS = telemetry.Counter(
+    "clearscript_model_tokens_total", "Gemini tokens by endpoint, model and kind (input/output/image)",
+    ("endpoint", "model", "kind"))
+BUDGET_ROUTING = telemetry.Counter(
+    "clearscript_budget_routing_total", "Model lookups demoted or skipped by the daily token budget",
+    ("model", "state"))
+telemetry.METRICS.extend([TOKENS, BUDGET_ROUTING])
+
+_language = contextvars.ContextVar("usage_language", default="-")
+
+
+def _load_json_env(name, default, convert):
+    values = dict(default)
+    override = os.environ.get(name)
+    if override:
+        try:
+            for model, value in json.loads(override).items():
+                values[model] = convert(value)
+        except Exception as e:
+            print(f"⚠️ Ignoring invalid {name}: {e}")
+    return values
+
+
+PRICES = _load_json_env("MODEL_PRICES", DEFAULT_PRICES, lambda v: (float(v[0]), float(v[1])))
+BUDGETS = _load_json_env("DAILY_TOKEN_BUDGETS", {}, float)
+
+
+def today():
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+class UsageTracker:
+    """In-memory token counts, added to the shared table every flush_seconds
+    by a background thread"""
+
+    def __init__(self, filename, flush_seconds=USAGE_FLUSH_SECONDS):
+        self.db = LocalDB(filename, """
+            CREATE TABLE IF NOT EXISTS usage (
+                day TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                model TEXT NOT NULL,
+                language TEXT NOT NULL,
+                calls INTEGER NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                image_tokens INTEGER NOT NULL,
+                PRIMARY KEY (day, endpoint, model, language)
+            ) WITHOUT ROWID;
+        """)
+        self.flush_seconds = flush_seconds
+        self._pending = {}  # (day, endpoint, model, language) -> [calls, input, output, image]
+        self._stored = {}  # model -> today's tokens in the table, as of the last flush
+        self._stored_day = None
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, model, language, input_tokens, output_tokens, image_tokens):
+        key = (today(), endpoint, model, language)
+        with self._lock:
+            row = self._pending.get(key)
+            if row is None:
+                row = self._pending[key] = [0, 0, 0, 0]
+            row[0] += 1
+            row[1] += input_tokens
+            row[2] += output_tokens
+            row[3] += image_tokens
+            due = time.monotonic() - self._last_flush >= self.flush_seconds
+            if due:
+                self._last_flush = time.monotonic()
+        if due:
+            # The write may wait on other workers' locks: never in the caller (or its event loop)
+            threading.Thread(target=self.flush, name="usage-flush", daemon=True).start()
+
+    def flush(self):
+        """Add pending counts to the table and reload today's per-model totals"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        day = today()
+        conn = self.db.conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("""
+                    INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (day, endpoint, model, language) DO UPDATE SET
+                        calls = calls + excluded.calls,
+                        input_tokens = input_tokens + excluded.input_tokens,
+                        output_tokens = output_tokens + excluded.output_tokens,
+                        image_tokens = image_tokens + excluded.image_tokens
+                """, [key + tuple(row) for key, row in pending.items()])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            stored = dict(conn.execute(
+                "SELECT model, SUM(input_tokens + output_tokens) FROM usage WHERE day = ? GROUP BY model",
+                (day,)).fetchall())
+        except Exception as e:
+            print(f"⚠️ Usage flush failed, keeping counts for the next one: {e}")
+            with self._lock:
+                for key, row in pending.items():
+                    merged = self._pending.setdefault(key, [0, 0, 0, 0])
+                    for i, value in enumerate(row):
+                        merged[i] += value
+            return
+        with self._lock:
+            self._stored, self._stored_day = stored, day
+
+    def day_tokens(self, model):
+        """Today's input + output tokens for `model`: all workers up to the last flush, plus ours since"""
+        day = today()
+        with self._lock:
+            total = self._stored.get(model, 0) if self._stored_day == day else 0
+            for (row_day, _, row_model, _), row in self._pending.items():
+                if row_day == day and row_model == model:
+                    total += row[1] + row[2]
+        return total
+
+    def rows(self, since):
+        self.flush()
+        return self.db.conn().execute("""
+            SELECT day, endpoint, model, language, calls, input_tokens, output_tokens, image_tokens
+            FROM usage WHERE day >= ? ORDER BY day DESC, endpoint, model, language
+        """, (since,)).fetchall()
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker():
+    # Created on first use, i.e. after gunicorn has forked
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = UsageTracker("usage.sqlite3")
+                atexit.register(_tracker.flush)
+    return _tracker
+
+
+# --- Recording ---
+
+@contextlib.contextmanager
+def attribute(language):
+    """Attribute calls made inside the block (and its hedges) to `language`"""
+    token = _language.set(language or "-")
+    try:
+        yield
+    finally:
+        _language.reset(token)
+
+
+def estimate_image_tokens(image):
+    """Estimated tokens for one image part (PIL image or {"mime_type", "data"} blob)"""
+    if isinstance(image, dict):
+        from PIL import Image
+        image = Image.open(io.BytesIO(image["data"]))  # reads the header only
+    width, height = image.size
+    if width <= IMAGE_SMALL_SIDE and height <= IMAGE_SMALL_SIDE:
+        return IMAGE_TILE_TOKENS
+    return math.ceil(width / IMAGE_TILE_SIDE) * math.ceil(height / IMAGE_TILE_SIDE) * IMAGE_TILE_TOKENS
+
+
+def _reported_image_tokens(meta):
+    # Newer API versions break the prompt down by modality
+    details = getattr(meta, "prompt_tokens_details", None)
+    if not details:
+        return None
+    return sum(d.token_count for d in details if "IMAGE" in str(getattr(d, "modality", "")))
+
+
+def record(endpoint, model, response, language=None, image=None):
+    """Account one generate_content answer (tokens are billed even if it can't be parsed)
+    and correct the rate limiter's up-front token estimate with the real count"""
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return
+    try:
+        input_tokens = int(getattr(meta, "prompt_token_count", 0) or 0)
+        # Thinking models bill their thoughts as output
+        output_tokens = int(getattr(meta, "candidates_token_count", 0) or 0)
+        output_tokens += int(getattr(meta, "thoughts_token_count", 0) or 0)
+    except Exception as e:
+        print(f"⚠️ Usage not recorded: {e}")
+        return
+    priority = ratelimit.SCAN if endpoint == "scan" else ratelimit.CHAT
+    ratelimit.settle(model, priority, input_tokens + output_tokens)
+    if not ENABLED:
+        return
+    try:
+        from_images = _reported_image_tokens(meta)
+        if from_images is None:
+            from_images = min(input_tokens, estimate_image_tokens(image)) if image is not None else 0
+
+        get_tracker().add(
+            endpoint, model, language or _language.get(), input_tokens, output_tokens, from_images)
+    except Exception as e:
+        print(f"⚠️ Usage not recorded: {e}")
+        return
+    if telemetry.ENABLED:
+        TOKENS.inc(endpoint, model, "input", amount=input_tokens)
+        TOKENS.inc(endpoint, model, "output", amount=output_tokens)
+        TOKENS.inc(endpoint, model, "image", amount=from_images)
+
+
+# --- Budgets ---
+
+def budget_state(model):
+    budget = BUDGETS.get(model)
+    if not ENABLED or not budget:
+        return WITHIN
+    spent = get_tracker().day_tokens(model) / budget
+    if spent >= 1.0:
+        return EXHAUSTED
+    if spent >= BUDGET_DOWNGRADE_AT:
+        return DOWNGRADE
+    return WITHIN
+
+
+def allows(model):
+    """False once `model` has used up today's budget"""
+    return budget_state(model) != EXHAUSTED
+
+
+def route(models):
+    """
+    `models` in the order to try them today: models near their budget move
+    behind the others (BUDGET_DOWNGRADE_MODEL is added ahead of them), spent
+    ones are left out.
+    """
+    if not BUDGETS or not ENABLED:
+        return list(models)
+    within, downgraded = [], []
+    for model in models:
+        state = budget_state(model)
+        if state == WITHIN:
+            within.append(model)
+        else:
+            telemetry.count(BUDGET_ROUTING, model, state)
+            if state == DOWNGRADE:
+                downgraded.append(model)
+    if downgraded and BUDGET_DOWNGRADE_MODEL not in within and BUDGET_DOWNGRADE_MODEL not in downgraded \
+            and budget_state(BUDGET_DOWNGRADE_MODEL) == WITHIN:
+        within.append(BUDGET_DOWNGRADE_MODEL)
+    routed = within + downgraded
+    if routed != list(models):
+        print(f"💸 Budget routing: {routed}")
+    return routed
+
+
+# --- Summary ---
+
+def cost(model, input_tokens, output_tokens):
+    price_in, price_out = PRICES.get(model, FALLBACK_PRICE)
+    return (input_tokens * price_in + output_tokens * price_out) / 1e6
+
+
+def summary(days=1):
+    """Usage of the last `days` days (today included) for GET /usage"""
+    since = (datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=days - 1)).isoformat()
+    rows = []
+    totals = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "image_tokens": 0, "cost_usd": 0.0}
+    for day, endpoint, model, language, calls, input_tokens, output_tokens, image_tokens in get_tracker().rows(since):
+        row = {
+            "day": day, "endpoint": endpoint, "model": model, "language": language, "calls": calls,
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "image_tokens": image_tokens,
+            "cost_usd": round(cost(model, input_tokens, output_tokens), 6),
+        }
+        rows.append(row)
+        for field in totals:
+            totals[field] += row[field]
+    totals["cost_usd"] = round(totals["cost_usd"], 6)
+
+    budgets = {}
+    for model, budget in BUDGETS.items():
+        spent = get_tracker().day_tokens(model)
+        budgets[model] = {"budget": budget, "used": spent, "state": budget_state(model)}
+    return {"since": since, "totals": totals, "rows": rows, "budgets": budgets}
@@ -0,0 +1,131 @@
+"""
+Warm startup
+The heavy imports in app.py/pipeline.py are lazy, so without this the first
+request after a deploy or dyno wake pays for them. Run before taking traffic:
+
+- gunicorn: when_ready warms the master before workers fork (so the imported
+  modules are shared and frozen with the rest of the app), post_worker_init
+  checks model availability in each worker.
+- asgi.py: on lifespan startup.
+- By hand, to see what each step costs:  python warmup.py [--no-models]
+"""
+
+import io
+import time
+
+from config import get_api_key, WARMUP_CHECK_MODELS
+import telemetry
+
+WARMUP_SECONDS = telemetry.Gauge(
+    "clearscript_warmup_seconds", "Time spent in each startup warmup step", ("step",))
+telemetry.METRICS.append(WARMUP_SECONDS)
+
+MODEL_CHECK_TIMEOUT = 10
+
+
+def import_genai():
+    import google.generativeai  # noqa: F401
+
+
+def import_tts():
+    import tts
+    if any(backend.name == "gtts" for backend in tts.BACKENDS):
+        import gtts  # noqa: F401
+
+
+def load_pil_codecs():
+    """Register every PIL plugin and run one decode per upload format"""
+    from PIL import Image, ImageOps
+    Image.init()
+    for fmt in ("JPEG", "WEBP", "PNG"):
+        buf = io.BytesIO()
+        Image.new("RGB", (16, 16)).save(buf, fmt)
+        buf.seek(0)
+        img = Image.open(buf)
+        img.draft("RGB", (8, 8))
+        ImageOps.exif_transpose(img).load()
+
+
+def compile_templates():
+    from app import app
+    for name in ("index.html", "language.html", "_results.html"):
+        app.jinja_env.get_template(name)
+
+
+# Order matters only for the report: each step is timed on its own
+STEPS = [
+    ("google.generativeai", import_genai),
+    ("tts", import_tts),
+    ("pil_codecs", load_pil_codecs),
+    ("templates", compile_templates),
+]
+
+
+def check_models():
+    """Warn about configured models the API key can't use. Returns a short status."""
+    api_key = get_api_key()
+    if not api_key:
+        return "skipped (no API key)"
+
+    import google.generativeai as genai
+    from pipeline import configure_genai, SCAN_MODELS
+    from app import CHAT_MODELS
+
+    configure_genai(genai, api_key)
+    available = {
+        m.name.split("/", 1)[-1]
+        for m in genai.list_models(request_options={"timeout": MODEL_CHECK_TIMEOUT})
+        if "generateContent" in m.supported_generation_methods
+    }
+    missing = [m for m in dict.fromkeys(SCAN_MODELS + CHAT_MODELS) if m not in available]
+    for model in missing:
+        print(f"⚠️ Warmup: {model} is not available for this API key")
+    return f"{len(missing)} configured model(s) missing" if missing else "all models available"
+
+
+def _timed(name, fn, report):
+    started = time.perf_counter()
+    try:
+        status = fn() or "ok"
+    except Exception as e:
+        status = f"failed: {e}"
+    elapsed = time.perf_counter() - started
+    WARMUP_SECONDS.inc(name, amount=elapsed)
+    report.append((name, elapsed, status))
+
+
+def print_report(report, title):
+    print(f"🔥 {title}")
+    for name, elapsed, status in report:
+        print(f"   {name:<22} {elapsed * 1000:8.1f} ms  {status}")
+    print(f"   {'total':<22} {sum(r[1] for r in report) * 1000:8.1f} ms")
+
+
+def warm_up(check_models_too=False):
+    """Run the warmup steps; returns [(step, seconds, status)]"""
+    report = []
+    for name, fn in STEPS:
+        _timed(name, fn, report)
+    if check_models_too and WARMUP_CHECK_MODELS:
+        _timed("list_models", check_models, report)
+    print_report(report, "Warmup")
+    return report
+
+
+def warm_worker():
+    """Per-process part: the model check (network clients must not cross a fork)"""
+    if not WARMUP_CHECK_MODELS:
+        return []
+    report = []
+    _timed("list_models", check_models, report)
+    print_report(report, "Worker warmup")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the startup warmup and show what each step costs")
+    parser.add_argument("--no-models", action="store_true", help="skip the list_models check")
+    args = parser.parse_args()
+    warm_up(check_models_too=not args.no_models)